@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# compare the native out-db raster encoder with raster2pgsql -R
+#
+# writes small GeoTIFFs covering the header variants the encoder has to get
+# right (strips and tiles, integer and float pixels, with and without nodata,
+# nodata nan or out of the pixel range, pixel-is-point, projected, several
+# bands) and compares raster_od.get_raster_od_hex with the hex raster2pgsql -R
+# writes for the same file.
+#
+#   ./benchmarks/check_raster2pgsql.py
+#   ./benchmarks/check_raster2pgsql.py --record raster2pgsql_hex.json
+#   ./benchmarks/check_raster2pgsql.py --expected raster2pgsql_hex.json
+#
+# --record saves the raster2pgsql output of every case, --expected checks the
+# encoder against such a file on a host without raster2pgsql. recorded hex
+# leaves out the file paths, which depend on where the files were written.
+# exit status 0 when everything matches, 1 on a difference, 2 when there is
+# nothing to compare with.
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import numpy as np
+
+import raster_od
+import synth_viirs
+
+
+# case -> (numpy dtype, bands, write_geotiff keyword arguments)
+CASES = {
+    'strip_byte': ('uint8', 1, {}),
+    'strip_byte_nodata': ('uint8', 1, {'nodata': 0}),
+    'strip_byte_nodata_below_range': ('uint8', 1, {'nodata': '-9999'}),
+    'strip_byte_nodata_above_range': ('uint8', 1, {'nodata': '300'}),
+    'strip_int8_nodata': ('int8', 1, {'nodata': -128}),
+    'strip_int16_nodata_nan': ('int16', 1, {'nodata': 'nan'}),
+    'strip_int32_nodata_fraction': ('int32', 1, {'nodata': '-1.7'}),
+    'tile_int16_nodata': ('int16', 1, {'nodata': -1, 'tile': 16, 'deflate': True}),
+    'tile_uint32': ('uint32', 1, {'tile': 32, 'deflate': True}),
+    'tile_uint16_bands_nodata': ('uint16', 3, {'nodata': 65535, 'tile': 16}),
+    'strip_float32': ('float32', 1, {}),
+    'strip_float32_nodata': ('float32', 1, {'nodata': -999.25}),
+    'strip_float32_nodata_nan': ('float32', 1, {'nodata': 'nan'}),
+    'strip_float32_nodata_above_range': ('float32', 1, {'nodata': '1e40'}),
+    'tile_float64_nodata': ('float64', 2, {'nodata': '-1e300', 'tile': 16}),
+    'strip_float32_pixel_is_point': ('float32', 1, {'nodata': 0, 'pixel_is_point': True}),
+    'tile_int16_pixel_is_point_utm': ('int16', 1, {'tile': 16, 'pixel_is_point': True, 'epsg': 32633,
+                                                   'ulx': 500000.0, 'uly': 4649776.0, 'res': 30.0}),
+}
+
+SIZE = (37, 45)
+
+
+def write_cases(out_dir):
+    # case -> path of its GeoTIFF
+
+    paths = {}
+    for name, (dtype, bands, kwargs) in sorted(CASES.items()):
+        data = (np.arange(bands * SIZE[0] * SIZE[1]) % 97).reshape((bands,) + SIZE).astype(dtype)
+        paths[name] = synth_viirs.write_geotiff(os.path.join(out_dir, name + '.tif'), data, **kwargs)
+    return paths
+
+
+def raster2pgsql_hex(path):
+    # hex of the out-db raster in the INSERT raster2pgsql -R writes, as ImportToDB reads it
+
+    out = subprocess.run(['raster2pgsql', '-R', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         check=True).stdout.decode('utf-8', 'replace')
+    rem = re.search("'([0-9A-F]{20,})'", out)
+    if rem is None:
+        raise ValueError('No raster in raster2pgsql output for %s' % path)
+    return rem.group(1)
+
+
+def without_paths(hexstr):
+    # header and band flags, nodata and numbers of an out-db raster hex, the paths left empty
+
+    header, bands = raster_od.split_out_db(bytes.fromhex(hexstr))
+    return raster_od.join_out_db(header, [(head, bandnum, '') for head, bandnum, _ in bands]).hex().upper()
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Compare the native out-db raster encoder with raster2pgsql -R.')
+    parser.add_argument('--record', default=None, help='save the raster2pgsql hex of every case to this file')
+    parser.add_argument('--expected', default=None, help='compare with hex saved by --record, without raster2pgsql')
+    parser.add_argument('--data-dir', default=None, help='write and keep the GeoTIFFs in this directory')
+    args = parser.parse_args(argv)
+
+    if args.expected is None and shutil.which('raster2pgsql') is None:
+        print('raster2pgsql not found, use --expected with hex recorded where it is installed')
+        return 2
+
+    expected = None
+    if args.expected is not None:
+        with open(args.expected) as f:
+            expected = json.load(f)
+
+    out_dir = args.data_dir or tempfile.mkdtemp(prefix='check_raster2pgsql_')
+    os.makedirs(out_dir, exist_ok=True)
+    try:
+        paths = write_cases(out_dir)
+        recorded = {}
+        failed = 0
+        for name, path in sorted(paths.items()):
+            native = raster_od.get_raster_od_hex(path)
+            if expected is not None:
+                if name not in expected:
+                    print('SKIP %s: not recorded' % name)
+                    continue
+                want, got = expected[name], without_paths(native)
+            else:
+                want, got = raster2pgsql_hex(path), native
+                recorded[name] = without_paths(want)
+            if want == got:
+                print('MATCH %s' % name)
+            else:
+                failed += 1
+                print('DIFF %s\n  raster2pgsql %s\n  native       %s' % (name, want, got))
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    if args.record is not None:
+        with open(args.record, 'w') as f:
+            json.dump(recorded, f, indent=1, sort_keys=True)
+            f.write('\n')
+
+    print('%d of %d cases differ' % (failed, len(paths)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
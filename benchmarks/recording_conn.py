@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# stand-in for a psycopg2 connection, for benchmarks without a database
+#
+# statements are recorded instead of executed and answered with plausible
+# results, enough for ImportToDB to run every stage of a new file:
+#   leap second check   -> a fresh "modified" date, no update needed
+#   SELECT h5id/rastid  -> nothing found
+#   gid resolution      -> a new gid per name
+#   INSERT ... RETURNING -> a new id
+#   column types        -> the array tables of the ingest schema
+#   COPY ... FROM STDIN -> the data is read and counted
+
+import datetime
+import itertools
+
+from psycopg2 import sql
+
+
+# table -> [(column, type oid, element oid)], as pg_binary.column_types reads them
+ARRAY_TABLES = {
+    'midtime': [('h5id', 23, 0), ('val', 1016, 20)],
+    'qf3_scan_rdr': [('h5id', 23, 0), ('val', 1005, 21)],
+    'radiance_factor': [('h5id', 23, 0), ('val', 1021, 700)],
+    'solar_zenith': [('h5id', 23, 0), ('val', 1021, 700)],
+}
+
+
+def query_text(query):
+    # sql.Composable -> plain text without needing a live connection
+
+    if isinstance(query, sql.Composed):
+        return ''.join(query_text(i) for i in query.seq)
+    if isinstance(query, sql.SQL):
+        return query.string
+    if isinstance(query, sql.Identifier):
+        return '.'.join('"%s"' % i for i in query.strings)
+    if isinstance(query, sql.Literal):
+        return repr(query.wrapped)
+    if isinstance(query, sql.Placeholder):
+        return '%s' if query.name is None else '%%(%s)s' % query.name
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    return query
+
+
+def param_bytes(params):
+    # rough size of the parameters sent with a statement
+
+    if params is None:
+        return 0
+    if isinstance(params, dict):
+        params = params.values()
+    total = 0
+    for val in params:
+        if isinstance(val, (bytes, bytearray, memoryview)):
+            total += len(val)
+        elif isinstance(val, (list, tuple)):
+            total += param_bytes(val)
+        else:
+            total += len(str(val))
+    return total
+
+
+class RecordingCursor:
+
+    def __init__(self, conn):
+
+        self.conn = conn
+        self.connection = conn
+        self._result = []
+        self.rowcount = -1
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def execute(self, query, params=None):
+
+        text = query_text(query)
+        self.conn.record(text, params)
+        self._result = self.conn.answer(text, params)
+        self.rowcount = len(self._result)
+
+    def executemany(self, query, seq):
+
+        for params in seq:
+            self.execute(query, params)
+
+    def copy_expert(self, query, file, size=8192):
+
+        text = query_text(query)
+        data = file.read() if 'FROM STDIN' in text.upper() else b''
+        self.conn.record(text, [data])
+        self._result = []
+        self.rowcount = 1
+
+    def fetchone(self):
+
+        if len(self._result) == 0:
+            return None
+        return self._result.pop(0)
+
+    def fetchall(self):
+
+        result, self._result = self._result, []
+        return result
+
+    def close(self):
+        self.closed = True
+
+
+class RecordingConnection:
+
+    def __init__(self):
+
+        self.closed = 0
+        self.queries = []  # (statement kind, parameter bytes)
+        self.commits = 0
+        self.rollbacks = 0
+        self._ids = itertools.count(1)
+
+    def get_dsn_parameters(self):
+        return {'host': 'recording', 'port': '0', 'dbname': 'recording-%s' % id(self)}
+
+    def cursor(self, name=None, cursor_factory=None):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+    def record(self, text, params):
+        self.queries.append((text.split(None, 1)[0].upper() if text.strip() else '', param_bytes(params)))
+
+    def answer(self, text, params):
+
+        if 'pg_attribute' in text:
+            return [tuple(i) for i in ARRAY_TABLES.get(params[0], [])]
+        if 'SELECT modified FROM' in text:
+            return [(datetime.datetime.now(),)]
+        if 'unnest(' in text:
+            # gid resolution: every name is new
+            return [(gname, next(self._ids), True) for gname in sorted(set(params[0]))]
+        if 'RETURNING' in text:
+            return [(next(self._ids),)]
+        return []
+
+    def summary(self):
+
+        kinds = {}
+        for kind, nbytes in self.queries:
+            count, total = kinds.get(kind, (0, 0))
+            kinds[kind] = (count + 1, total + nbytes)
+        return {
+            'queries': len(self.queries),
+            'param_bytes': sum(i[1] for i in self.queries),
+            'commits': self.commits,
+            'rollbacks': self.rollbacks,
+            'by_kind': {kind: {'count': c, 'param_bytes': b} for kind, (c, b) in sorted(kinds.items())},
+        }
+
+
+class RollbackConnection:
+    # real connection whose commits are rolled back, so a benchmark can insert the same file repeatedly
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.commits = 0
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def commit(self):
+        self.commits += 1
+        self._conn.rollback()
+
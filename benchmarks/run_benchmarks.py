@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+# ingest benchmarks on synthetic files
+#
+# times InfoFile.parse_file (eager and lazy), the footprint builders, the
+# native out-db raster encoder and every ImportToDB stage. without --server
+# the import runs against a recording stand-in connection; with --server the
+# statements go to that database and every commit is rolled back.
+#
+#   ./benchmarks/run_benchmarks.py --out bench.json
+#   ./benchmarks/run_benchmarks.py --server local --granules 1 4 --scale 1 --repeat 5
+#
+# the output is one JSON document: run metadata and a list of results with
+# min/median/mean seconds per benchmark and file, to compare across versions.
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import pickle
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import h5py
+import numpy as np
+
+from parse_file import InfoFile
+from import_to_db import DBInfo, ImportToDB
+from gid_resolver import GidResolver
+from leap_second import LeapSecondManager
+import footprint
+import raster_od
+import pg_binary
+from psycopg2.extensions import adapt
+import synth_viirs
+from recording_conn import RecordingConnection, RollbackConnection
+
+
+# ImportToDB methods timed as stages, in import order
+STAGES = (
+    '_update_leap_second', '_ask_h5id', '_ask_rastid', '_insert_granule_info',
+    '_insert_file_hdf5_info', '_insert_file_raster_info', '_make_gring_info', '_get_raster_od_hex',
+    '_insert_midtime', '_insert_qf3_scan_rdr', '_insert_radiance_factor',
+    '_insert_gring_ncei', '_make_gring_ncei', '_insert_solz',
+)
+
+
+def measure(fn, repeat):
+    # seconds of each of repeat calls, fn gets the repetition number
+
+    times = []
+    for n in range(repeat):
+        start = time.perf_counter()
+        fn(n)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def result(name, path, times, **extra):
+
+    row = {
+        'name': name,
+        'file': os.path.basename(path) if path is not None else None,
+        'repeat': len(times),
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+    }
+    row.update(extra)
+    return row
+
+
+@contextlib.contextmanager
+def quiet():
+    # the ingest code prints progress for every file
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def stage_timer(stages):
+    # wrap ImportToDB stage methods; stages collects {name: [seconds, ...]}
+
+    originals = {}
+
+    def wrap(name, method):
+        def timed(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                stages.setdefault(name, []).append(time.perf_counter() - start)
+        return timed
+
+    for name in STAGES:
+        originals[name] = getattr(ImportToDB, name)
+        setattr(ImportToDB, name, wrap(name, originals[name]))
+    try:
+        yield stages
+    finally:
+        for name, method in originals.items():
+            setattr(ImportToDB, name, method)
+
+
+def parse_closed(path):
+    # lazily parsed InfoFile with the file closed, as handed to the writers in batch mode
+
+    with InfoFile(lazy=True) as finfo:
+        finfo.parse_file(path)
+    return finfo
+
+
+def bench_parse(paths, repeat):
+
+    rows = []
+    for path in paths:
+        for lazy in (False, True):
+            def run(_):
+                finfo = InfoFile(lazy=lazy)
+                finfo.parse_file(path)
+                finfo.close()
+            with quiet():
+                times = measure(run, repeat)
+            rows.append(result('parse.%s' % ('lazy' if lazy else 'eager'), path, times,
+                               bytes=os.path.getsize(path)))
+    return rows
+
+
+def bench_footprints(paths, repeat):
+
+    rows = []
+    for path in paths:
+        if not path.endswith('.h5'):
+            with quiet():
+                rows.append(result('raster.out_db_wkb', path, measure(lambda _: raster_od.out_db_wkb(path), repeat)))
+            continue
+        with quiet():
+            finfo = parse_closed(path)
+        rows.append(result('footprint.gring_ewkb', path,
+                           measure(lambda _: footprint.gring_ewkb(finfo.gring, finfo.ngranule), repeat),
+                           granules=finfo.ngranule))
+        if not finfo.is_geo:
+            continue
+        with h5py.File(path, 'r') as h5f:
+            lat = h5f[[k for k in finfo.content_list if k.endswith('/Latitude')][0]]
+            lon = h5f[[k for k in finfo.content_list if k.endswith('/Longitude')][0]]
+            rows.append(result('footprint.read_ncei_edge', path,
+                               measure(lambda _: footprint.read_ncei_edge(lat, lon, finfo.ngranule), repeat),
+                               granules=finfo.ngranule))
+            # the full grid read the edge extraction replaced
+            rows.append(result('footprint.read_full_grids', path,
+                               measure(lambda _: (lat[()], lon[()]), repeat), granules=finfo.ngranule))
+        rows.append(result('footprint.polygon_ewkb', path,
+                           measure(lambda _: footprint.polygon_ewkb(*finfo.ncei_edge), repeat),
+                           vertices=len(finfo.ncei_edge[0])))
+    return rows
+
+
+def bench_arrays(granules, repeat):
+    # midtime of aggregated files: text array literal (tolist + adapt) vs binary COPY stream
+
+    rows = []
+    for ngranule in sorted(set(granules) | {100}):
+        val = 1861920000000000 + np.arange(synth_viirs.SCANS_PER_GRANULE * ngranule, dtype=np.uint64) * 1778000
+        text_len = len(adapt(val.tolist()).getquoted())
+        rows.append(result('arrays.text', None, measure(lambda _: adapt(val.tolist()).getquoted(), repeat),
+                           elements=len(val), bytes=text_len))
+        binary_len = len(pg_binary.copy_stream([(1, val)], [(23, 0), (1016, 20)]).getvalue())
+        rows.append(result('arrays.binary', None,
+                           measure(lambda _: pg_binary.copy_stream([(1, val)], [(23, 0), (1016, 20)]), repeat),
+                           elements=len(val), bytes=binary_len))
+    return rows
+
+
+def bench_import(paths, repeat, server=None, array_encoding='binary'):
+
+    rows = []
+    real = None
+    if server is not None:
+        real = DBInfo().make_con(server)
+        # bring the leap second table up to date for real, the timed runs only check it
+        with quiet():
+            LeapSecondManager().ensure(real)
+    try:
+        for path in paths:
+            with quiet():
+                template = pickle.dumps(parse_closed(path))
+            stages = {}
+            totals = []
+            recorded = None
+            for n in range(repeat):
+                # fresh InfoFile and caches each time, so footprints and gids are built again
+                finfo = pickle.loads(template)
+                if real is None:
+                    conn = recorded = RecordingConnection()
+                else:
+                    conn = RollbackConnection(real)
+                LeapSecondManager.reset()
+                with stage_timer(stages), quiet():
+                    start = time.perf_counter()
+                    ImportToDB(path, finfo=finfo, conn=conn, raster_encoder='native', gid_resolver=GidResolver(),
+                               array_encoding=array_encoding)
+                    totals.append(time.perf_counter() - start)
+            extra = {'db': recorded.summary()} if recorded is not None else {}
+            rows.append(result('import.total', path, totals, **extra))
+            for name in STAGES:
+                if name in stages:
+                    rows.append(result('import.%s' % name.strip('_'), path, stages[name]))
+    finally:
+        if real is not None:
+            real.rollback()
+            real.close()
+    return rows
+
+
+def git_revision():
+
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(HERE),
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        return out.stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark parsing, footprints and import on synthetic files.')
+    parser.add_argument('--out', default=None, help='write the JSON results here instead of stdout')
+    parser.add_argument('--data-dir', default=None, help='reuse or keep the synthetic files in this directory')
+    parser.add_argument('--granules', type=int, nargs='+', default=[1, 4], help='aggregation levels')
+    parser.add_argument('--scale', type=float, default=0.25, help='fraction of the full granule size')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--server', default=None, help='DBInfo server for the import; default is a recording stand-in')
+    parser.add_argument('--array-encoding', choices=['binary', 'text'], default='binary',
+                        help='how the import sends midtime/qf3/radiance factor/solz arrays')
+    parser.add_argument('--only', nargs='+', choices=['parse', 'footprint', 'arrays', 'import'],
+                        default=['parse', 'footprint', 'arrays', 'import'])
+    args = parser.parse_args(argv)
+
+    tmp = None
+    data_dir = args.data_dir
+    if data_dir is None:
+        tmp = tempfile.TemporaryDirectory(prefix='viirs_bench_')
+        data_dir = tmp.name
+    try:
+        start = time.perf_counter()
+        paths = synth_viirs.write_set(data_dir, args.granules, args.scale)
+        setup = time.perf_counter() - start
+
+        rows = []
+        if 'parse' in args.only:
+            rows += bench_parse([i for i in paths if i.endswith('.h5')], args.repeat)
+        if 'footprint' in args.only:
+            rows += bench_footprints(paths, args.repeat)
+        if 'arrays' in args.only:
+            rows += bench_arrays(args.granules, args.repeat)
+        if 'import' in args.only:
+            rows += bench_import(paths, args.repeat, args.server, args.array_encoding)
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    report = {
+        'created': datetime.datetime.now().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'h5py': h5py.__version__,
+        'hdf5': h5py.version.hdf5_version,
+        'platform': platform.platform(),
+        'params': {'granules': args.granules, 'scale': args.scale, 'repeat': args.repeat,
+                   'db': args.server or 'recording', 'array_encoding': args.array_encoding},
+        'setup_seconds': setup,
+        'results': rows,
+    }
+    text = json.dumps(report, indent=1)
+    if args.out is None:
+        print(text)
+    else:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+        print('%s results written to %s' % (len(rows), args.out))
+
+
+if __name__ == '__main__':
+    main()
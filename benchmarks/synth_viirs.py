@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# synthetic VIIRS SDR/GEO HDF5 files and small GeoTIFFs for benchmarking
+#
+# the HDF5 layout follows the NOAA files the ingest reads:
+#
+#   /All_Data/VIIRS-DNB-GEO_All/{Latitude,Longitude,SolarZenithAngle,MidTime,NumberOfScans}
+#   /Data_Products/VIIRS-DNB-GEO/VIIRS-DNB-GEO_Aggr
+#   /Data_Products/VIIRS-DNB-GEO/VIIRS-DNB-GEO_Gran_N   G-Ring_Latitude/Longitude, Ascending/Descending_Indicator
+#
+# SDR files carry N_GEO_Ref and Radiance/QF3_SCAN_RDR (and RadianceFactors for
+# M bands); an aggregated file has one _Gran_N object per granule.
+#
+#   ./synth_viirs.py /tmp/synth --granules 1 4 --scale 0.25
+
+import argparse
+import datetime
+import os
+import struct
+import zlib
+
+import h5py
+import numpy as np
+
+
+# file type -> (product, is geolocation, columns of a full size granule)
+PRODUCTS = {
+    'GDNBO': ('VIIRS-DNB-GEO', True, 4064),
+    'SVDNB': ('VIIRS-DNB-SDR', False, 4064),
+    'GMTCO': ('VIIRS-MOD-GEO-TC', True, 3200),
+    'SVM07': ('VIIRS-M7-SDR', False, 3200),
+    'SVM15': ('VIIRS-M15-SDR', False, 3200),
+}
+# geolocation file of each SDR file type
+GEO_OF = {'SVDNB': 'GDNBO', 'SVM07': 'GMTCO', 'SVM15': 'GMTCO'}
+
+ROWS_PER_GRANULE = 768
+SCANS_PER_GRANULE = 48
+GRANULE_SECONDS = 85.35
+FILL = -999.3
+CHUNK_ROWS = 64
+
+
+def viirs_name(ftype, dt_start, ngranule=1, orbit=37000, space_craft='npp'):
+    # NOAA style file name for ngranule granules starting at dt_start
+
+    dt_end = dt_start + datetime.timedelta(seconds=GRANULE_SECONDS * ngranule)
+    return '%s_%s_d%s_t%s%d_e%s%d_b%05d_c%s_noac_ops.h5' % (
+        ftype, space_craft, dt_start.strftime('%Y%m%d'),
+        dt_start.strftime('%H%M%S'), dt_start.microsecond // 100000,
+        dt_end.strftime('%H%M%S'), dt_end.microsecond // 100000,
+        orbit, (dt_start + datetime.timedelta(hours=1)).strftime('%Y%m%d%H%M%S%f'))
+
+
+def swath(rows, cols, lat0=10.0, lon0=100.0):
+    # lat/lon grid of a slightly skewed descending swath, float32
+
+    row = np.arange(rows, dtype=np.float64)[:, None]
+    col = np.arange(cols, dtype=np.float64)[None, :]
+    lat = lat0 + row * (20.0 / rows) + col * (1.0 / cols)
+    lon = lon0 + col * (30.0 / cols) + row * (2.0 / rows)
+    return lat.astype(np.float32), lon.astype(np.float32)
+
+
+def write_h5(path, ftype, ngranule=1, scale=1.0, seed=0):
+    # one VIIRS HDF5 file, scale shrinks the rows and columns of every granule
+
+    product, is_geo, full_cols = PRODUCTS[ftype]
+    rows_per_granule = max(16, int(ROWS_PER_GRANULE * scale))
+    cols = max(16, int(full_cols * scale))
+    rows = rows_per_granule * ngranule
+    nscan = SCANS_PER_GRANULE * ngranule
+    chunks = (min(CHUNK_ROWS, rows), cols)
+    rng = np.random.default_rng(seed)
+    lat, lon = swath(rows, cols)
+
+    with h5py.File(path, 'w') as f:
+        if is_geo:
+            data = f.create_group('All_Data/%s_All' % product)
+            # the first scan lines of real granules are often fill
+            lat[:2, :] = FILL
+            lon[:2, :] = FILL
+            data.create_dataset('Latitude', data=lat, chunks=chunks)
+            data.create_dataset('Longitude', data=lon, chunks=chunks)
+            solz = rng.uniform(0, 180, size=(rows, cols)).astype(np.float32)
+            solz[:2, :] = FILL
+            data.create_dataset('SolarZenithAngle', data=solz, chunks=chunks)
+            midtime = 1861920000000000 + np.arange(nscan, dtype=np.uint64) * 1778000
+            data.create_dataset('MidTime', data=midtime)
+        else:
+            f.attrs['N_GEO_Ref'] = np.bytes_(viirs_name(GEO_OF[ftype], datetime.datetime(2019, 1, 1), ngranule))
+            data = f.create_group('All_Data/%s_All' % product)
+            radiance = rng.random((rows, cols), dtype=np.float32)
+            data.create_dataset('Radiance', data=radiance, chunks=chunks)
+            data.create_dataset('QF3_SCAN_RDR', data=np.zeros(nscan, dtype=np.uint8))
+            if ftype.startswith('SVM'):
+                data.create_dataset('RadianceFactors', data=np.tile(np.array([1.0, 0.0], dtype=np.float32), ngranule))
+        data.create_dataset('NumberOfScans', data=np.full(ngranule, SCANS_PER_GRANULE, dtype=np.int32))
+
+        products = f.create_group('Data_Products/%s' % product)
+        products.create_dataset('%s_Aggr' % product, data=np.zeros(1, dtype=np.uint8))
+        for n in range(ngranule):
+            gran = products.create_dataset('%s_Gran_%d' % (product, n), data=np.zeros(1, dtype=np.uint8))
+            first = n * rows_per_granule + (2 if n == 0 else 0)
+            last = (n + 1) * rows_per_granule - 1
+            # corners of the granule, clockwise, as (n, 1) float32 like the NOAA files
+            ring_lat = [lat[first, 0], lat[first, -1], lat[last, -1], lat[last, 0]]
+            ring_lon = [lon[first, 0], lon[first, -1], lon[last, -1], lon[last, 0]]
+            gran.attrs['G-Ring_Latitude'] = np.array(ring_lat, dtype=np.float32)[:, None]
+            gran.attrs['G-Ring_Longitude'] = np.array(ring_lon, dtype=np.float32)[:, None]
+            gran.attrs['Ascending/Descending_Indicator'] = np.array([[1]], dtype=np.int32)
+
+    return path
+
+
+# numpy dtype -> tiff (sample format, bits per sample)
+TIFF_SAMPLE = {
+    np.dtype('uint8'): (1, 8), np.dtype('int8'): (2, 8),
+    np.dtype('uint16'): (1, 16), np.dtype('int16'): (2, 16),
+    np.dtype('uint32'): (1, 32), np.dtype('int32'): (2, 32),
+    np.dtype('float32'): (3, 32), np.dtype('float64'): (3, 64),
+}
+
+
+def _tiff_entry(tag, ftype, values, extra, extra_base):
+    # 12 byte IFD entry; values over 4 bytes go to the extra data block
+
+    fmt = {2: 's', 3: 'H', 4: 'I', 12: 'd'}[ftype]
+    if ftype == 2:
+        raw = values.encode('ascii') + b'\0'
+        count = len(raw)
+    else:
+        raw = struct.pack('<%d%s' % (len(values), fmt), *values)
+        count = len(values)
+    if len(raw) <= 4:
+        return struct.pack('<HHI', tag, ftype, count) + raw.ljust(4, b'\0')
+    offset = extra_base + len(extra)
+    extra.extend(raw)
+    if len(extra) % 2:
+        extra.append(0)
+    return struct.pack('<HHII', tag, ftype, count, offset)
+
+
+def write_geotiff(path, data, ulx=100.0, uly=30.0, res=1.0 / 240, epsg=4326, nodata=None,
+                  deflate=False, tile=None, rows_per_strip=16, pixel_is_point=False):
+    # minimal little endian GeoTIFF, (bands, rows, cols) or (rows, cols), pixel interleaved
+    # strips by default, square tiles of size tile otherwise; deflate compresses each block
+    # a nodata string is written to GDAL_NODATA as is, e.g. 'nan' or a value out of the pixel range
+
+    data = np.asarray(data)
+    if data.ndim == 2:
+        data = data[None]
+    bands, height, width = data.shape
+    sample_format, bits = TIFF_SAMPLE[data.dtype]
+    pixels = np.ascontiguousarray(np.moveaxis(data, 0, -1)).astype(data.dtype.newbyteorder('<'))
+
+    blocks = []
+    if tile is None:
+        for top in range(0, height, rows_per_strip):
+            blocks.append(pixels[top:top + rows_per_strip].tobytes())
+    else:
+        for top in range(0, height, tile):
+            for left in range(0, width, tile):
+                block = np.zeros((tile, tile, bands), dtype=pixels.dtype)
+                part = pixels[top:top + tile, left:left + tile]
+                block[:part.shape[0], :part.shape[1]] = part
+                blocks.append(block.tobytes())
+    if deflate:
+        blocks = [zlib.compress(block) for block in blocks]
+
+    body = bytearray()
+    offsets = []
+    for block in blocks:
+        offsets.append(8 + len(body))
+        body.extend(block)
+        if len(body) % 2:
+            body.append(0)
+
+    geo_type = (3072, 0, 1, epsg) if epsg not in (4326, 4269, 4267) else (2048, 0, 1, epsg)
+    model_type = 1 if geo_type[0] == 3072 else 2
+    geo_keys = (1, 1, 0, 3, 1024, 0, 1, model_type, 1025, 0, 1, 2 if pixel_is_point else 1) + geo_type
+
+    tags = [
+        (256, 4, [width]), (257, 4, [height]), (258, 3, [bits] * bands), (259, 3, [8 if deflate else 1]),
+        (262, 3, [1]), (277, 3, [bands]), (284, 3, [1]), (339, 3, [sample_format] * bands),
+        (33550, 12, [res, res, 0.0]), (33922, 12, [0.0, 0.0, 0.0, ulx, uly, 0.0]), (34735, 3, list(geo_keys)),
+    ]
+    if tile is None:
+        tags += [(273, 4, offsets), (278, 4, [rows_per_strip]), (279, 4, [len(i) for i in blocks])]
+    else:
+        tags += [(322, 3, [tile]), (323, 3, [tile]), (324, 4, offsets), (325, 4, [len(i) for i in blocks])]
+    if isinstance(nodata, str):
+        tags.append((42113, 2, nodata))
+    elif nodata is not None:
+        tags.append((42113, 2, repr(float(nodata)) if data.dtype.kind == 'f' else str(int(nodata))))
+    tags.sort()
+
+    extra_base = 8 + len(body)
+    extra = bytearray()
+    entries = [_tiff_entry(tag, ftype, values, extra, extra_base) for tag, ftype, values in tags]
+    ifd_offset = extra_base + len(extra)
+
+    with open(path, 'wb') as f:
+        f.write(b'II' + struct.pack('<HI', 42, ifd_offset))
+        f.write(body)
+        f.write(extra)
+        f.write(struct.pack('<H', len(entries)) + b''.join(entries) + struct.pack('<I', 0))
+
+    return path
+
+
+def write_set(out_dir, granules=(1, 4), scale=0.25, tif_size=512):
+    # GEO and SDR files for each aggregation level plus derived GeoTIFFs; returns the paths
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    start = datetime.datetime(2019, 1, 1)
+    for n, ngranule in enumerate(granules):
+        dt_start = start + datetime.timedelta(hours=n)
+        for ftype in ('GDNBO', 'SVDNB', 'GMTCO', 'SVM07'):
+            path = os.path.join(out_dir, viirs_name(ftype, dt_start, ngranule))
+            paths.append(write_h5(path, ftype, ngranule, scale, seed=n))
+
+    base = os.path.join(out_dir, viirs_name('SVDNB', start, 1)[:-3])
+    rows = np.arange(tif_size * tif_size).reshape(tif_size, tif_size)
+    paths.append(write_geotiff(base + '.rade9.tif', (rows % 251).astype(np.float32), nodata=FILL))
+    paths.append(write_geotiff(base + '.vflag.tif', (rows % 7).astype(np.uint32), deflate=True))
+    paths.append(write_geotiff(base + '.lines.tif', (rows // tif_size).astype(np.int16), nodata=-1,
+                               tile=256, deflate=True))
+
+    return paths
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Write synthetic VIIRS HDF5 and GeoTIFF files.')
+    parser.add_argument('out_dir')
+    parser.add_argument('--granules', type=int, nargs='+', default=[1, 4], help='aggregation levels')
+    parser.add_argument('--scale', type=float, default=0.25, help='fraction of the full granule size')
+    parser.add_argument('--tif-size', type=int, default=512)
+    args = parser.parse_args(argv)
+
+    for path in write_set(args.out_dir, args.granules, args.scale, args.tif_size):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
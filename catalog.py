@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+# read side of the ingest tables: find files by area, time and product
+#
+#   cat = Catalog('eogdev')
+#   for row in cat.hdf5_files(bbox=(-106, 39, -104, 41), start=datetime(2019, 1, 1),
+#                             end=datetime(2020, 1, 1), ftype='SVDNB', desc_indicator=True):
+#       print(row.fname, row.dt_start, row.link)
+#   cat.close()
+#
+#   ./catalog.py --server eogdev --bbox -106 39 -104 41 --start 2019-01-01 --end 2020-01-01 --ftype SVDNB
+#
+# every query is parameterized and shaped for the indexes in INDEXES: the time
+# window is a range on dt_start (bounded by max_span, the longest file) and the
+# area goes through ST_Intersects on the GiST indexed gring. rows are streamed
+# from a named (server-side) cursor batch_size rows at a time, so coverage
+# queries over years of granules run in constant client memory.
+
+import argparse
+import datetime
+import sys
+
+from psycopg2 import sql
+from psycopg2.extras import NamedTupleCursor
+
+from import_to_db import DBInfo
+from footprint import SRID, polygon_ewkb
+from tools import randomword
+
+
+BATCH_SIZE = 2000
+
+# longest time a file covers; the time window becomes a dt_start range this much wider,
+# None scans every file that starts before the end of the window
+MAX_SPAN = datetime.timedelta(days=1)
+
+HDF5_COLUMNS = ('h5id', 'fname', 'ftype', 'space_craft', 'dt_start', 'dt_end', 'dt_create', 'orbit', 'source',
+                'state', 'space', 'nscan', 'ngranule', 'geolocation', 'desc_indicator', 'gid', 'link')
+RASTER_COLUMNS = ('rastid', 'fname', 'ftype', 'space_craft', 'dt_start', 'dt_end', 'dt_create', 'orbit', 'source',
+                  'state', 'space', 'geolocation', 'gid', 'link', 'content')
+
+# (name, table, method and columns) of the indexes the queries are written for
+INDEXES = (
+    ('info_file_hdf5_dt_start', 'info_file_hdf5', 'btree (dt_start)'),
+    ('info_file_hdf5_ftype_dt_start', 'info_file_hdf5', 'btree (ftype, dt_start)'),
+    ('info_file_hdf5_gid', 'info_file_hdf5', 'btree (gid)'),
+    ('info_file_hdf5_gring', 'info_file_hdf5', 'gist (gring)'),
+    ('info_file_raster_dt_start', 'info_file_raster', 'btree (dt_start)'),
+    ('info_file_raster_gid', 'info_file_raster', 'btree (gid)'),
+    ('gring_ncei_gring', 'gring_ncei', 'gist (gring)'),
+)
+
+
+def create_indexes(conn):
+    # the indexes of INDEXES that are missing; footprints must be stored as geometry for the GiST ones
+
+    cur = conn.cursor()
+    try:
+        for name, table, method in INDEXES:
+            cur.execute(sql.SQL('CREATE INDEX IF NOT EXISTS {} ON {} USING ' + method)
+                        .format(sql.Identifier(name), sql.Identifier(table)))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def _area(geom, bbox=None, polygon=None):
+    # ST_Intersects conditions on the geometry expression geom, with their parameters
+    # bbox: (west, south, east, north) in degrees, west > east crosses the antimeridian
+    # polygon: (lons, lats) vertices or WKB/EWKB bytes, in EPSG:4326
+
+    where = []
+    params = []
+    if bbox is not None:
+        west, south, east, north = bbox
+        if west <= east:
+            where.append(sql.SQL('ST_Intersects({}, ST_MakeEnvelope(%s, %s, %s, %s, %s))').format(geom))
+            params += [west, south, east, north, SRID]
+        else:
+            where.append(sql.SQL('(ST_Intersects({geom}, ST_MakeEnvelope(%s, %s, 180, %s, %s)) OR '
+                                 'ST_Intersects({geom}, ST_MakeEnvelope(-180, %s, %s, %s, %s)))').format(geom=geom))
+            params += [west, south, north, SRID, south, east, north, SRID]
+    if polygon is not None:
+        if not isinstance(polygon, (bytes, bytearray, memoryview)):
+            polygon = polygon_ewkb(*polygon)
+        where.append(sql.SQL('ST_Intersects({}, ST_SetSRID(ST_GeomFromEWKB(%s), %s))').format(geom))
+        params += [bytes(polygon), SRID]
+    return where, params
+
+
+def _window(alias, start=None, end=None, max_span=MAX_SPAN):
+    # files overlapping [start, end); the dt_start bounds are what an index can use
+
+    where = []
+    params = []
+    dt_start = sql.Identifier(alias, 'dt_start')
+    if end is not None:
+        where.append(sql.SQL('{} < %s').format(dt_start))
+        params.append(end)
+    if start is not None:
+        where.append(sql.SQL('{} >= %s').format(sql.Identifier(alias, 'dt_end')))
+        params.append(start)
+        if max_span is not None:
+            where.append(sql.SQL('{} >= %s').format(dt_start))
+            params.append(start - max_span)
+    return where, params
+
+
+def _equal(alias, column, value):
+    # column = value, or = ANY for a list of values
+
+    if value is None:
+        return [], []
+    if isinstance(value, (list, tuple, set)):
+        return [sql.SQL('{} = ANY(%s)').format(sql.Identifier(alias, column))], [list(value)]
+    return [sql.SQL('{} = %s').format(sql.Identifier(alias, column))], [value]
+
+
+def file_filters(alias, start=None, end=None, ftype=None, space=None, space_craft=None, desc_indicator=None,
+                 geolocation=None, max_span=MAX_SPAN):
+    # conditions on the columns shared by info_file_hdf5 and info_file_raster
+    # desc_indicator: True for files whose granules are all descending, False for all ascending
+
+    where, params = _window(alias, start, end, max_span)
+    for column, value in (('ftype', ftype), ('space', space), ('space_craft', space_craft),
+                          ('geolocation', geolocation)):
+        cond, cond_params = _equal(alias, column, value)
+        where += cond
+        params += cond_params
+    if desc_indicator is not None:
+        where.append(sql.SQL('%s = ALL({})').format(sql.Identifier(alias, 'desc_indicator')))
+        params.append(bool(desc_indicator))
+    return where, params
+
+
+def select(table, alias, columns, where, order_by=('dt_start',), join=None):
+    # SELECT columns FROM table alias [join] WHERE ... ORDER BY ...
+    # columns are names in alias, or sql.Composable expressions (e.g. a column of the joined table)
+
+    cols = [sql.Identifier(alias, i) if isinstance(i, str) else i for i in columns]
+    query = sql.SQL('SELECT {} FROM {} {}').format(
+        sql.SQL(', ').join(cols), sql.Identifier(table), sql.Identifier(alias))
+    if join is not None:
+        query = query + sql.SQL(' ') + join
+    if len(where) > 0:
+        query = query + sql.SQL(' WHERE ') + sql.SQL(' AND ').join(where)
+    if order_by:
+        query = query + sql.SQL(' ORDER BY ') + sql.SQL(', ').join(sql.Identifier(alias, i) for i in order_by)
+    return query
+
+
+def stream(conn, query, params=None, batch_size=BATCH_SIZE):
+    # lists of at most batch_size rows (named tuples) from a server-side cursor
+    # the read transaction is rolled back at the end, or when the consumer stops early
+
+    cur = conn.cursor(name='catalog_%s' % randomword(12).lower(), cursor_factory=NamedTupleCursor)
+    cur.itersize = batch_size
+    try:
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if len(rows) == 0:
+                break
+            yield rows
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+class Catalog:
+
+    def __init__(self, server='eogdev', conn=None, batch_size=BATCH_SIZE, max_span=MAX_SPAN):
+
+        self._owns_conn = conn is None
+        self.conn = conn if conn is not None else DBInfo().make_con(server)
+        self.batch_size = batch_size
+        self.max_span = max_span
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+
+        if self._owns_conn and self.conn is not None:
+            self.conn.close()
+        self.conn = None
+
+    def rows(self, query, params):
+        # rows of a (query, params) pair, streamed in batches
+
+        for rows in stream(self.conn, query, params, self.batch_size):
+            yield from rows
+
+    def hdf5_query(self, bbox=None, polygon=None, columns=HDF5_COLUMNS, order_by=('dt_start', 'h5id'), **filters):
+        # (query, params) for info_file_hdf5, filters as in file_filters
+
+        filters.setdefault('max_span', self.max_span)
+        where, params = file_filters('f', **filters)
+        area, area_params = _area(sql.Identifier('f', 'gring'), bbox, polygon)
+        return select('info_file_hdf5', 'f', columns, where + area, order_by), params + area_params
+
+    def hdf5_files(self, **kwargs):
+        # rows of info_file_hdf5, see hdf5_query
+        return self.rows(*self.hdf5_query(**kwargs))
+
+    def raster_query(self, bbox=None, polygon=None, content=None, columns=RASTER_COLUMNS,
+                     order_by=('dt_start', 'rastid'), **filters):
+        # (query, params) for info_file_raster; rasters have no footprint of their own,
+        # the area is matched against the footprints of the HDF5 files of the same granule
+
+        filters.setdefault('max_span', self.max_span)
+        where, params = file_filters('r', **filters)
+        cond, cond_params = _equal('r', 'content', content)
+        where += cond
+        params += cond_params
+        area, area_params = _area(sql.Identifier('h', 'gring'), bbox, polygon)
+        if len(area) > 0:
+            where.append(sql.SQL('EXISTS (SELECT 1 FROM {} {} WHERE {} = {} AND {})').format(
+                sql.Identifier('info_file_hdf5'), sql.Identifier('h'), sql.Identifier('h', 'gid'),
+                sql.Identifier('r', 'gid'), sql.SQL(' AND ').join(area)))
+            params += area_params
+        return select('info_file_raster', 'r', columns, where, order_by), params
+
+    def rasters(self, **kwargs):
+        # rows of info_file_raster, see raster_query
+        return self.rows(*self.raster_query(**kwargs))
+
+    def ncei_query(self, bbox=None, polygon=None, columns=('h5id', 'fname', 'dt_start', 'dt_end', 'space', 'link'),
+                   order_by=('dt_start', 'h5id'), **filters):
+        # (query, params) for geolocation files matched on their NCEI gring instead of the G-Ring
+
+        filters.setdefault('max_span', self.max_span)
+        where, params = file_filters('f', **filters)
+        area, area_params = _area(sql.Identifier('n', 'gring'), bbox, polygon)
+        join = sql.SQL('JOIN {} {} ON {} = {}').format(sql.Identifier('gring_ncei'), sql.Identifier('n'),
+                                                      sql.Identifier('n', 'h5id'), sql.Identifier('f', 'h5id'))
+        return select('info_file_hdf5', 'f', columns, where + area, order_by, join), params + area_params
+
+    def ncei_files(self, **kwargs):
+        # rows of ncei_query
+        return self.rows(*self.ncei_query(**kwargs))
+
+    def count(self, query, params):
+        # number of rows a query returns, counted in the database
+
+        cur = self.conn.cursor()
+        try:
+            cur.execute(sql.SQL('SELECT count(*) FROM ({}) q').format(query), params)
+            return cur.fetchone()[0]
+        finally:
+            cur.close()
+            self.conn.rollback()
+
+
+def _date(text):
+    return datetime.datetime.fromisoformat(text)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='List ingested files by area, time and product.')
+    parser.add_argument('--server', default='eogdev')
+    parser.add_argument('--table', choices=['hdf5', 'raster', 'ncei'], default='hdf5')
+    parser.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'))
+    parser.add_argument('--start', type=_date, default=None, help='ISO date or time, inclusive')
+    parser.add_argument('--end', type=_date, default=None, help='ISO date or time, exclusive')
+    parser.add_argument('--ftype', nargs='+', default=None, help='e.g. SVDNB GDNBO')
+    parser.add_argument('--space', nargs='+', choices=['D', 'M', 'I'], default=None)
+    parser.add_argument('--space-craft', nargs='+', default=None, help='e.g. npp j01')
+    parser.add_argument('--desc', choices=['yes', 'no'], default=None,
+                        help='only files whose granules are all descending (yes) or all ascending (no)')
+    parser.add_argument('--content', nargs='+', default=None, help='raster content, e.g. rade9 vflag')
+    parser.add_argument('--count', action='store_true', help='print the number of files only')
+    args = parser.parse_args(argv)
+
+    kwargs = {'bbox': args.bbox, 'start': args.start, 'end': args.end, 'ftype': args.ftype, 'space': args.space,
+              'space_craft': args.space_craft}
+    if args.desc is not None:
+        kwargs['desc_indicator'] = args.desc == 'yes'
+    if args.table == 'raster':
+        kwargs['content'] = args.content
+
+    with Catalog(args.server) as cat:
+        make_query = {'hdf5': cat.hdf5_query, 'raster': cat.raster_query, 'ncei': cat.ncei_query}[args.table]
+        query, params = make_query(**kwargs)
+        if args.count:
+            print(cat.count(query, params))
+            return 0
+        for row in cat.rows(query, params):
+            print(row.link)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
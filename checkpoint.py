@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# checkpointed, retrying batch runs
+#
+# Checkpoint appends the outcome of every file (ingested, skipped, failed,
+# with the number of attempts) to a JSON lines file as soon as it is known.
+# a run that is killed or crashes is started again with the same file and
+# only processes what has no final outcome yet:
+#
+#   ./load_batch.py --checkpoint ~/reprocess_2019.ckpt --attempts 5 /data/viirs/2019
+#
+# RetryPolicy repeats a call that failed on a transient database error (lost
+# connection, server restart, serialization failure, deadlock) with
+# exponential backoff and jitter, up to a bounded number of attempts; any
+# other error is final on the first attempt.
+
+import datetime
+import json
+import os
+import random
+import threading
+import time
+
+import psycopg2
+
+
+ATTEMPTS = 5
+BASE_DELAY = 2.0
+MAX_DELAY = 120.0
+
+# OperationalError covers TransactionRollbackError (serialization failure, deadlock) and AdminShutdown
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# outcomes that end the work on a file; failed files are tried again with retry_failed
+FINAL = ('ingested', 'skipped')
+
+
+def is_transient(exc):
+    # exc or an error it was raised from (IngestError wraps psycopg2 errors) is worth another attempt
+
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        if isinstance(exc, TRANSIENT_ERRORS):
+            return True
+        seen.add(id(exc))
+        exc = exc.__cause__ if exc.__cause__ is not None else exc.__context__
+    return False
+
+
+class RetryPolicy:
+
+    def __init__(self, attempts=ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        # seconds to wait after the given failed attempt (1, 2, ...)
+
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def call(self, fn, *args, what=None, **kwargs):
+        # (result, attempts) of fn(*args, **kwargs); the last error is raised with an attempts attribute
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return fn(*args, **kwargs), attempt
+            except Exception as e:
+                if attempt >= self.attempts or not is_transient(e):
+                    e.attempts = attempt
+                    raise
+                delay = self.delay(attempt)
+                print('Transient error%s (attempt %s of %s), retrying in %.1f s: %s' %
+                      (' for %s' % what if what else '', attempt, self.attempts, delay, e))
+                time.sleep(delay)
+
+
+class Checkpoint:
+    # thread safe; the last record of a path is its outcome
+
+    def __init__(self, path):
+
+        self.path = path
+        self.outcomes = {}
+        self._lock = threading.Lock()
+        cut = False
+        if os.path.exists(path):
+            cut = self._load()
+        self._out = open(path, 'a')
+        if cut:
+            # end the partial line so the next record starts on its own
+            self._out.write('\n')
+
+    def _load(self):
+        # outcomes of earlier runs; True if the file ends in the middle of a line
+
+        line = '\n'
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a line cut short by a crash
+                    continue
+                self.outcomes[record['path']] = record
+        return not line.endswith('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def pending(self, paths, retry_failed=True):
+        # (paths still to do, paths done in earlier runs), in the given order
+
+        todo = []
+        done = []
+        for path in paths:
+            record = self.outcomes.get(os.path.abspath(path))
+            if record is not None and (record['status'] in FINAL or not retry_failed):
+                done.append(path)
+            else:
+                todo.append(path)
+        return todo, done
+
+    def record(self, path, status, message=None, attempts=1):
+
+        record = {'path': os.path.abspath(path), 'status': status, 'attempts': attempts, 'message': message,
+                  'time': datetime.datetime.now().isoformat()}
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self.outcomes[record['path']] = record
+            self._out.write(line)
+            self._out.flush()
+
+    def counts(self):
+
+        counts = {}
+        with self._lock:
+            for record in self.outcomes.values():
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+        return counts
+
+    def close(self):
+
+        with self._lock:
+            if self._out is not None:
+                self._out.flush()
+                os.fsync(self._out.fileno())
+                self._out.close()
+                self._out = None
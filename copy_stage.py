@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+# offline staging of ingest rows as COPY files, and the bulk loader
+#
+# StageWriter runs where there is no database: every parsed file becomes rows
+# of the ingest tables written to COPY text files under <stage dir>/<run id>/,
+# keyed by the natural names (gname, fname) instead of gid/h5id/rastid.
+# load_run() later COPYs a run into temp tables and resolves the ids set-wise:
+#
+#   info_granule      insert the missing gnames
+#   info_file_hdf5    insert new fnames with their gid, RETURNING h5id
+#   info_file_raster  insert new fnames with their gid, RETURNING rastid
+#   midtime, qf3_scan_rdr, radiance_factor, solar_zenith, gring_ncei
+#                     join the new h5ids on fname
+#
+# files already in the database are skipped, as in ImportToDB without update.
+# part files are named by host and pid, so many nodes can stage into one run,
+# and only appear under their final name once closed.
+
+import datetime
+import glob
+import os
+import socket
+import threading
+
+from psycopg2 import sql
+
+from footprint import file_footprints
+import raster_od
+
+
+# staged table -> columns of its COPY files
+STAGE_COLUMNS = {
+    'info_granule': ('gname',),
+    'info_file_hdf5': ('fname', 'ftype', 'space_craft', 'dt_start', 'dt_end', 'dt_create', 'orbit', 'source',
+                       'state', 'space', 'nscan', 'ngranule', 'geolocation', 'desc_indicator', 'gname', 'gring',
+                       'link'),
+    'info_file_raster': ('fname', 'ftype', 'space_craft', 'dt_start', 'dt_end', 'dt_create', 'orbit', 'source',
+                         'state', 'space', 'geolocation', 'gname', 'link', 'content', 'rast'),
+    'midtime': ('fname', 'val'),
+    'qf3_scan_rdr': ('fname', 'val'),
+    'radiance_factor': ('fname', 'val'),
+    'solar_zenith': ('fname', 'val'),
+    'gring_ncei': ('fname', 'space', 'gring'),
+}
+# tables keyed by h5id, loaded after info_file_hdf5
+HDF5_CHILD_TABLES = ('midtime', 'qf3_scan_rdr', 'radiance_factor', 'solar_zenith', 'gring_ncei')
+
+PART_EXT = '.copy'
+LOADED_MARKER = 'LOADED'
+
+
+class RunIncomplete(Exception):
+    pass
+
+
+def copy_value(val):
+    # one field in COPY text format
+
+    if val is None:
+        return '\\N'
+    if isinstance(val, bool):
+        return 't' if val else 'f'
+    if isinstance(val, (list, tuple)):
+        return '{' + ','.join('NULL' if i is None else copy_value(i) for i in val) + '}'
+    if isinstance(val, datetime.datetime):
+        return val.isoformat(' ')
+    if isinstance(val, float):
+        return repr(val)
+    text = str(val)
+    if '\\' in text or '\t' in text or '\n' in text or '\r' in text:
+        text = text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return text
+
+
+def copy_line(row):
+    return '\t'.join(copy_value(i) for i in row) + '\n'
+
+
+def first_value(data):
+    # first array of a {path: array} dict, as the insert methods of ImportToDB use
+
+    return data[list(data.keys())[0]]
+
+
+def stage_rows(finfo):
+    # {table: [row, ...]} for one parsed file, in STAGE_COLUMNS order
+    # out-db rasters are always encoded in process, compute nodes have no raster2pgsql
+
+    rows = {'info_granule': [(finfo.gname,)]}
+    footprints = finfo.footprints if finfo.footprints != {} else file_footprints(finfo)
+    file_cols = (finfo.filename, finfo.ftype, finfo.space_craft, finfo.dt_start, finfo.dt_end, finfo.dt_create,
+                 finfo.orbit, finfo.source, finfo.state, finfo.space)
+
+    if finfo.is_h5:
+        desc_val = [finfo.desc[key][0][0] != 0 for key in finfo.desc.keys()]
+        rows['info_file_hdf5'] = [file_cols + (finfo.nscan, finfo.ngranule, finfo.is_geo, desc_val, finfo.gname,
+                                               footprints.get('gring'), finfo.link)]
+        if finfo.midtime != {}:
+            rows['midtime'] = [(finfo.filename, first_value(finfo.midtime).tolist())]
+        if finfo.qf3_scan_rdr != {}:
+            rows['qf3_scan_rdr'] = [(finfo.filename, first_value(finfo.qf3_scan_rdr).tolist())]
+        if finfo.radiance_factor != {}:
+            rows['radiance_factor'] = [(finfo.filename, first_value(finfo.radiance_factor).tolist())]
+        if finfo.is_geo:
+            rows['gring_ncei'] = [(finfo.filename, finfo.space, footprints.get('gring_ncei'))]
+            if finfo.solz is not None:
+                rows['solar_zenith'] = [(finfo.filename, finfo.solz.tolist())]
+    else:
+        rows['info_file_raster'] = [file_cols + (finfo.is_geo, finfo.gname, finfo.link, finfo.content,
+                                                 raster_od.get_raster_od_hex(finfo.link))]
+
+    return rows
+
+
+class StageWriter:
+    # thread safe; the rows of one file are written together
+
+    def __init__(self, stage_dir, run_id=None):
+
+        if run_id is None:
+            run_id = datetime.datetime.now().strftime('run-%Y%m%dT%H%M%S')
+        self.run_id = run_id
+        self.run_dir = os.path.join(stage_dir, run_id)
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.part = '%s-%s' % (socket.gethostname(), os.getpid())
+        self.files = 0
+        self._out = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _part_path(self, table):
+        return os.path.join(self.run_dir, '%s.%s%s' % (table, self.part, PART_EXT))
+
+    def add(self, finfo):
+
+        rows = stage_rows(finfo)
+        with self._lock:
+            for table, table_rows in rows.items():
+                out = self._out.get(table)
+                if out is None:
+                    out = self._out[table] = open(self._part_path(table) + '.tmp', 'a')
+                out.write(''.join(copy_line(row) for row in table_rows))
+            self.files += 1
+
+    def close(self):
+        # complete part files get their final name, the loader ignores *.tmp
+
+        with self._lock:
+            for table, out in self._out.items():
+                out.close()
+                os.replace(self._part_path(table) + '.tmp', self._part_path(table))
+            self._out = {}
+
+
+def _stage_table(table):
+    return 'stage_' + table
+
+
+def _create_stage_tables(cur):
+    # temp tables with the column types of the target tables, names instead of ids
+
+    for table, columns in STAGE_COLUMNS.items():
+        select = []
+        for col in columns:
+            if (col == 'gname' and table != 'info_granule') or (col == 'fname' and table in HDF5_CHILD_TABLES):
+                # stands in for gid/h5id, not a column of the target table
+                select.append(sql.SQL('NULL::text AS {}').format(sql.Identifier(col)))
+            else:
+                select.append(sql.Identifier(col))
+        cur.execute(sql.SQL('CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA')
+                    .format(sql.Identifier(_stage_table(table)), sql.SQL(', ').join(select),
+                            sql.Identifier(table)))
+
+
+def run_parts(run_dir):
+    # {table: [part file, ...]} of the complete part files of a run
+
+    parts = {}
+    for table in STAGE_COLUMNS:
+        found = sorted(glob.glob(os.path.join(run_dir, '%s.*%s' % (table, PART_EXT))))
+        if len(found) > 0:
+            parts[table] = found
+    return parts
+
+
+def open_parts(run_dir):
+    # part files a StageWriter is still writing
+
+    return sorted(glob.glob(os.path.join(run_dir, '*%s.tmp' % PART_EXT)))
+
+
+def load_run(conn, run_dir):
+    # COPY a staged run and insert it in one transaction; returns row counts per table
+    # a run with parts still being written is refused, it would be marked LOADED half done
+
+    writing = open_parts(run_dir)
+    if len(writing) > 0:
+        raise RunIncomplete('%s part files still being written in %s, e.g. %s' %
+                            (len(writing), run_dir, os.path.basename(writing[0])))
+    parts = run_parts(run_dir)
+    counts = {}
+    cur = conn.cursor()
+    try:
+        _create_stage_tables(cur)
+        for table, paths in parts.items():
+            copy_sql = sql.SQL('COPY {} ({}) FROM STDIN').format(
+                sql.Identifier(_stage_table(table)),
+                sql.SQL(', ').join(sql.Identifier(i) for i in STAGE_COLUMNS[table]))
+            for path in paths:
+                with open(path, 'r') as f:
+                    cur.copy_expert(copy_sql, f)
+
+        cur.execute(sql.SQL('INSERT INTO {target}(gname) SELECT DISTINCT gname FROM {stage} '
+                            'WHERE gname IS NOT NULL ON CONFLICT DO NOTHING')
+                    .format(target=sql.Identifier('info_granule'), stage=sql.Identifier('stage_info_granule')))
+        counts['info_granule'] = cur.rowcount
+
+        for table, id_col in (('info_file_hdf5', 'h5id'), ('info_file_raster', 'rastid')):
+            # files without gname have no granule to join and are not loaded, say which
+            cur.execute(sql.SQL('SELECT DISTINCT fname FROM {} WHERE gname IS NULL ORDER BY fname')
+                        .format(sql.Identifier(_stage_table(table))))
+            no_gname = [i[0] for i in cur.fetchall()]
+            for fname in no_gname:
+                print('Not loaded, no gname: %s' % fname)
+            counts[table + '_no_gname'] = len(no_gname)
+
+            columns = [i for i in STAGE_COLUMNS[table] if i != 'gname']
+            # one row per fname (a file staged twice), only files not in the database yet
+            cur.execute(sql.SQL(
+                'CREATE TEMP TABLE {new_ids} ON COMMIT DROP AS '
+                'WITH ins AS (INSERT INTO {target} ({cols}, gid) '
+                'SELECT DISTINCT ON (s.fname) {s_cols}, g.gid FROM {stage} s '
+                'JOIN {granule} g ON g.gname = s.gname '
+                'WHERE NOT EXISTS (SELECT 1 FROM {target} t WHERE t.fname = s.fname) '
+                'ORDER BY s.fname ON CONFLICT DO NOTHING RETURNING {id_col}, fname) '
+                'SELECT * FROM ins').format(
+                    new_ids=sql.Identifier('new_' + id_col),
+                    target=sql.Identifier(table),
+                    cols=sql.SQL(', ').join(sql.Identifier(i) for i in columns),
+                    s_cols=sql.SQL(', ').join(sql.Identifier('s', i) for i in columns),
+                    stage=sql.Identifier(_stage_table(table)),
+                    granule=sql.Identifier('info_granule'),
+                    id_col=sql.Identifier(id_col)))
+            counts[table] = cur.rowcount
+
+        for table in HDF5_CHILD_TABLES:
+            columns = [i for i in STAGE_COLUMNS[table] if i != 'fname']
+            cur.execute(sql.SQL('INSERT INTO {target} (h5id, {cols}) '
+                                'SELECT DISTINCT ON (n.h5id) n.h5id, {s_cols} FROM {stage} s '
+                                'JOIN {new_ids} n ON n.fname = s.fname ORDER BY n.h5id')
+                        .format(target=sql.Identifier(table),
+                                cols=sql.SQL(', ').join(sql.Identifier(i) for i in columns),
+                                s_cols=sql.SQL(', ').join(sql.Identifier('s', i) for i in columns),
+                                stage=sql.Identifier(_stage_table(table)),
+                                new_ids=sql.Identifier('new_h5id')))
+            counts[table] = cur.rowcount
+
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    with open(os.path.join(run_dir, LOADED_MARKER), 'w') as f:
+        f.write('%s %s\n' % (datetime.datetime.now().isoformat(), counts))
+
+    return counts
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# VIIRS file name decoding
+#
+#   SVDNB_npp_d20190101_t0000123_e0001365_b37000_c20190101010203123456_noac_ops.h5
+#   <ftype>_<sc>_d<date>_t<start><f>_e<end><f>_b<orbit>_c<create date/time/usec>_<source>_<state>
+#
+# the grammar is compiled once; decode_names() decodes a whole list of names
+# into numpy columns (datetimes are converted in one vectorized step), and
+# decode_name() runs the same code for a single file (used by InfoFile)
+
+import os
+import re
+import numpy as np
+
+
+# full NOAA name, anchored: file type, granule and creation/source/state fields
+FULL_NAME = re.compile('(?P<ftype>.{5})_(?P<sc>...)_d(?P<date>[0-9]{8})_t(?P<start>[0-9]{6})(?P<startf>[0-9])'
+                       '_e(?P<end>[0-9]{6})(?P<endf>[0-9])_b(?P<orbit>[0-9]{5})'
+                       '_c(?P<cdate>[0-9]{8})(?P<ctime>[0-9]{6})(?P<ctimef>[0-9]{6})_(?P<source>....)_(?P<state>...)')
+
+# granule part only, anywhere in the name (derived rasters and other file names)
+GRANULE = re.compile('(?P<sc>...)_d(?P<date>[0-9]{8})_t(?P<start>[0-9]{6})(?P<startf>[0-9])'
+                     '_e(?P<end>[0-9]{6})(?P<endf>[0-9])_b(?P<orbit>[0-9]{5})')
+
+# raster content from the file name, first match wins:
+# (substring, content, is_geo, reproj, space); None leaves the default
+CONTENT_RULES = (
+    ('.lines.', 'lines', True, True, None),
+    ('.samples', 'samples', True, True, None),
+    ('.rade9.', 'rade9', None, True, None),
+    ('.srade9.', 'srade9', None, False, None),
+    ('.dspace_rad.', 'dspace_rad', None, False, 'D'),
+    ('.rad.', 'rad', None, True, None),
+    ('.vflag', 'vflag', None, True, None),
+    ('.dflag.', 'dflag', None, None, 'd'),
+    ('.dflagr.', 'dflag', None, True, 'd'),
+    ('.mflag.', 'mflag', None, None, 'm'),
+    ('.mflagr.', 'mflag', None, True, 'm'),
+    ('.blur.', 'blur', None, None, None),
+    ('.lon.', 'longitude', None, False, None),
+    ('.lat.', 'latitude', None, None, None),
+)
+
+STRING_FIELDS = ('fname', 'gname', 'ftype', 'space_craft', 'source', 'state', 'content', 'space')
+DATETIME_FIELDS = ('dt_start', 'dt_end', 'dt_create')
+FIELDS = STRING_FIELDS + DATETIME_FIELDS + ('orbit', 'is_geo', 'reproj')
+
+ONE_DAY = np.timedelta64(1, 'D')
+
+
+def _iso(date, time):
+    return '%s-%s-%sT%s:%s:%s' % (date[:4], date[4:6], date[6:], time[:2], time[2:4], time[4:])
+
+
+def _to_datetime64(texts, strict=False):
+    # one vectorized conversion; names with impossible dates become NaT unless strict
+
+    try:
+        return np.array(texts, dtype='datetime64[us]')
+    except ValueError:
+        if strict:
+            raise
+        out = np.empty(len(texts), dtype='datetime64[us]')
+        for n, text in enumerate(texts):
+            try:
+                out[n] = np.datetime64(text, 'us')
+            except ValueError:
+                out[n] = np.datetime64('NaT')
+        return out
+
+
+def decode_names(names, strict=False):
+    # decode file names (or paths) into a dict of numpy columns, see FIELDS
+    # missing values are None, NaT or orbit -1; strict raises ValueError on impossible dates
+
+    count = len(names)
+    cols = {field: np.full(count, None, dtype=object) for field in STRING_FIELDS}
+    cols['orbit'] = np.full(count, -1, dtype=np.int32)
+    cols['is_geo'] = np.zeros(count, dtype=bool)
+    cols['reproj'] = np.zeros(count, dtype=bool)
+
+    start_txt = ['NaT'] * count
+    end_txt = ['NaT'] * count
+    create_txt = ['NaT'] * count
+    start_frac = np.zeros(count, dtype=np.int64)
+    end_frac = np.zeros(count, dtype=np.int64)
+    create_frac = np.zeros(count, dtype=np.int64)
+
+    fname, gname, ftype = cols['fname'], cols['gname'], cols['ftype']
+    space_craft, source, state = cols['space_craft'], cols['source'], cols['state']
+    content, space, orbit = cols['content'], cols['space'], cols['orbit']
+    is_geo, reproj = cols['is_geo'], cols['reproj']
+
+    for n, name in enumerate(names):
+        base = os.path.basename(name)
+        fname[n] = base
+
+        m = FULL_NAME.match(base)
+        if m is not None:
+            ftype[n], source[n], state[n] = m.group('ftype', 'source', 'state')
+            cdate, ctime, ctimef = m.group('cdate', 'ctime', 'ctimef')
+            create_txt[n] = _iso(cdate, ctime)
+            create_frac[n] = int(ctimef)
+        else:
+            m = GRANULE.search(base)
+
+        if m is not None:
+            sc, date, start, startf, end, endf, orb = m.group('sc', 'date', 'start', 'startf', 'end', 'endf', 'orbit')
+            gname[n] = m.string[m.start('sc'):m.end('orbit')]
+            space_craft[n] = sc
+            start_txt[n] = _iso(date, start)
+            end_txt[n] = _iso(date, end)
+            start_frac[n] = int(startf)
+            end_frac[n] = int(endf)
+            orbit[n] = int(orb)
+
+        for sub, rule_content, rule_geo, rule_reproj, rule_space in CONTENT_RULES:
+            if sub in base:
+                content[n] = rule_content
+                if rule_geo is not None:
+                    is_geo[n] = rule_geo
+                if rule_reproj is not None:
+                    reproj[n] = rule_reproj
+                if rule_space is not None:
+                    space[n] = rule_space
+                break
+
+    # start/end carry tenths of a second, the creation time microseconds
+    cols['dt_start'] = _to_datetime64(start_txt, strict) + start_frac * np.timedelta64(100000, 'us')
+    dt_end = _to_datetime64(end_txt, strict) + end_frac * np.timedelta64(100000, 'us')
+    # granules crossing midnight end on the next day
+    dt_end[dt_end < cols['dt_start']] += ONE_DAY
+    cols['dt_end'] = dt_end
+    cols['dt_create'] = _to_datetime64(create_txt, strict) + create_frac * np.timedelta64(1, 'us')
+
+    return cols
+
+
+def decode_name(name):
+    # single file, same code path as decode_names; datetimes as datetime.datetime, missing as None
+
+    cols = decode_names([name], strict=True)
+    row = {field: cols[field][0] for field in STRING_FIELDS}
+    for field in DATETIME_FIELDS:
+        row[field] = cols[field][0].tolist()
+    row['orbit'] = int(cols['orbit'][0]) if cols['orbit'][0] >= 0 else None
+    row['is_geo'] = bool(cols['is_geo'][0])
+    row['reproj'] = bool(cols['reproj'][0])
+
+    return row
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# footprint helpers shared by InfoFile and ImportToDB
+#
+# the ncei gring only needs the first, middle and last column of the first and
+# last valid scan line, plus one edge pixel at every granule boundary; these
+# helpers read exactly those pixels instead of the full lat/lon grids
+#
+# footprints are written straight from the numpy coordinates to (hex) EWKB,
+# the same bytes shapely's wkb.dumps(geom, srid=4326) gives, without going
+# through WKT text, so the float32 values from the file are kept exactly
+
+import re
+import struct
+import numpy as np
+
+import instrument
+
+
+SRID = 4326
+
+# EWKB, little endian
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+EWKB_SRID_FLAG = 0x20000000
+
+# granule number and coordinate of a gring key, e.g. .../VIIRS-DNB-GEO_Gran_3/G-Ring_Latitude
+GRING_KEY = re.compile('.*_Gran_([0-9]+)/G-Ring_(Latitude|Longitude)$')
+
+
+def ncei_pixel_index(dls, mcols, ngrans):
+    # (row, col) of the ncei gring vertices in ring order (ring not closed)
+    # dls: indices of valid rows, mcols: number of columns, ngrans: granules in file
+
+    ndls = len(dls)
+    mid = round(mcols / 2) - 1
+    last = mcols - 1
+
+    index = [(dls[0], 0), (dls[0], mid), (dls[0], last)]
+    for ngr in range(1, ngrans):
+        index.append((dls[round(ngr * ndls / ngrans) - 1], last))
+    index.extend([(dls[-1], last), (dls[-1], mid), (dls[-1], 0)])
+    for ngr in range(1, ngrans):
+        index.append((dls[round((ngrans - ngr) * ndls / ngrans) - 1], 0))
+
+    return index
+
+
+def read_pixels(grid, index):
+    # read the (row, col) pixels from an array or h5py dataset
+    # one hyperslab read per distinct row, so only a few bytes per vertex leave the file
+
+    rows = {}
+    for row, col in index:
+        rows.setdefault(int(row), set()).add(int(col))
+
+    values = {}
+    for row, cols in rows.items():
+        cols = sorted(cols)
+        line = grid[row, cols]
+        instrument.count_read(grid, line)
+        for col, val in zip(cols, line):
+            values[(row, col)] = val
+
+    return np.array([values[(int(row), int(col))] for row, col in index], dtype=grid.dtype)
+
+
+@instrument.timed('footprint.read_ncei_edge')
+def read_ncei_edge(lat_grid, lon_grid, ngrans, fill=-999):
+    # returns (lons, lats) of the ncei gring vertices, reading only the first
+    # column to find the valid rows and then the vertex pixels themselves
+
+    first_col = lat_grid[:, 0]
+    instrument.count_read(lat_grid, first_col)
+    dls = np.where(first_col > fill)[0]
+    if len(dls) == 0:
+        return None
+    mcols = lat_grid.shape[1]
+    index = ncei_pixel_index(dls, mcols, ngrans)
+
+    return read_pixels(lon_grid, index), read_pixels(lat_grid, index)
+
+
+def _ring_wkb(lons, lats):
+    # polygon body with one closed ring: nrings, npoints, x y pairs
+
+    lons = np.asarray(lons, dtype='<f8').ravel()
+    lats = np.asarray(lats, dtype='<f8').ravel()
+    npts = len(lons) + 1
+    coords = np.empty((npts, 2), dtype='<f8')
+    coords[:-1, 0] = lons
+    coords[:-1, 1] = lats
+    coords[-1] = coords[0]
+
+    return struct.pack('<II', 1, npts) + coords.tobytes()
+
+
+def _header(geom_type, srid):
+
+    if srid is None:
+        return struct.pack('<BI', 1, geom_type)
+    return struct.pack('<BII', 1, geom_type | EWKB_SRID_FLAG, srid)
+
+
+@instrument.timed('footprint.polygon_ewkb')
+def polygon_ewkb(lons, lats, srid=SRID):
+    # single ring polygon, the ring is closed here
+
+    return _header(WKB_POLYGON, srid) + _ring_wkb(lons, lats)
+
+
+def multipolygon_ewkb(rings, srid=SRID):
+    # rings: sequence of (lons, lats), one polygon per ring; only the outer geometry carries the srid
+
+    parts = [_header(WKB_MULTIPOLYGON, srid), struct.pack('<I', len(rings))]
+    polygon_header = _header(WKB_POLYGON, None)
+    for lons, lats in rings:
+        parts.append(polygon_header)
+        parts.append(_ring_wkb(lons, lats))
+
+    return b''.join(parts)
+
+
+def to_hex(ewkb):
+    # upper case hex, as shapely and PostGIS write it
+    return ewkb.hex().upper()
+
+
+def gring_rings(gring):
+    # {granule number: (lons, lats)} from an InfoFile.gring dict, in a single pass
+
+    by_gran = {}
+    for key, val in gring.items():
+        m = GRING_KEY.match(key)
+        if m is not None:
+            by_gran.setdefault(int(m.group(1)), {})[m.group(2)] = val
+
+    return {n: (val['Longitude'], val['Latitude']) for n, val in by_gran.items()}
+
+
+@instrument.timed('footprint.gring_ewkb')
+def gring_ewkb(gring, ngranule, srid=SRID):
+    # file footprint: polygon for a single granule, multipolygon for aggregated files
+
+    if ngranule == 1:
+        lon_key = [i for i in gring.keys() if i.endswith('/G-Ring_Longitude')][0]
+        lat_key = [i for i in gring.keys() if i.endswith('/G-Ring_Latitude')][0]
+        return polygon_ewkb(gring[lon_key], gring[lat_key], srid)
+
+    rings = gring_rings(gring)
+    return multipolygon_ewkb([rings[n] for n in range(0, ngranule)], srid)
+
+
+def gring_ewkb_many(grings, ngranules, srid=SRID):
+    # footprints of many files at once, e.g. when re-deriving archived granules
+    return [gring_ewkb(gring, ngranule, srid) for gring, ngranule in zip(grings, ngranules)]
+
+
+@instrument.timed('footprint.file_footprints')
+def file_footprints(finfo):
+    # hex EWKB footprints of a parsed InfoFile: 'gring' (G-Ring polygon/multipolygon)
+    # and, for geolocation files, 'gring_ncei'
+
+    footprints = {}
+    if not finfo.is_h5:
+        return footprints
+    if finfo.gring != {}:
+        footprints['gring'] = to_hex(gring_ewkb(finfo.gring, finfo.ngranule))
+    if finfo.is_geo and finfo.ncei_edge is not None:
+        footprints['gring_ncei'] = to_hex(polygon_ewkb(*finfo.ncei_edge))
+
+    return footprints
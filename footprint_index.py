@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+
+# local spatial index of file footprints for in-process coverage lookups
+#
+# "which granules cover this point at this time" is answered without the
+# database: footprints (hex EWKB, as ImportToDB writes gring or gring_ncei)
+# are kept in segment files under an index directory, one or more segments
+# per time bucket (a day by default). each segment holds a packed R-tree
+# (sort-tile-recursive order, NODE_SIZE entries per node) over the footprint
+# bounding boxes, the time range, h5id and name of every file and the EWKB;
+# all arrays are read through mmap, so opening an index costs a few page
+# faults. candidates from the tree are checked against the exact footprint
+# with shapely.
+#
+#   index = FootprintIndex('/data/fpindex')
+#   index.query_point(-105.2, 40.0, datetime(2019, 1, 1, 9, 30))
+#   qidx, hits = index.query_points(lons, lats, times)
+#
+#   ./footprint_index.py build /data/fpindex --server eogdev        (new files since the last build)
+#   ./footprint_index.py query /data/fpindex --point -105.2 40.0 --time 2019-01-01T09:30
+#   ./load_batch.py --footprint-index /data/fpindex /data/viirs      (append while ingesting)
+#
+# segments are never changed once written: append() adds segments for the
+# buckets its files fall in and compact() merges the segments of a bucket.
+
+import argparse
+import collections
+import datetime
+import json
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+import shapely
+from psycopg2 import sql
+
+from footprint import file_footprints
+import catalog
+
+
+MAGIC = b'VFPIDX1\n'
+MANIFEST = 'index.json'
+SEGMENT_EXT = '.fpi'
+NODE_SIZE = 16
+ALIGN = 64
+BUCKET_SECONDS = 86400
+# segments of one bucket before append() merges them
+MAX_SEGMENTS = 8
+# h5ids below the largest indexed one that export_from_db looks at again: loaders running in
+# parallel commit their files out of h5id order, append() drops the files already indexed
+EXPORT_OVERLAP = 10000
+
+US = np.timedelta64(1, 'us')
+EPOCH = np.datetime64(0, 'us')
+
+Hit = collections.namedtuple('Hit', ['fname', 'h5id', 'dt_start', 'dt_end'])
+
+
+def to_us(times):
+    # microseconds since 1970 (int64) of datetimes, datetime64 or ISO strings
+
+    return (np.asarray(times, dtype='datetime64[us]') - EPOCH) // US
+
+
+def from_us(us):
+    return (EPOCH + int(us) * US).astype(datetime.datetime)
+
+
+def ewkb_bytes(val):
+    # bytes of a footprint as stored (hex text) or fetched (hex text, bytes or memoryview)
+
+    if isinstance(val, str):
+        return bytes.fromhex(val)
+    return bytes(val)
+
+
+def _ragged(items):
+    # (flat uint8 data, int64 offsets) of a list of bytes
+
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(i) for i in items])
+    data = np.frombuffer(b''.join(items), dtype=np.uint8)
+    return data, offsets
+
+
+def str_order(boxes, node_size=NODE_SIZE):
+    # sort-tile-recursive order of boxes: vertical slices by x center, each sorted by y center
+
+    count = len(boxes)
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    leaves = -(-count // node_size)
+    slices = int(np.ceil(np.sqrt(leaves)))
+    slice_len = slices * node_size
+    by_x = np.argsort(cx, kind='stable')
+    order = []
+    for start in range(0, count, slice_len):
+        part = by_x[start:start + slice_len]
+        order.append(part[np.argsort(cy[part], kind='stable')])
+    return np.concatenate(order)
+
+
+def pack_levels(boxes, node_size=NODE_SIZE):
+    # node boxes of the levels above boxes, bottom up, concatenated; and the level offsets
+
+    levels = []
+    below = boxes
+    while len(below) > 1:
+        count = -(-len(below) // node_size)
+        starts = np.arange(count) * node_size
+        node = np.empty((count, 4), dtype=np.float64)
+        node[:, 0] = np.minimum.reduceat(below[:, 0], starts)
+        node[:, 1] = np.minimum.reduceat(below[:, 1], starts)
+        node[:, 2] = np.maximum.reduceat(below[:, 2], starts)
+        node[:, 3] = np.maximum.reduceat(below[:, 3], starts)
+        levels.append(node)
+        below = node
+    offsets = np.zeros(len(levels) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(i) for i in levels])
+    nodes = np.concatenate(levels) if len(levels) > 0 else np.zeros((0, 4), dtype=np.float64)
+    return nodes, offsets
+
+
+def write_segment(path, records):
+    # records: (h5id or -1, fname, start us, end us, EWKB bytes); returns the manifest entry
+
+    geoms = shapely.from_wkb([i[4] for i in records])
+    bounds = shapely.bounds(geoms)
+    order = str_order(bounds)
+    records = [records[i] for i in order]
+    boxes = np.ascontiguousarray(bounds[order], dtype=np.float64)
+    nodes, level_off = pack_levels(boxes)
+    wkb_data, wkb_off = _ragged([i[4] for i in records])
+    name_data, name_off = _ragged([i[1].encode() for i in records])
+    arrays = {
+        'boxes': boxes,
+        'h5id': np.array([i[0] for i in records], dtype=np.int64),
+        't_start': np.array([i[2] for i in records], dtype=np.int64),
+        't_end': np.array([i[3] for i in records], dtype=np.int64),
+        'wkb_data': wkb_data, 'wkb_off': wkb_off,
+        'name_data': name_data, 'name_off': name_off,
+        'nodes': nodes, 'level_off': level_off,
+    }
+
+    # header: magic, JSON length, JSON {array: [dtype, shape, offset]}, then the arrays, aligned
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = [arr.dtype.str, list(arr.shape), offset]
+        offset += -(-arr.nbytes // ALIGN) * ALIGN
+    header = json.dumps({'count': len(records), 'node_size': NODE_SIZE, 'arrays': layout}).encode()
+    start = -(-(len(MAGIC) + 4 + len(header)) // ALIGN) * ALIGN
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for name, arr in arrays.items():
+            f.seek(start + layout[name][2])
+            f.write(arr.tobytes())
+        f.truncate(start + offset)
+    os.replace(path + '.tmp', path)
+
+    return {'file': os.path.basename(path), 'count': len(records),
+            't_min': int(arrays['t_start'].min()), 't_max': int(arrays['t_end'].max()),
+            'max_h5id': int(arrays['h5id'].max())}
+
+
+class Segment:
+    # a segment file mapped read only; exact geometries are parsed on first use
+
+    def __init__(self, path):
+
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a footprint index segment: %s' % path)
+        size, = struct.unpack_from('<I', self._mm, len(MAGIC))
+        header = json.loads(self._mm[len(MAGIC) + 4:len(MAGIC) + 4 + size].decode())
+        start = -(-(len(MAGIC) + 4 + size) // ALIGN) * ALIGN
+        self.count = header['count']
+        self.node_size = header['node_size']
+        for name, (dtype, shape, offset) in header['arrays'].items():
+            count = int(np.prod(shape)) if len(shape) > 0 else 1
+            arr = np.frombuffer(self._mm, dtype=dtype, count=count, offset=start + offset).reshape(shape)
+            setattr(self, name, arr)
+        self._geoms = None
+        self._fnames = None
+
+    def close(self):
+
+        self._geoms = None
+        self._fnames = None
+        for name in ('boxes', 'h5id', 't_start', 't_end', 'wkb_data', 'wkb_off', 'name_data', 'name_off',
+                     'nodes', 'level_off'):
+            setattr(self, name, None)
+        self._mm.close()
+
+    def geoms(self):
+
+        if self._geoms is None:
+            self._geoms = shapely.from_wkb([self.wkb(i) for i in range(self.count)])
+        return self._geoms
+
+    def wkb(self, item):
+        return self.wkb_data[self.wkb_off[item]:self.wkb_off[item + 1]].tobytes()
+
+    def fname(self, item):
+        return self.name_data[self.name_off[item]:self.name_off[item + 1]].tobytes().decode()
+
+    def fnames(self):
+
+        if self._fnames is None:
+            self._fnames = set(self.fname(i) for i in range(self.count))
+        return self._fnames
+
+    def hit(self, item):
+        return Hit(self.fname(item), int(self.h5id[item]) if self.h5id[item] >= 0 else None,
+                   from_us(self.t_start[item]), from_us(self.t_end[item]))
+
+    def records(self):
+        return [(int(self.h5id[i]), self.fname(i), int(self.t_start[i]), int(self.t_end[i]), self.wkb(i))
+                for i in range(self.count)]
+
+    def search(self, qboxes):
+        # (query, item) pairs whose bounding boxes intersect, level by level down the packed tree
+
+        def overlap(q, b):
+            return ((qboxes[q, 0] <= b[:, 2]) & (qboxes[q, 2] >= b[:, 0]) &
+                    (qboxes[q, 1] <= b[:, 3]) & (qboxes[q, 3] >= b[:, 1]))
+
+        nlevels = len(self.level_off) - 1
+        if nlevels == 0:
+            count = self.count
+        else:
+            count = int(self.level_off[nlevels] - self.level_off[nlevels - 1])
+        q = np.repeat(np.arange(len(qboxes)), count)
+        node = np.tile(np.arange(count), len(qboxes))
+
+        for level in range(nlevels, -1, -1):
+            if level == 0:
+                boxes = self.boxes
+            else:
+                boxes = self.nodes[self.level_off[level - 1]:self.level_off[level]]
+            keep = overlap(q, boxes[node])
+            q, node = q[keep], node[keep]
+            if level == 0 or len(q) == 0:
+                break
+            # children of node j are entries j*size .. (j+1)*size of the level below
+            below = self.count if level == 1 else int(self.level_off[level - 1] - self.level_off[level - 2])
+            first = node * self.node_size
+            lens = np.minimum(first + self.node_size, below) - first
+            q = np.repeat(q, lens)
+            node = np.repeat(first - np.cumsum(lens) + lens, lens) + np.arange(int(lens.sum()))
+
+        return q, node
+
+
+class FootprintIndex:
+
+    def __init__(self, path, kind='gring', bucket_seconds=BUCKET_SECONDS):
+        # kind and bucket size are fixed when the index is created; max_h5id is the watermark of
+        # export_from_db: every file up to it was exported by an unfiltered build
+
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest = {'version': 1, 'kind': kind, 'bucket_seconds': bucket_seconds, 'max_h5id': 0,
+                         'segments': []}
+        if os.path.exists(self._manifest_path()):
+            with open(self._manifest_path(), 'r') as f:
+                self.manifest = json.load(f)
+        self.kind = self.manifest['kind']
+        self._open = {}
+
+    def _manifest_path(self):
+        return os.path.join(self.path, MANIFEST)
+
+    def _save(self):
+
+        tmp = self._manifest_path() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp, self._manifest_path())
+
+    def __len__(self):
+        return sum(i['count'] for i in self.manifest['segments'])
+
+    def close(self):
+
+        for seg in self._open.values():
+            seg.close()
+        self._open = {}
+
+    def _segment(self, entry):
+
+        seg = self._open.get(entry['file'])
+        if seg is None:
+            seg = self._open[entry['file']] = Segment(os.path.join(self.path, entry['file']))
+        return seg
+
+    def record_of(self, finfo, h5id=None):
+        # index record of a parsed file, None if it has no footprint of this kind
+
+        if not finfo.is_h5 or finfo.dt_start is None:
+            return None
+        finfo.footprints = file_footprints(finfo)
+        wkbhex = finfo.footprints.get(self.kind)
+        if wkbhex is None:
+            return None
+        return (h5id if h5id is not None else -1, finfo.filename, int(to_us(finfo.dt_start)),
+                int(to_us(finfo.dt_end)), ewkb_bytes(wkbhex))
+
+    def append(self, records):
+        # add (h5id or -1, fname, dt_start, dt_end, EWKB hex or bytes) records, one new segment per bucket
+        # a file is in the bucket of its dt_start, files already in that bucket are skipped;
+        # returns the number of files added
+
+        bucket_us = self.manifest['bucket_seconds'] * 1000000
+        by_bucket = {}
+        for h5id, fname, dt_start, dt_end, ewkb in records:
+            start, end = int(to_us(dt_start)), int(to_us(dt_end))
+            by_bucket.setdefault(start // bucket_us, {})[fname] = (h5id, fname, start, end, ewkb)
+
+        added = 0
+        for bucket, bucket_records in sorted(by_bucket.items()):
+            known = set()
+            for entry in self._bucket_entries(bucket):
+                known |= self._segment(entry).fnames()
+            new = [(h5id, fname, start, end, ewkb_bytes(ewkb))
+                   for fname, (h5id, _, start, end, ewkb) in bucket_records.items() if fname not in known]
+            if len(new) == 0:
+                continue
+            self._add_segment(bucket, new)
+            added += len(new)
+            if len(self._bucket_entries(bucket)) > MAX_SEGMENTS:
+                self._merge(bucket)
+        self._save()
+        return added
+
+    def _bucket_entries(self, bucket):
+        return [i for i in self.manifest['segments'] if i['bucket'] == bucket]
+
+    def _next_seq(self, bucket):
+        return max([int(i['file'].split('-')[1].split('.')[0]) for i in self._bucket_entries(bucket)] + [0]) + 1
+
+    def _add_segment(self, bucket, records, seq=None):
+
+        day = from_us(bucket * self.manifest['bucket_seconds'] * 1000000).strftime('%Y%m%dT%H%M%S')
+        if seq is None:
+            seq = self._next_seq(bucket)
+        entry = write_segment(os.path.join(self.path, '%s-%04d%s' % (day, seq, SEGMENT_EXT)), records)
+        entry['bucket'] = bucket
+        self.manifest['segments'].append(entry)
+
+    def _merge(self, bucket):
+        # one segment for all files of a bucket, the same file name only once
+
+        entries = self._bucket_entries(bucket)
+        seq = self._next_seq(bucket)
+        records = {}
+        for entry in entries:
+            for record in self._segment(entry).records():
+                records[record[1]] = record
+        for entry in entries:
+            seg = self._open.pop(entry['file'], None)
+            if seg is not None:
+                seg.close()
+            self.manifest['segments'].remove(entry)
+        self._add_segment(bucket, list(records.values()), seq)
+        # the manifest stops pointing at the old segments before they go; a crash in between
+        # leaves unreferenced files, never a manifest entry without its file
+        self._save()
+        for entry in entries:
+            os.remove(os.path.join(self.path, entry['file']))
+
+    def compact(self):
+        # merge the segments of every bucket that has more than one
+
+        buckets = collections.Counter(i['bucket'] for i in self.manifest['segments'])
+        for bucket, count in buckets.items():
+            if count > 1:
+                self._merge(bucket)
+        self._save()
+
+    def _candidates(self, t_start, t_end):
+        # segments whose time range overlaps [t_start, t_end] (us), all of them without a time
+
+        for entry in self.manifest['segments']:
+            if t_start is None or (entry['t_min'] <= t_end and entry['t_max'] >= t_start):
+                yield entry
+
+    def _query(self, qboxes, t_start, t_end, refine):
+        # [(query index array, segment, item array)] after the time filter and refine(geoms, q) -> mask
+
+        qboxes = np.asarray(qboxes, dtype=np.float64).reshape(-1, 4)
+        found = []
+        lo = None if t_start is None else int(t_start.min())
+        hi = None if t_end is None else int(t_end.max())
+        for entry in self._candidates(lo, hi):
+            seg = self._segment(entry)
+            q, item = seg.search(qboxes)
+            if t_start is not None:
+                keep = (seg.t_start[item] <= t_end[q]) & (seg.t_end[item] >= t_start[q])
+                q, item = q[keep], item[keep]
+            if len(q) > 0:
+                keep = refine(seg.geoms()[item], q)
+                q, item = q[keep], item[keep]
+            if len(q) > 0:
+                found.append((q, seg, item))
+        return found
+
+    @staticmethod
+    def _times(times, count, start=None, end=None):
+        # (start, end) arrays in us per query, None without a time filter
+
+        if times is not None:
+            t = np.broadcast_to(to_us(times), (count,))
+            return t, t
+        if start is None and end is None:
+            return None, None
+        lo = np.iinfo(np.int64).min if start is None else to_us(start)
+        hi = np.iinfo(np.int64).max if end is None else to_us(end)
+        return np.broadcast_to(lo, (count,)), np.broadcast_to(hi, (count,))
+
+    def query_points(self, lons, lats, times=None):
+        # (query index array, [Hit, ...]) of the files covering each point, at each time if given
+
+        lons = np.asarray(lons, dtype=np.float64).reshape(-1)
+        lats = np.asarray(lats, dtype=np.float64).reshape(-1)
+        t_start, t_end = self._times(times, len(lons))
+        found = self._query(np.column_stack([lons, lats, lons, lats]), t_start, t_end,
+                            lambda geoms, q: shapely.intersects_xy(geoms, lons[q], lats[q]))
+        return self._collect(found)
+
+    def query_point(self, lon, lat, time=None):
+        # [Hit, ...] of the files covering one point
+        return self.query_points([lon], [lat], None if time is None else [time])[1]
+
+    def query_bboxes(self, bboxes, start=None, end=None):
+        # (query index array, [Hit, ...]) of the files intersecting each (west, south, east, north) box
+
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        t_start, t_end = self._times(None, len(bboxes), start, end)
+        boxes = shapely.box(bboxes[:, 0], bboxes[:, 1], bboxes[:, 2], bboxes[:, 3])
+        found = self._query(bboxes, t_start, t_end, lambda geoms, q: shapely.intersects(geoms, boxes[q]))
+        return self._collect(found)
+
+    def query_bbox(self, bbox, start=None, end=None):
+        return self.query_bboxes([bbox], start, end)[1]
+
+    def query_geometry(self, geom, start=None, end=None):
+        # [Hit, ...] of the files intersecting a shapely geometry
+
+        t_start, t_end = self._times(None, 1, start, end)
+        found = self._query([geom.bounds], t_start, t_end, lambda geoms, q: shapely.intersects(geoms, geom))
+        return self._collect(found)[1]
+
+    @staticmethod
+    def _collect(found):
+
+        if len(found) == 0:
+            return np.zeros(0, dtype=np.int64), []
+        qidx = np.concatenate([q for q, _, _ in found])
+        hits = [seg.hit(i) for _, seg, items in found for i in items]
+        order = np.argsort(qidx, kind='stable')
+        return qidx[order], [hits[i] for i in order]
+
+
+def export_from_db(index, conn, batch_size=catalog.BATCH_SIZE, overlap=EXPORT_OVERLAP, **filters):
+    # append the files of the database not in the index yet: h5id above the watermark less overlap,
+    # minus the files already indexed; filters as in catalog.file_filters
+    # only an unfiltered export moves the watermark, a filtered one leaves out files it has not seen
+    # returns the number of files added
+
+    alias = 'f'
+    where, params = catalog.file_filters(alias, **filters)
+    where.append(sql.SQL('{} > %s').format(sql.Identifier(alias, 'h5id')))
+    params.append(max(0, index.manifest['max_h5id'] - overlap))
+    join = None
+    gring = sql.Identifier(alias, 'gring')
+    if index.kind == 'gring_ncei':
+        gring = sql.Identifier('n', 'gring')
+        join = sql.SQL('JOIN {} {} ON {} = {}').format(sql.Identifier('gring_ncei'), sql.Identifier('n'),
+                                                      sql.Identifier('n', 'h5id'), sql.Identifier(alias, 'h5id'))
+    where.append(sql.SQL('{} IS NOT NULL').format(gring))
+    query = catalog.select('info_file_hdf5', alias, ['h5id', 'fname', 'dt_start', 'dt_end', gring], where,
+                           ('h5id',), join)
+
+    added = 0
+    seen = 0
+    for rows in catalog.stream(conn, query, params, batch_size):
+        added += index.append([(row.h5id, row.fname, row.dt_start, row.dt_end, row.gring) for row in rows])
+        seen = max([seen] + [row.h5id for row in rows])
+    if all(i is None for i in filters.values()) and seen > index.manifest['max_h5id']:
+        index.manifest['max_h5id'] = seen
+        index._save()
+    return added
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Build and query the local footprint index.')
+    parser.add_argument('action', choices=['build', 'query', 'compact', 'info'])
+    parser.add_argument('index', help='index directory')
+    parser.add_argument('--server', default='eogdev')
+    parser.add_argument('--kind', choices=['gring', 'gring_ncei'], default='gring',
+                        help='footprint of a new index: G-Ring of every file or NCEI gring of geolocation files')
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat, default=None)
+    parser.add_argument('--end', type=datetime.datetime.fromisoformat, default=None)
+    parser.add_argument('--ftype', nargs='+', default=None)
+    parser.add_argument('--point', type=float, nargs=2, default=None, metavar=('LON', 'LAT'))
+    parser.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'))
+    parser.add_argument('--overlap', type=int, default=EXPORT_OVERLAP,
+                        help='build: also look at this many h5ids below the largest indexed one')
+    parser.add_argument('--time', type=datetime.datetime.fromisoformat, default=None, help='with --point, files covering this time')
+    args = parser.parse_args(argv)
+
+    index = FootprintIndex(args.index, kind=args.kind)
+    try:
+        if args.action == 'build':
+            conn = catalog.DBInfo().make_con(args.server)
+            try:
+                added = export_from_db(index, conn, overlap=args.overlap, start=args.start, end=args.end,
+                                       ftype=args.ftype)
+            finally:
+                conn.close()
+            print('%s files added, %s in the index.' % (added, len(index)))
+        elif args.action == 'compact':
+            index.compact()
+            print('%s segments, %s files.' % (len(index.manifest['segments']), len(index)))
+        elif args.action == 'info':
+            print('%s: %s, %s segments, %s files, exported up to h5id %s' %
+                  (args.index, index.kind, len(index.manifest['segments']), len(index), index.manifest['max_h5id']))
+        else:
+            if args.point is not None:
+                hits = index.query_point(args.point[0], args.point[1], args.time)
+            elif args.bbox is not None:
+                hits = index.query_bbox(args.bbox, args.start, args.end)
+            else:
+                parser.error('query needs --point or --bbox')
+            for hit in hits:
+                print('%s %s %s' % (hit.fname, hit.dt_start.isoformat(), hit.dt_end.isoformat()))
+    finally:
+        index.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
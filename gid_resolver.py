@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# gname -> gid resolution for info_granule
+#
+# band files of one granule (SVM07..SVM16, GMTCO, SVDNB, GDNBO, derived
+# rasters) all need the same gid. gids are kept in a bounded LRU cache and
+# cache misses are inserted-if-absent and returned by a single statement, in
+# the transaction of the file that needs them, instead of an INSERT that fails
+# with IntegrityError plus a SELECT.
+
+import threading
+from collections import OrderedDict
+from psycopg2 import sql
+
+
+# insert the missing names and return the gid of every requested name
+# the second branch finds names that already existed (not returned by the insert)
+RESOLVE_SQL = sql.SQL('''
+WITH input(gname) AS (SELECT DISTINCT unnest(%s::text[])),
+ins AS (INSERT INTO {table}(gname) SELECT gname FROM input ON CONFLICT DO NOTHING RETURNING gname, gid)
+SELECT gname, gid, true FROM ins
+UNION ALL
+SELECT g.gname, g.gid, false FROM {table} g JOIN input i ON g.gname = i.gname
+''').format(table=sql.Identifier('info_granule'))
+
+# gids of granules already in the table, nothing is inserted
+LOOKUP_SQL = sql.SQL('SELECT gname, gid FROM {table} WHERE gname = ANY(%s::text[])').format(
+    table=sql.Identifier('info_granule'))
+
+# a concurrent insert of the same name can hide it from both branches of one
+# statement; those names are asked for again in a new statement
+MAX_ROUNDS = 3
+
+
+class GidResolver:
+
+    def __init__(self, max_size=100000):
+
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, gname):
+        # cached gid or None
+
+        with self._lock:
+            gid = self._cache.get(gname)
+            if gid is not None:
+                self._cache.move_to_end(gname)
+            return gid
+
+    def remember(self, gname, gid):
+        # only call with gids that are committed
+
+        with self._lock:
+            self._cache[gname] = gid
+            self._cache.move_to_end(gname)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def forget(self, gname):
+
+        with self._lock:
+            self._cache.pop(gname, None)
+
+    def resolve(self, cur, gnames):
+        # {gname: gid} for all gnames, inserting missing granules in the cursor's transaction;
+        # gids inserted here are only cached once the caller commits and calls remember()
+
+        found = {}
+        missing = []
+        for gname in set(gnames):
+            if gname is None:
+                continue
+            gid = self.get(gname)
+            if gid is None:
+                missing.append(gname)
+            else:
+                found[gname] = gid
+
+        for _ in range(MAX_ROUNDS):
+            if len(missing) == 0:
+                break
+            cur.execute(RESOLVE_SQL, (missing,))
+            for gname, gid, inserted in cur.fetchall():
+                found[gname] = gid
+                if not inserted:
+                    self.remember(gname, gid)
+            missing = [gname for gname in missing if gname not in found]
+
+        return found
+
+    def prefetch(self, conn, gnames, chunk_size=5000):
+        # cache the gids of a whole batch that already exist, e.g. all gnames of a directory listing
+        # missing granules are left to resolve() in the transaction of their first file, so a file
+        # that fails later leaves no granule row behind
+
+        gnames = [gname for gname in set(gnames) if gname is not None and self.get(gname) is None]
+        cur = conn.cursor()
+        try:
+            for start in range(0, len(gnames), chunk_size):
+                cur.execute(LOOKUP_SQL, (gnames[start:start + chunk_size],))
+                for gname, gid in cur.fetchall():
+                    self.remember(gname, gid)
+        finally:
+            cur.close()
+            conn.rollback()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# one pass index of an h5 file
+#
+# the file is walked once with visititems; datasets are looked up by their
+# name (the last path component) and the wanted granule attributes are read
+# while walking, so the extractors never rescan the content list
+
+import posixpath
+import h5py
+
+
+# granule attributes collected while indexing, matched by suffix
+GRANULE_ATTR_SUFFIXES = (
+    'G-Ring_Latitude',
+    'G-Ring_Longitude',
+    'Ascending/Descending_Indicator',
+)
+
+
+class H5Index:
+
+    def __init__(self, h5f, attr_suffixes=GRANULE_ATTR_SUFFIXES):
+
+        self.attr_suffixes = tuple(attr_suffixes)
+        self.paths = []  # every object path, in visit order
+        self.datasets = {}  # dataset name -> [paths]
+        self.granules = []  # paths of the *_Gran_N objects, in visit order
+        self.granule_attrs = {}  # granule path -> {attr name: value} for the wanted suffixes
+
+        h5f.visititems(self._visit)
+
+    def _visit(self, name, obj):
+
+        self.paths.append(name)
+
+        if isinstance(obj, h5py.Dataset):
+            self.datasets.setdefault(posixpath.basename(name), []).append(name)
+
+        if '_Gran_' in name:
+            self.granules.append(name)
+            attrs = {}
+            for key in obj.attrs.keys():
+                if key.endswith(self.attr_suffixes):
+                    attrs[key] = obj.attrs[key]
+            self.granule_attrs[name] = attrs
+
+    def find(self, name):
+        # paths of all datasets called name, e.g. find('Latitude')
+        return self.datasets.get(name, [])
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# streaming reductions over h5 datasets
+#
+# a dataset is read in row blocks aligned to its chunk layout, every reducer
+# sees each block once, so memory stays bounded by the block size no matter
+# how many granules are aggregated in the file
+
+import numpy as np
+
+import instrument
+
+
+# default amount of data read per block
+BLOCK_BYTES = 16 * 1024 * 1024
+
+
+class Reducer:
+    # base class: update() is called with every block, result() at the end
+
+    def update(self, block):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class MinMaxReducer(Reducer):
+    # min over values above the fill threshold, max over all values
+    # (fill values are large negative numbers and never win the max)
+
+    def __init__(self, fill=-999.3):
+
+        self.fill = fill
+        self.vmin = None
+        self.vmax = None
+
+    def update(self, block):
+
+        if block.size == 0:
+            return
+        bmax = block.max()
+        if self.vmax is None or bmax > self.vmax:
+            self.vmax = bmax
+
+        valid = block[block > self.fill]
+        if valid.size > 0:
+            bmin = valid.min()
+            if self.vmin is None or bmin < self.vmin:
+                self.vmin = bmin
+
+    def result(self):
+
+        if self.vmin is None:
+            return None
+        return np.array([self.vmin.tolist(), self.vmax.tolist()])
+
+
+def iter_blocks(dset, block_bytes=BLOCK_BYTES):
+    # yield consecutive row blocks of an array or h5py dataset
+
+    nrows = dset.shape[0]
+    if nrows == 0:
+        return
+    row_bytes = max(1, int(np.prod(dset.shape[1:], dtype=np.int64)) * dset.dtype.itemsize)
+    rows = max(1, block_bytes // row_bytes)
+
+    # align the block to whole chunks, so every chunk is decompressed only once
+    chunks = getattr(dset, 'chunks', None)
+    if chunks is not None:
+        rows = max(chunks[0], rows - rows % chunks[0])
+
+    for start in range(0, nrows, rows):
+        block = dset[start:min(start + rows, nrows)]
+        instrument.count_read(dset, block)
+        yield block
+
+
+@instrument.timed('parse.reduce_dataset')
+def reduce_dataset(dset, reducers, block_bytes=BLOCK_BYTES):
+    # run several reducers over a dataset in a single pass, returns their results
+
+    for block in iter_blocks(dset, block_bytes):
+        for reducer in reducers:
+            reducer.update(block)
+
+    return [reducer.result() for reducer in reducers]
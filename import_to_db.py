@@ -2,14 +2,29 @@
 
 import datetime
 import os
-import sys
 import subprocess
 import re
 import psycopg2
-from psycopg2 import sql
+from psycopg2 import sql, pool
 from tools import randomword
-from shapely import wkt, wkb
 from parse_file import InfoFile
+from footprint import read_ncei_edge, gring_ewkb, polygon_ewkb, to_hex
+from leap_second import LeapSecondManager
+import raster_od
+import raster_tiles
+import pg_binary
+from gid_resolver import GidResolver
+import instrument
+
+
+class IngestError(Exception):
+    # raised instead of exiting so batch runs can continue with the next file
+    pass
+
+
+class AlreadyIngested(IngestError):
+    # the file is already in the database and update mode is off
+    pass
 
 
 class DBInfo:
@@ -83,24 +98,60 @@ class DBInfo:
                                 password=server_info['pass'])
         return conn
 
+    def make_pool(self, server='boat', minconn=1, maxconn=4):
+        # thread safe pool, to be shared by all ImportToDB objects of a batch run
+        server_info = self.get(server)
+        return pool.ThreadedConnectionPool(minconn, maxconn,
+                                           database=server_info['database'],
+                                           host=server_info['host'],
+                                           port=server_info['port'],
+                                           user=server_info['user'],
+                                           password=server_info['pass'])
 
-class ImportToDB(object):
-
-    def __init__(self, file_path, update=False, server='boat'):
-
-        # parse h5 information
-        self.finfo = InfoFile()
-        self.finfo.parse_file(file_path)
-        self.gid = None
-        self.h5id = None
-        self.rastid = None
 
-        # prepare database connection
-        db_info = DBInfo()
-        self.server = db_info.get(server)
+class ImportToDB(object):
 
-        # start importing h5 info into database
-        self.import_to_db(update)
+    def __init__(self, file_path, update=False, server='boat', finfo=None, conn=None, pool=None,
+                 leap_second=None, raster_encoder='raster2pgsql', gid_resolver=None, array_encoding='binary',
+                 in_db_content=(), tile_size=raster_tiles.TILE_SIZE):
+
+        # one metrics record per file when instrumentation is on, see instrument.py
+        with instrument.file_scope(file_path):
+            # parse h5 information, unless a parsed InfoFile is handed over (batch mode)
+            # datasets are read lazily, only the pixels the import needs are touched
+            owns_finfo = finfo is None
+            if owns_finfo:
+                finfo = InfoFile(lazy=True)
+                finfo.parse_file(file_path)
+            self.finfo = finfo
+            self.gid = None
+            self.h5id = None
+            self.rastid = None
+
+            # prepare database connection
+            # an injected connection or pool is reused, otherwise one connection is opened per file
+            db_info = DBInfo()
+            self.server = db_info.get(server)
+            self.pool = pool
+            self._injected_conn = conn
+            self.conn = None
+            self.leap_second = leap_second if leap_second is not None else LeapSecondManager()
+            # 'raster2pgsql' spawns raster2pgsql -R, 'native' encodes the out-db raster in process
+            self.raster_encoder = raster_encoder
+            # 'binary' sends midtime/qf3/radiance factor/solz arrays with binary COPY, 'text' as array literals
+            self.array_encoding = array_encoding
+            # raster contents whose pixels are also loaded as in-db tiles of tile_size, see raster_tiles.py
+            self.in_db_content = in_db_content
+            self.tile_size = tile_size
+            # share one resolver across the files of a batch to reuse its gname -> gid cache
+            self.gid_resolver = gid_resolver if gid_resolver is not None else GidResolver()
+
+            # start importing h5 info into database
+            try:
+                self.import_to_db(update)
+            finally:
+                if owns_finfo:
+                    self.finfo.close()
         
     def make_conn(self):
 
@@ -111,10 +162,65 @@ class ImportToDB(object):
                                 password=self.server['pass']
                                 )
 
+    def _acquire_conn(self):
+
+        if self._injected_conn is not None:
+            return self._injected_conn
+        if self.pool is not None:
+            instrument.count('pool_checkouts')
+            return self.pool.getconn()
+        instrument.count('connections_opened')
+        return self.make_conn()
+
+    def _cursor(self):
+
+        # counts queries and written rows when instrumentation is on
+        return self.conn.cursor(cursor_factory=instrument.cursor_factory())
+
+    def _release_conn(self, conn):
+
+        if conn is None or conn is self._injected_conn:
+            return
+        if self.pool is not None:
+            self.pool.putconn(conn, close=bool(conn.closed))
+        else:
+            conn.close()
+
+    @instrument.timed('import.import_to_db')
     def import_to_db(self, update):
 
-        # do leap second check first
-        self._update_leap_second()
+        self.conn = self._acquire_conn()
+        try:
+            # do leap second check first
+            self._update_leap_second()
+
+            # all rows of this file are written in one transaction
+            try:
+                result = self._import_file(update)
+                self.conn.commit()
+                if self.gid is not None:
+                    self.gid_resolver.remember(self.finfo.gname, self.gid)
+            except psycopg2.Error as e:
+                self._rollback()
+                raise IngestError('Import failed for %s: %s' % (self.finfo.filename, e))
+            except BaseException:
+                self._rollback()
+                raise
+            return result
+        finally:
+            self._release_conn(self.conn)
+            self.conn = None
+
+    def _rollback(self):
+
+        if not self.conn.closed:
+            self.conn.rollback()
+        # ids found or created inside the aborted transaction are no longer valid
+        self.gid = None
+        self.h5id = None
+        self.rastid = None
+
+    def _import_file(self, update):
 
         if self.finfo.is_h5:
 
@@ -134,14 +240,14 @@ class ImportToDB(object):
                     self._insert_radiance_factor()
                 if self.finfo.is_geo:
                     self._insert_gring_ncei()
-                    self._insert_solz()
+                    if self.finfo.solz is not None:
+                        self._insert_solz()
 
             else:
                 if update:
                     self._update_file_info()
                 else:
-                    print('This HDF5 file is already in the database: %s' % filename)
-                    sys.exit(0)
+                    raise AlreadyIngested('This HDF5 file is already in the database: %s' % filename)
 
         else:
 
@@ -152,30 +258,34 @@ class ImportToDB(object):
 
                 self._insert_granule_info()
                 self._insert_file_raster_info()
+                if self.finfo.content in self.in_db_content:
+                    self._insert_raster_tiles()
                 # self._import_raster_od()
 
             else:
                 if update:
                     self._update_file_info()
+                    if self.finfo.content in self.in_db_content:
+                        self._insert_raster_tiles(replace=True)
                     # self._update_raster_od()
                 else:
-                    print('This raster file is already in the database: %s' % filename)
-                    sys.exit(0)
+                    raise AlreadyIngested('This raster file is already in the database: %s' % filename)
 
+        return True
+
+    @instrument.timed('import.ask_h5id')
     def _ask_h5id(self, filename):
 
         if self.h5id is not None:
             return self.h5id
 
-        conn = self.make_conn()
-        cur = conn.cursor()
+        cur = self._cursor()
         try:
             cur.execute(sql.SQL("SELECT h5id FROM {} WHERE fname=%s")
                         .format(sql.Identifier('info_file_hdf5')),
                         (filename,)
                         )
             result = cur.fetchall()
-            cur.close()
             if len(result) == 0:
                 print('h5id not found for file: %s' % filename)
                 return None
@@ -184,26 +294,24 @@ class ImportToDB(object):
                 print('Found h5id %s' % h5id)
                 self.h5id = h5id
                 return h5id
-        except psycopg2.Error:
-            print('h5id retrieve error.')
-            sys.exit(1)
+        except psycopg2.Error as e:
+            raise IngestError('h5id retrieve error: %s' % e)
         finally:
-            conn.close()
+            cur.close()
 
+    @instrument.timed('import.ask_rastid')
     def _ask_rastid(self, filename):
 
         if self.rastid is not None:
             return self.rastid
 
-        conn = self.make_conn()
-        cur = conn.cursor()
+        cur = self._cursor()
         try:
             cur.execute(sql.SQL("SELECT rastid FROM {} WHERE fname=%s")
                         .format(sql.Identifier('info_file_raster')),
                         (filename,)
                         )
             result = cur.fetchall()
-            cur.close()
             if len(result) == 0:
                 print('rastid not found for file: %s' % filename)
                 return None
@@ -212,19 +320,18 @@ class ImportToDB(object):
                 print('Found rastid %s' % rastid)
                 self.rastid = rastid
                 return rastid
-        except psycopg2.Error:
-            print('rastid retrieve error.')
-            sys.exit(1)
+        except psycopg2.Error as e:
+            raise IngestError('rastid retrieve error: %s' % e)
         finally:
-            conn.close()
+            cur.close()
 
+    @instrument.timed('import.ask_gid')
     def _ask_gid(self, gname):
 
         if self.gid is not None:
             return self.gid
 
-        conn = self.make_conn()
-        cur = conn.cursor()
+        cur = self._cursor()
 
         try:
             cur.execute(sql.SQL("SELECT gid FROM {} WHERE gname=%s")
@@ -232,7 +339,6 @@ class ImportToDB(object):
                         (gname,)
                         )
             result = cur.fetchall()
-            cur.close()
             if len(result) == 0:
                 print('gid not found for gname: %s' % gname)
                 return None
@@ -241,11 +347,10 @@ class ImportToDB(object):
                 print('Found gid: %s' % gid)
                 self.gid = gid
                 return gid
-        except psycopg2.Error:
-            print('gid retrieve error.')
-            sys.exit(1)
+        except psycopg2.Error as e:
+            raise IngestError('gid retrieve error: %s' % e)
         finally:
-            conn.close()
+            cur.close()
 
     def _make_temp_dir(self):
         # create temporary dir for CSV to be copied into db
@@ -258,84 +363,11 @@ class ImportToDB(object):
 
         return temp_dir
 
-    def _download_leap_second_file(self, dest_dir):
-
-        import ftplib
-        url = 'ftp://ftp.nist.gov/pub/time/leap-seconds.list'
-        # url = self.leap_second_file
-        filename = os.path.basename(url)
-        local_filename = os.path.join(dest_dir, filename)
-        file = open(local_filename, 'wb')
-
-        server, cwd = re.match('ftp://(.*?)/(.*)/', url).groups()
-        ftp = ftplib.FTP(server)
-        ftp.login('anonymous')
-        ftp.cwd(cwd)
-
-        try:
-            ftp.retrbinary("RETR " + filename, file.write)
-        except:
-            print("Error")
-
-        return local_filename
-
-    def _need_to_update_leap_second(self):
-
-        conn = self.make_conn()
-        cur = conn.cursor()
-        a = datetime.datetime(1980, 1, 1)  # default a old day
-        try:
-            cur.execute(sql.SQL('SELECT modified FROM {} ORDER BY modified DESC LIMIT 1')
-                        .format(sql.Identifier('leap_seconds')))
-            a = cur.fetchall()[0][0]
-        except:
-            print('Check leap second status failed, will proceed to update.')
-            return True
-        finally:
-            conn.close()
-        if datetime.datetime.now() - a > datetime.timedelta(days=170):
-            return True
-        else:
-            return False
-
+    @instrument.timed('import.update_leap_second')
     def _update_leap_second(self):
 
-        # check if the leap second table is up to date
-        ## select the modified date from the row with latest implement date leap_second table
-        ## if the date is within 1 month then do nothing
-        ## otherwise...
-        if not self._need_to_update_leap_second():
-            print('Leap second table is up to date.')
-            return
-        print('Leap second table needs to be updated.')
-        # download the latest leap second file
-        temp_dir = self._make_temp_dir()
-        leap_second_file = self._download_leap_second_file(temp_dir)
-        # parse the file
-        cdate = datetime.datetime.now()
-        epoch = datetime.datetime(1900, 1, 1)
-        f = open(leap_second_file, 'r')
-        for i in f:
-            if not i.startswith('#'):
-                ds, lp, ex = [j for j in i.split('\t') if j is not '']
-                dt = epoch + datetime.timedelta(seconds=int(ds))
-                try:
-                    conn = self.make_conn()
-                    cur = conn.cursor()
-                    cur.execute(sql.SQL('INSERT INTO {}(epoch_dt, epoch, leap_seconds, modified) VALUES ( %s, %s, %s, %s)')
-                                .format(sql.Identifier('leap_seconds')),
-                                [
-                                    dt.strftime('%Y-%m-%d'),
-                                    int(ds),
-                                    int(lp),
-                                    cdate.strftime('%Y-%m-%d')
-                                ])
-                    conn.commit()
-                    conn.close()
-                except psycopg2.IntegrityError:
-                    print('This leap second record already exists: %s %s' % (ds, lp))
-                except psycopg2.Error:
-                    print('Warning: Leap second record update failed.')
+        # checked once per process and database, see leap_second.py
+        self.leap_second.ensure(self.conn)
 
     def _update_file_info(self):
 
@@ -344,12 +376,13 @@ class ImportToDB(object):
         else:
             self._update_link_raster()
 
+    @instrument.timed('import.insert_file_raster_info')
     def _insert_file_raster_info(self):
 
         # get gid
         self.gid = self._ask_gid(self.finfo.gname)
         if self.gid is None:
-            sys.exit(1)
+            raise IngestError('gid not found for gname: %s' % self.finfo.gname)
 
         val = self._get_raster_od_hex()
 
@@ -376,11 +409,10 @@ class ImportToDB(object):
 
         col_names = ','.join(col_name_list)
 
-        conn = self.make_conn()
-        cur = conn.cursor()
+        cur = self._cursor()
 
         try:
-            cur.execute(sql.SQL('INSERT INTO {} (' + col_names + ') VALUES ' + sql_var)
+            cur.execute(sql.SQL('INSERT INTO {} (' + col_names + ') VALUES ' + sql_var + ' RETURNING rastid')
                         .format(sql.Identifier('info_file_raster')),
                         [
                             self.finfo.filename,
@@ -399,24 +431,41 @@ class ImportToDB(object):
                             self.finfo.content,
                             val
                         ])
-            conn.commit()
+            self.rastid = cur.fetchone()[0]
+            print('%s ingested.' % self.finfo.filename)
         except psycopg2.IntegrityError:
-            print('This file is already in the table: %s' % self.finfo.filename)
+            # another writer got there first; nothing of this file is kept
+            raise AlreadyIngested('This file is already in the table: %s' % self.finfo.filename)
         finally:
-            conn.close()
+            cur.close()
+
+    @instrument.timed('import.insert_raster_tiles')
+    def _insert_raster_tiles(self, replace=False):
 
+        rastid = self._ask_rastid(self.finfo.filename)
+        cur = self._cursor()
+        try:
+            if replace:
+                cur.execute(sql.SQL('DELETE FROM {} WHERE rastid = %s').format(sql.Identifier(raster_tiles.TILE_TABLE)),
+                            (rastid,))
+            # tiles are read, encoded and sent one band of tile rows at a time
+            count = raster_tiles.copy_tiles(cur, rastid, self.finfo.link, self.tile_size)
+        except ValueError as e:
+            # a TIFF layout the tile reader does not handle, e.g. LZW compression
+            raise IngestError('In-db tiles failed for %s: %s' % (self.finfo.filename, e))
+        finally:
+            cur.close()
+        print('Loaded %s in-db tiles for rastid %s' % (count, rastid))
+
+    @instrument.timed('import.insert_file_hdf5_info')
     def _insert_file_hdf5_info(self):
 
         # get gid
         self.gid = self._ask_gid(self.finfo.gname)
         if self.gid is None:
-            sys.exit(1)
+            raise IngestError('gid not found for gname: %s' % self.finfo.gname)
 
-        if self.finfo.ngranule == 1:
-            geo_obj = self._make_gring_info_single()
-        else:
-            geo_obj = self._make_gring_info_multi()
-        wkbhex = wkb.dumps(geo_obj, srid=4326, hex=True)
+        wkbhex = self._make_gring_info()
 
         # import file info
         col_name_list = [
@@ -451,11 +500,10 @@ class ImportToDB(object):
         # print(desc_val)
         col_names = ','.join(col_name_list)
 
-        conn = self.make_conn()
-        cur = conn.cursor()
+        cur = self._cursor()
 
         try:
-            cur.execute(sql.SQL('INSERT INTO {} (' + col_names + ') VALUES ' + sql_var)
+            cur.execute(sql.SQL('INSERT INTO {} (' + col_names + ') VALUES ' + sql_var + ' RETURNING h5id')
                         .format(sql.Identifier('info_file_hdf5')),
                         [
                             self.finfo.filename,
@@ -476,162 +524,93 @@ class ImportToDB(object):
                             wkbhex,
                             self.finfo.link
                         ])
-            conn.commit()
+            self.h5id = cur.fetchone()[0]
             print('%s ingested.' % self.finfo.filename)
         except psycopg2.IntegrityError:
-            print('This file is already in the table: %s' % self.finfo.filename)
+            # another writer got there first; nothing of this file is kept
+            raise AlreadyIngested('This file is already in the table: %s' % self.finfo.filename)
         finally:
-            conn.close()
+            cur.close()
 
+    @instrument.timed('import.insert_granule_info')
     def _insert_granule_info(self):
 
-        conn = self.make_conn()
-        cur = conn.cursor()
+        # insert-if-absent and return the gid in one statement, cached across files of a batch
+        cur = self._cursor()
         try:
-            cur.execute(sql.SQL("INSERT INTO {}(gname) VALUES (%s)")
-                        .format(sql.Identifier('info_granule')),
-                        [self.finfo.gname]
-                        )
-            conn.commit()
-        except psycopg2.IntegrityError:
-            print('This gname is already in the table: %s' % self.finfo.gname)
+            self.gid = self.gid_resolver.resolve(cur, [self.finfo.gname]).get(self.finfo.gname)
         finally:
             cur.close()
-            conn.close()
-
-    def _make_gring_info_single(self):
-
-        keys = list(self.finfo.gring.keys())
-        lat_gr_key = [i for i in keys if i.endswith('/G-Ring_Latitude')][0]
-        lon_gr_key = [i for i in keys if i.endswith('/G-Ring_Longitude')][0]
-        lat_gr = self.finfo.gring[lat_gr_key]
-        lon_gr = self.finfo.gring[lon_gr_key]
-
-        zipper = [' '.join([str(lon_gr[i][0]), str(lat_gr[i][0])]) for i in range(0, len(lat_gr))]
-        zipper.append(zipper[0])
-
-        wkt_text = 'POLYGON ((' + ','.join(zipper) + '))'
-        geo_obj = wkt.loads(wkt_text)
-
-        return geo_obj
-
-    def _make_gring_info_multi(self):
+        if self.gid is not None:
+            print('Found gid: %s' % self.gid)
 
-        ngra = self.finfo.ngranule
-        keys = list(self.finfo.gring.keys())
-        wkt_gr = []
-        for n in range(0, ngra):
-            lat_gr_key = [i for i in keys if i.endswith('_Gran_'+str(n)+'/G-Ring_Latitude')][0]
-            lon_gr_key = [i for i in keys if i.endswith('_Gran_'+str(n)+'/G-Ring_Longitude')][0]
-            lat_gr = self.finfo.gring[lat_gr_key]
-            lon_gr = self.finfo.gring[lon_gr_key]
-            zipper = [' '.join([str(lon_gr[i][0]), str(lat_gr[i][0])]) for i in range(0, len(lat_gr))]
-            zipper.append(zipper[0])
-            wkt_gr.append('(('+','.join(zipper)+'))')
-        wkt_text = 'MULTIPOLYGON ('+','.join(wkt_gr)+')'
-        geo_obj = wkt.loads(wkt_text)
+    @instrument.timed('import.make_gring_info')
+    def _make_gring_info(self):
 
-        return geo_obj
+        # polygon for a single granule, multipolygon for aggregated files, as hex EWKB
+        # reuses the footprint if it was computed (or cached) at parse time
+        if 'gring' not in self.finfo.footprints:
+            self.finfo.footprints['gring'] = to_hex(gring_ewkb(self.finfo.gring, self.finfo.ngranule))
+        return self.finfo.footprints['gring']
 
+    @instrument.timed('import.insert_solz')
     def _insert_solz(self):
 
-        h5id = self._ask_h5id(self.finfo.filename)
         val = self.finfo.solz
+        self._insert_array('solar_zenith', val, 'solar zenith min/max')
 
-        conn = self.make_conn()
-        cur = conn.cursor()
-        try:
-            cur.execute(sql.SQL('INSERT INTO {}(h5id, val) VALUES (' + ','.join(['%s'] * 2) + ')')
-                        .format(sql.Identifier('solar_zenith')),
-                        [
-                            h5id,
-                            val.tolist()
-                        ])
-
-            conn.commit()
-        except psycopg2.IntegrityError:
-            print('This solar zenith min/max insert already exists?')
-        # except psycopg2.Error:
-        #     print('solar zenith min/max insert failed.')
-        #     sys.exit(1)
-        finally:
-            conn.close()
-
+    @instrument.timed('import.insert_midtime')
     def _insert_midtime(self):
 
-        h5id = self._ask_h5id(self.finfo.filename)
         key = list(self.finfo.midtime.keys())[0]
         val = self.finfo.midtime[key]
+        self._insert_array('midtime', val, 'midtime')
 
-        conn = self.make_conn()
-        cur = conn.cursor()
-        try:
-            cur.execute(sql.SQL('INSERT INTO {}(h5id, val) VALUES (' + ','.join(['%s'] * 2) + ')')
-                        .format(sql.Identifier('midtime')),
-                        [
-                            h5id,
-                            val.tolist()
-                        ])
-
-            conn.commit()
-        except psycopg2.IntegrityError:
-            print('This midtime insert already exists?')
-        except psycopg2.Error:
-            print('midtime insert failed.')
-            sys.exit(1)
-        finally:
-            conn.close()
-
+    @instrument.timed('import.insert_qf3_scan_rdr')
     def _insert_qf3_scan_rdr(self):
 
-        h5id = self._ask_h5id(self.finfo.filename)
         key = list(self.finfo.qf3_scan_rdr.keys())[0]
         val = self.finfo.qf3_scan_rdr[key]
+        self._insert_array('qf3_scan_rdr', val, 'qf3_scan_rdr')
 
-        conn = self.make_conn()
-        cur = conn.cursor()
-        try:
-            cur.execute(sql.SQL('INSERT INTO {}(h5id, val) VALUES (' + ','.join(['%s'] * 2) + ')')
-                        .format(sql.Identifier('qf3_scan_rdr')),
-                        [
-                            h5id,
-                            val.tolist()
-                        ])
-            conn.commit()
-        except psycopg2.IntegrityError:
-            print('This qf3_scan_rdr insert already exists?')
-        except psycopg2.Error:
-            print('qf3_scan_rdr insert failed.')
-            sys.exit(1)
-        finally:
-            conn.close()
-
+    @instrument.timed('import.insert_radiance_factor')
     def _insert_radiance_factor(self):
 
-        h5id = self._ask_h5id(self.finfo.filename)
         key = list(self.finfo.radiance_factor.keys())[0]
         val = self.finfo.radiance_factor[key]
+        self._insert_array('radiance_factor', val, 'radiance_factor')
+
+    def _insert_array(self, table, val, what):
+
+        # one (h5id, val) row; binary COPY straight from the numpy buffer (see pg_binary.py),
+        # the text array literal of val.tolist() if disabled or the column type has no binary encoder
+        h5id = self._ask_h5id(self.finfo.filename)
 
-        conn = self.make_conn()
-        cur = conn.cursor()
+        cur = self._cursor()
         try:
-            cur.execute(sql.SQL('INSERT INTO {}(h5id, val) VALUES (' + ','.join(['%s'] * 2) + ')')
-                        .format(sql.Identifier('radiance_factor')),
-                        [
-                            h5id,
-                            val.tolist()
-                        ])
-            conn.commit()
-        except psycopg2.IntegrityError:
-            print('This radiance_factor insert already exists?')
-        except psycopg2.Error:
-            print('radiance_factor insert failed.')
-            sys.exit(1)
+            sent = False
+            if self.array_encoding == 'binary':
+                sent = pg_binary.copy_rows(cur, table, ['h5id', 'val'], [(h5id, val)])
+            if not sent:
+                cur.execute(sql.SQL('INSERT INTO {}(h5id, val) VALUES (' + ','.join(['%s'] * 2) + ')')
+                            .format(sql.Identifier(table)),
+                            [
+                                h5id,
+                                val.tolist()
+                            ])
+        except (psycopg2.Error, ValueError) as e:
+            # ValueError: values the column type cannot hold, see pg_binary.to_column_type
+            raise IngestError('%s insert failed: %s' % (what, e))
         finally:
-            conn.close()
+            cur.close()
 
+    @instrument.timed('import.get_raster_od_hex')
     def _get_raster_od_hex(self):
 
+        if self.raster_encoder == 'native':
+            # reads the GeoTIFF header only, see raster_od.py
+            return raster_od.get_raster_od_hex(self.finfo.link)
+
         # path = os.path.join(self.finfo.link, self.finfo.filename)
         ret = subprocess.Popen(['raster2pgsql', '-R', self.finfo.link], stdout=subprocess.PIPE)
         out = None
@@ -645,12 +624,12 @@ class ImportToDB(object):
 
         return val
 
+    @instrument.timed('import.update_link_hdf5')
     def _update_link_hdf5(self):
 
         h5id = self._ask_h5id(self.finfo.filename)
 
-        conn = self.make_conn()
-        cur = conn.cursor()
+        cur = self._cursor()
         try:
             cur.execute(sql.SQL('UPDATE {} SET link = %s WHERE h5id = %s')
                         .format(sql.Identifier('info_file_hdf5')),
@@ -658,22 +637,20 @@ class ImportToDB(object):
                             self.finfo.link,
                             h5id
                         ])
-            conn.commit()
             print('Update success.')
-        except psycopg2.Error:
-            print('Update error for h5id=%s: %s' % (h5id, self.finfo.link))
-            sys.exit(1)
+        except psycopg2.Error as e:
+            raise IngestError('Update error for h5id=%s: %s (%s)' % (h5id, self.finfo.link, e))
         finally:
-            conn.close()
+            cur.close()
 
+    @instrument.timed('import.update_link_raster')
     def _update_link_raster(self):
 
         rastid = self._ask_rastid(self.finfo.filename)
         val = self._get_raster_od_hex()
 
         # print('Update raster')
-        conn = self.make_conn()
-        cur = conn.cursor()
+        cur = self._cursor()
         try:
             cur.execute(sql.SQL('UPDATE {} SET rast = %s, link = %s WHERE rastid = %s')
                         .format(sql.Identifier('info_file_raster')),
@@ -682,13 +659,11 @@ class ImportToDB(object):
                             self.finfo.link,
                             rastid
                         ])
-            conn.commit()
             print('Update success.')
-        except psycopg2.Error:
-            print('Update error for rastid=%s: %s' % (rastid, self.finfo.link))
-            sys.exit(1)
+        except psycopg2.Error as e:
+            raise IngestError('Update error for rastid=%s: %s (%s)' % (rastid, self.finfo.link, e))
         finally:
-            conn.close()
+            cur.close()
 
     def _insert_link_dnb_loc(self):
         # insert records with link to gdnbo lat/lon grid
@@ -700,14 +675,13 @@ class ImportToDB(object):
         # save lat/lon grid to local files
 
 
+    @instrument.timed('import.insert_gring_ncei')
     def _insert_gring_ncei(self):
 
         h5id = self._ask_h5id(self.finfo.filename)
-        geo_obj = self._make_gring_ncei()
-        wkbhex = wkb.dumps(geo_obj, srid=4326, hex=True)
+        wkbhex = self._make_gring_ncei()
 
-        conn = self.make_conn()
-        cur = conn.cursor()
+        cur = self._cursor()
         try:
             cur.execute(sql.SQL('INSERT INTO {} (h5id, space, gring) VALUES ( %s, %s, %s )')
                         .format(sql.Identifier('gring_ncei')),
@@ -716,114 +690,37 @@ class ImportToDB(object):
                             self.finfo.space,
                             wkbhex
                         ])
-
-            conn.commit()
             print('Insert gring_ncei success.')
         # except psycopg2.Error:
         #     print('Insert gring_ncei failed for gid=%s: %s' %(gid, self.finfo.gname))
         #     sys.exit(1)
         finally:
-            conn.close()
+            cur.close()
 
+    @instrument.timed('import.make_gring_ncei')
     def _make_gring_ncei(self):
 
-        import numpy as np
-
         # this module makes ncei house baked gring from lat/lon grids provided in geolocation files
-        klats = list(self.finfo.latitude.keys())[0]
-        mlats = self.finfo.latitude[klats]
-        klons = list(self.finfo.longitude.keys())[0]
-        mlons = self.finfo.longitude[klons]
-        mlines, mcols = np.shape(np.array(mlats))
-
-        # dls = find(malts(:,1) > -999)
-        dls = np.where(mlats[:, 0] > -999)[0]
-        ndls = len(dls)
+        # vertices are normally extracted at parse time (InfoFile.ncei_edge) from the edge pixels only
+        if 'gring_ncei' in self.finfo.footprints:
+            return self.finfo.footprints['gring_ncei']
+
+        edge = self.finfo.ncei_edge
+        if edge is None and self.finfo.latitude != {} and self.finfo.longitude != {}:
+            klats = list(self.finfo.latitude.keys())[0]
+            klons = list(self.finfo.longitude.keys())[0]
+            edge = read_ncei_edge(self.finfo.latitude[klats], self.finfo.longitude[klons], self.finfo.ngranule)
+        if edge is None:
+            # every row of the latitude grid is fill
+            raise IngestError('No valid geolocation rows for gring_ncei: %s' % self.finfo.filename)
+        lons, lats = edge
 
-        granule_mode = True
         if self.finfo.ngranule > 1:
-            granule_mode = False
-
-        # cross180 = False
-        if granule_mode:
-            print('Granule Mode.')
-            bounds = [[0] * 2 for _ in range(6)]
-
-            # col based
-            bounds[0][1] = mlats[dls[0]][0]
-            bounds[0][0] = mlons[dls[0]][0]
-            bounds[1][1] = mlats[dls[0]][round(mcols/2) - 1]
-            bounds[1][0] = mlons[dls[0]][round(mcols/2) - 1]
-            bounds[2][1] = mlats[dls[0]][mcols - 1]
-            bounds[2][0] = mlons[dls[0]][mcols - 1]
-            bounds[3][1] = mlats[dls[-1]][mcols - 1]
-            bounds[3][0] = mlons[dls[-1]][mcols - 1]
-            bounds[4][1] = mlats[dls[-1]][round(mcols/2) - 1]
-            bounds[4][0] = mlons[dls[-1]][round(mcols/2) - 1]
-            bounds[5][1] = mlats[dls[-1]][0]
-            bounds[5][0] = mlons[dls[-1]][0]
-            # print([
-            #     [dls[0],0],
-            #     [dls[0],round(mcols/2)-1],
-            #     [dls[0],mcols-1],
-            #     [dls[-1],mcols-1],
-            #     [dls[-1],round(mcols/2)-1],
-            #     [dls[-1],0]
-            # ])
-            # print(bounds)
-            # input()
-
-            zipper = [
-                ' '.join([str(k) for k in bounds[i]]) for i in range(0, len(bounds))
-            ]
-            zipper.append(zipper[0])
-
+            print('Aggregate mode with %s granules.' % self.finfo.ngranule)
         else:
-
-            ngrans = self.finfo.ngranule
-            print('Aggregate mode with %s granules.' % ngrans)
-            bounds = [[0] * 2 for _ in range((6 + (ngrans - 1) * 2))]
-
-            # col based
-            bounds[0][1] = mlats[dls[0]][0]
-            bounds[0][0] = mlons[dls[0]][0]
-            bounds[1][1] = mlats[dls[0]][round(mcols / 2) - 1]
-            bounds[1][0] = mlons[dls[0]][round(mcols / 2) - 1]
-            bounds[2][1] = mlats[dls[0]][mcols - 1]
-            bounds[2][0] = mlons[dls[0]][mcols - 1]
-
-            for ngr in range(1, ngrans):
-                bounds[2 + ngr][1] = mlats[dls[round(ngr * ndls / ngrans) - 1]][mcols - 1]
-                bounds[2 + ngr][0] = mlons[dls[round(ngr * ndls / ngrans) - 1]][mcols - 1]
-
-            bounds[2 + ngrans][1] = mlats[dls[-1]][mcols - 1]
-            bounds[2 + ngrans][0] = mlons[dls[-1]][mcols - 1]
-            bounds[3 + ngrans][1] = mlats[dls[-1]][round(mcols / 2) - 1]
-            bounds[3 + ngrans][0] = mlons[dls[-1]][round(mcols / 2) - 1]
-            bounds[4 + ngrans][1] = mlats[dls[-1]][0]
-            bounds[4 + ngrans][0] = mlons[dls[-1]][0]
-
-            for ngr in range(1, ngrans):
-                bounds[4 + ngrans + ngr][1] = mlats[dls[round((ngrans - ngr) * ndls / ngrans) - 1]][0]
-                bounds[4 + ngrans + ngr][0] = mlons[dls[round((ngrans - ngr) * ndls / ngrans) - 1]][0]
+            print('Granule Mode.')
 
         # over pole test is skipped in this python port
 
-            zipper = [
-                ' '.join([str(k) for k in bounds[i]]) for i in range(0, len(bounds))
-            ]
-            zipper.append(zipper[0])
-
-        wkt_text = 'POLYGON ((' + ','.join(zipper) + '))'
-        # print(wkt_text)
-        geo_obj = wkt.loads(wkt_text)
-        # print(geo_obj)
-
-        return geo_obj
-
-
-
-
-
-
-
+        self.finfo.footprints['gring_ncei'] = to_hex(polygon_ewkb(lons, lats))
+        return self.finfo.footprints['gring_ncei']
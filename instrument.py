@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+# per-stage timing and I/O counters for the ingest path
+#
+# off by default; the decorators and counters then cost one global check.
+# when on, every file processed in a thread gets a record of
+#
+#   timings   stage name -> [calls, seconds]  (parse.*, footprint.*, import.*)
+#   counters  h5_bytes, connections_opened, pool_checkouts, queries,
+#             rows_written, parse_cache_hits, ...
+#
+# records are reported per file and summed per run, as JSON:
+#
+#   VIIRS_INGEST_METRICS=/tmp/metrics.json ./load_file.py file.h5
+#   ./load_batch.py --metrics /tmp/metrics.json /data/viirs/2019/001
+
+import atexit
+import contextlib
+import datetime
+import functools
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+import psycopg2.extensions
+
+
+METRICS_ENV = 'VIIRS_INGEST_METRICS'
+WRITE_STATUS = ('INSERT', 'UPDATE', 'DELETE')
+
+_enabled = False
+_local = threading.local()
+_lock = threading.Lock()
+_files = []  # records of finished files
+_run = None  # counters and timings outside of any file
+_run_start = None
+
+
+class FileMetrics:
+
+    __slots__ = ('path', 'counters', 'timings')
+
+    def __init__(self, path=None):
+
+        self.path = path
+        self.counters = {}
+        self.timings = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name, seconds, calls=1):
+
+        entry = self.timings.get(name)
+        if entry is None:
+            self.timings[name] = [calls, seconds]
+        else:
+            entry[0] += calls
+            entry[1] += seconds
+
+    def merge(self, record):
+        # add a record (as_dict) of the same file, e.g. from a parse process
+
+        for name, n in record['counters'].items():
+            self.count(name, n)
+        for name, (calls, seconds) in record['timings'].items():
+            self.add_time(name, seconds, calls)
+
+    def as_dict(self):
+        return {'path': self.path, 'counters': dict(self.counters),
+                'timings': {k: list(v) for k, v in self.timings.items()}}
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+
+    global _enabled, _run, _run_start
+    with _lock:
+        if not _enabled:
+            _enabled = True
+            _run = FileMetrics()
+            _run_start = time.time()
+
+
+def disable():
+
+    global _enabled
+    _enabled = False
+
+
+def reset():
+
+    global _run, _run_start
+    with _lock:
+        del _files[:]
+        _run = FileMetrics()
+        _run_start = time.time()
+
+
+def _current():
+    return getattr(_local, 'file', None)
+
+
+@contextlib.contextmanager
+def file_scope(path, parsed=None, collect=True, label='file'):
+    # collect metrics of one file in this thread; nested scopes reuse the outer one
+    # parsed: a record from the parse step to merge, collect=False keeps it out of the report
+    # (the caller ships metrics.as_dict() elsewhere, e.g. from a parse process)
+    # the wall time of the whole scope is recorded under label
+
+    if not _enabled or _current() is not None:
+        yield _current()
+        return
+
+    metrics = FileMetrics(path)
+    if parsed is not None:
+        metrics.merge(parsed)
+    _local.file = metrics
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.add_time(label, time.perf_counter() - start)
+        _local.file = None
+        if collect:
+            with _lock:
+                _files.append(metrics.as_dict())
+
+
+def count(name, n=1):
+
+    if not _enabled:
+        return
+    metrics = _current()
+    if metrics is not None:
+        metrics.count(name, n)
+    else:
+        with _lock:
+            _run.count(name, n)
+
+
+def count_read(source, data):
+    # h5_bytes for data read from source, unless source was already in memory
+
+    if _enabled and not isinstance(source, np.ndarray):
+        count('h5_bytes', np.asarray(data).nbytes)
+
+
+def add_time(name, seconds):
+
+    metrics = _current()
+    if metrics is not None:
+        metrics.add_time(name, seconds)
+    else:
+        with _lock:
+            _run.add_time(name, seconds)
+
+
+def timed(name):
+    # decorator: wall time of each call under name, when enabled
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    # counts statements, their time and the rows they wrote
+
+    def _done(self, start, writes=None):
+
+        add_time('db.execute', time.perf_counter() - start)
+        count('queries')
+        if writes is None:
+            status = self.statusmessage
+            writes = status is not None and status.split(' ', 1)[0] in WRITE_STATUS
+        if writes and self.rowcount > 0:
+            count('rows_written', self.rowcount)
+
+    def execute(self, query, vars=None):
+
+        start = time.perf_counter()
+        result = super().execute(query, vars)
+        self._done(start)
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+
+        start = time.perf_counter()
+        result = super().copy_expert(sql, file, size)
+        # COPY leaves no status message; rows are written by COPY ... FROM
+        text = sql if isinstance(sql, str) else sql.as_string(self)
+        self._done(start, writes='FROM STDIN' in text.upper())
+        return result
+
+
+def cursor_factory():
+    # for conn.cursor(cursor_factory=...), None (the default cursor) when off
+    return CountingCursor if _enabled else None
+
+
+def _sum(records):
+
+    total = FileMetrics()
+    for record in records:
+        total.merge(record)
+    return total
+
+
+def report():
+
+    with _lock:
+        files = list(_files)
+        run = _run.as_dict() if _run is not None else FileMetrics().as_dict()
+    total = _sum(files + [run])
+    return {
+        'created': datetime.datetime.now().isoformat(),
+        'started': datetime.datetime.fromtimestamp(_run_start).isoformat() if _run_start else None,
+        'files': files,
+        'run': {'files': len(files), 'counters': total.counters,
+                'timings': {k: v for k, v in sorted(total.timings.items())}},
+        'outside_files': run,
+    }
+
+
+def write_report(path):
+
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=1)
+    print('Metrics written to %s' % path)
+
+
+# environment switch for any entry point, reported when the main process exits
+if os.environ.get(METRICS_ENV):
+    enable()
+    if multiprocessing.parent_process() is None:
+        atexit.register(write_report, os.environ[METRICS_ENV])
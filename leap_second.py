@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# leap second table maintenance
+#
+# the leap_seconds table is checked once per process and database; when it is
+# stale it is refreshed from a local leap-seconds.list (the bundled copy, or the
+# file named by VIIRS_LEAP_SECONDS_FILE) with one bulk upsert. downloading from
+# NIST is only done when asked for, ingest nodes usually have no network.
+
+import datetime
+import os
+import re
+import tempfile
+import threading
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+
+BUNDLED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'leap-seconds.list')
+NIST_URL = 'ftp://ftp.nist.gov/pub/time/leap-seconds.list'
+NTP_EPOCH = datetime.datetime(1900, 1, 1)
+
+
+def parse_leap_second_file(path):
+    # returns (rows, expires); rows are [epoch_dt, epoch, leap_seconds], expires is a datetime or None
+
+    rows = []
+    expires = None
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('#@'):
+                # expiration date of the file, in NTP seconds
+                expires = NTP_EPOCH + datetime.timedelta(seconds=int(line[2:].split()[0]))
+                continue
+            fields = line.split('#')[0].split()
+            if len(fields) < 2:
+                continue
+            ds, lp = fields[:2]
+            dt = NTP_EPOCH + datetime.timedelta(seconds=int(ds))
+            rows.append([dt.strftime('%Y-%m-%d'), int(ds), int(lp)])
+
+    return rows, expires
+
+
+def download_leap_second_file(dest_dir, url=NIST_URL, timeout=30):
+
+    import ftplib
+    filename = os.path.basename(url)
+    local_filename = os.path.join(dest_dir, filename)
+
+    server, cwd = re.match('ftp://(.*?)/(.*)/', url).groups()
+    ftp = ftplib.FTP(server, timeout=timeout)
+    try:
+        ftp.login('anonymous')
+        ftp.cwd(cwd)
+        with open(local_filename, 'wb') as file:
+            ftp.retrbinary("RETR " + filename, file.write)
+    finally:
+        ftp.close()
+
+    return local_filename
+
+
+class LeapSecondManager:
+
+    # databases already checked by this process, shared by all instances
+    _checked = set()
+    _lock = threading.Lock()
+
+    # refresh the table when the newest row is older than this
+    max_age = datetime.timedelta(days=170)
+    # unique column of leap_seconds used by the upsert
+    conflict_column = 'epoch'
+
+    def __init__(self, source=None, download=False):
+
+        # source: local leap-seconds.list, defaults to $VIIRS_LEAP_SECONDS_FILE or the bundled copy
+        # download: fetch a fresh copy from NIST when the table is stale (needs network)
+        if source is None:
+            source = os.environ.get('VIIRS_LEAP_SECONDS_FILE', BUNDLED_FILE)
+        self.source = source
+        self.download = download
+
+    @staticmethod
+    def _server_key(conn):
+
+        params = conn.get_dsn_parameters()
+        return params.get('host'), params.get('port'), params.get('dbname')
+
+    @classmethod
+    def reset(cls):
+        # forget which databases were checked, e.g. in a long running process
+        with cls._lock:
+            cls._checked.clear()
+
+    def ensure(self, conn):
+        # make sure the table is current; commits on conn, call it outside a file transaction
+
+        key = self._server_key(conn)
+        if key in self._checked:
+            return
+        with self._lock:
+            if key in self._checked:
+                return
+            if self.need_update(conn):
+                print('Leap second table needs to be updated.')
+                self.update(conn)
+            else:
+                print('Leap second table is up to date.')
+                conn.commit()
+            self._checked.add(key)
+
+    def need_update(self, conn):
+
+        cur = conn.cursor()
+        try:
+            cur.execute(sql.SQL('SELECT modified FROM {} ORDER BY modified DESC LIMIT 1')
+                        .format(sql.Identifier('leap_seconds')))
+            result = cur.fetchall()
+        except psycopg2.Error:
+            print('Check leap second status failed, will proceed to update.')
+            conn.rollback()
+            return True
+        finally:
+            cur.close()
+        if len(result) == 0:
+            return True
+        return datetime.datetime.now() - result[0][0] > self.max_age
+
+    def update(self, conn):
+
+        source = self.source
+        if self.download:
+            try:
+                source = download_leap_second_file(tempfile.mkdtemp(prefix='h5pg_'))
+            except Exception as e:
+                print('Leap second download failed, using %s: %s' % (self.source, e))
+
+        rows, expires = parse_leap_second_file(source)
+        if expires is not None and expires < datetime.datetime.now():
+            print('Warning: leap second file %s expired on %s.' % (source, expires.strftime('%Y-%m-%d')))
+
+        cdate = datetime.datetime.now().strftime('%Y-%m-%d')
+        cur = conn.cursor()
+        try:
+            execute_values(cur,
+                           sql.SQL('INSERT INTO {}(epoch_dt, epoch, leap_seconds, modified) VALUES %s '
+                                   'ON CONFLICT ({}) DO UPDATE SET leap_seconds = EXCLUDED.leap_seconds, '
+                                   'modified = EXCLUDED.modified')
+                           .format(sql.Identifier('leap_seconds'), sql.Identifier(self.conflict_column))
+                           .as_string(conn),
+                           [row + [cdate] for row in rows])
+            conn.commit()
+            print('Leap second table updated with %s records.' % len(rows))
+        except psycopg2.Error as e:
+            conn.rollback()
+            print('Warning: Leap second record update failed: %s' % e)
+        finally:
+            cur.close()
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+# batch ingest driver: parse many files in a process pool and hand the parsed
+# InfoFile objects to a few DB writer threads, so the interpreter start-up cost
+# is paid once per run instead of once per file.
+#
+#   ./load_batch.py --server eogdev --workers 8 --writers 2 /data/viirs/2019/001
+#   ./load_batch.py --file-list todo.txt
+#   ./load_batch.py --manifest ~/viirs_manifest.sqlite /data/viirs   (only new or changed files)
+#   ./load_batch.py --stage-dir /scratch/stage --run-id r1 /data/viirs   (no database, see load_stage.py)
+#   ./load_batch.py --footprint-index /data/fpindex /data/viirs   (also append footprints to a local index)
+#   ./load_batch.py --checkpoint run.ckpt --attempts 5 /data/viirs   (resumable, transient errors retried)
+
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from parse_file import InfoFile
+from import_to_db import DBInfo, ImportToDB, AlreadyIngested, IngestError
+from preflight import filter_new_files
+from gid_resolver import GidResolver
+from fname_parser import decode_names
+from pipeline import run_pipeline
+from parse_cache import ParseCache, MAX_BYTES
+from manifest import Manifest, DONE, FAILED
+from copy_stage import StageWriter
+from footprint_index import FootprintIndex
+from checkpoint import Checkpoint, RetryPolicy, ATTEMPTS
+from raster_tiles import IN_DB_CONTENT, TILE_SIZE
+import instrument
+
+
+SUPPORTED_EXT = ('.h5', '.tif')
+
+# parse cache of this process, see init_worker
+_parse_cache = None
+
+
+def collect_files(inputs, file_list=None):
+    # expand files, directories (recursively) and an optional list file into paths
+
+    paths = []
+    if file_list is not None:
+        with open(file_list, 'r') as f:
+            paths.extend([i.strip() for i in f if i.strip() != '' and not i.startswith('#')])
+
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(SUPPORTED_EXT):
+                        paths.append(os.path.join(root, name))
+        else:
+            paths.append(item)
+
+    return paths
+
+
+def init_worker(cache_path, max_bytes, instrumented=False):
+    # pool initializer, also called in the main process for pipeline mode
+
+    global _parse_cache
+    _parse_cache = ParseCache(cache_path, max_bytes) if cache_path is not None else None
+    if instrumented:
+        instrument.enable()
+
+
+def parse_worker(path):
+    # runs in a pool process; never raises so one bad file cannot stop the pool
+    # returns (path, finfo, error, metrics record of the parse or None)
+
+    with instrument.file_scope(path, collect=False, label='file.parse') as metrics:
+        try:
+            if _parse_cache is not None:
+                finfo = _parse_cache.parse(path)
+            else:
+                # only what the import uses is read and sent back to the main process,
+                # the lat/lon grids stay in the file (the ncei gring edge is read at parse time)
+                with InfoFile(lazy=True) as finfo:
+                    finfo.parse_file(path)
+            error = None
+        except Exception as e:
+            finfo, error = None, repr(e)
+
+    return path, finfo, error, metrics.as_dict() if metrics is not None else None
+
+
+class BatchSummary:
+
+    def __init__(self, checkpoint=None):
+
+        self.ingested = []
+        self.skipped = []
+        self.failed = []
+        # Checkpoint every outcome is written to as it comes in
+        self.checkpoint = checkpoint
+        self._lock = threading.Lock()
+
+    def add(self, status, path, message=None, attempts=1):
+
+        if self.checkpoint is not None:
+            self.checkpoint.record(path, status, message, attempts)
+        with self._lock:
+            if status == 'ingested':
+                self.ingested.append(path)
+            elif status == 'skipped':
+                self.skipped.append(path)
+            else:
+                self.failed.append((path, message))
+
+    def resumed(self, paths):
+        # files with an outcome from an earlier run, counted as skipped but not recorded again
+
+        with self._lock:
+            self.skipped.extend(paths)
+
+    def report(self):
+
+        print('Batch summary: %s ingested, %s skipped, %s failed.' %
+              (len(self.ingested), len(self.skipped), len(self.failed)))
+        for path, message in self.failed:
+            print('FAILED %s: %s' % (path, message))
+
+
+class BatchIngest:
+
+    def __init__(self, server='eogdev', update=False, workers=4, writers=2, raster_encoder='raster2pgsql',
+                 mode='pool', parse_cache=None, parse_cache_bytes=MAX_BYTES, stage=None, footprint_index=None,
+                 checkpoint=None, retry=None, retry_failed=True, in_db_content=(), tile_size=TILE_SIZE):
+
+        self.server = server
+        self.update = update
+        self.workers = workers
+        self.writers = writers
+        self.raster_encoder = raster_encoder
+        # raster contents also loaded as in-db tiles, see raster_tiles.py
+        self.in_db_content = in_db_content
+        self.tile_size = tile_size
+        # 'pool': parse in worker processes, 'pipeline': reader and writer threads in one process
+        self.mode = mode
+        # on-disk cache of parsed HDF5 metadata, None to always parse
+        self.parse_cache = parse_cache
+        self.parse_cache_bytes = parse_cache_bytes
+        # StageWriter: write COPY files for load_stage.py instead of talking to the database
+        self.stage = stage
+        # FootprintIndex the footprints of the files written are appended to at the end of the run
+        self.footprint_index = footprint_index
+        self._footprints = []
+        self._footprints_lock = threading.Lock()
+        # Checkpoint of this job: files with a final outcome in it are not processed again
+        self.checkpoint = checkpoint
+        self.retry_failed = retry_failed
+        # RetryPolicy for transient database errors, default one attempt
+        self.retry = retry if retry is not None else RetryPolicy(attempts=1)
+        self.summary = BatchSummary(checkpoint)
+        self.pool = None
+        self.gid_resolver = GidResolver()
+
+    def write(self, path, finfo):
+        # runs in a writer thread
+
+        if self.stage is not None:
+            self.write_stage(path, finfo)
+            return
+        try:
+            # each attempt is one transaction, rolled back on failure
+            imp, attempts = self.retry.call(ImportToDB, path, update=self.update, server=self.server, finfo=finfo,
+                                            pool=self.pool, raster_encoder=self.raster_encoder,
+                                            gid_resolver=self.gid_resolver, in_db_content=self.in_db_content,
+                                            tile_size=self.tile_size, what=path)
+            self.summary.add('ingested', path, attempts=attempts)
+            self.add_footprint(finfo, imp.h5id)
+        except AlreadyIngested as e:
+            self.summary.add('skipped', path, str(e), getattr(e, 'attempts', 1))
+        except IngestError as e:
+            self.summary.add('failed', path, str(e), getattr(e, 'attempts', 1))
+        except Exception as e:
+            self.summary.add('failed', path, repr(e), getattr(e, 'attempts', 1))
+
+    def write_stage(self, path, finfo):
+
+        try:
+            self.stage.add(finfo)
+            self.summary.add('ingested', path)
+            self.add_footprint(finfo)
+        except Exception as e:
+            self.summary.add('failed', path, repr(e))
+
+    def add_footprint(self, finfo, h5id=None):
+
+        if self.footprint_index is None:
+            return
+        record = self.footprint_index.record_of(finfo, h5id)
+        if record is not None:
+            with self._footprints_lock:
+                self._footprints.append(record)
+
+    def flush_footprints(self):
+
+        if self.footprint_index is not None and len(self._footprints) > 0:
+            count = self.footprint_index.append(self._footprints)
+            print('Footprint index: %s files added.' % count)
+            self._footprints = []
+
+    def _with_conn(self, fn, *args):
+        # fn(conn, *args) on a pooled connection; a broken connection is dropped from the pool
+
+        conn = self.pool.getconn()
+        try:
+            return fn(conn, *args)
+        finally:
+            self.pool.putconn(conn, close=bool(conn.closed))
+
+    def preflight(self, paths):
+        # drop files already in the database before anything is opened
+
+        new_paths, known_paths = self.retry.call(self._with_conn, filter_new_files, paths, what='pre-flight')[0]
+        for path in known_paths:
+            self.summary.add('skipped', path)
+        print('Pre-flight: %s new, %s already in the database.' % (len(new_paths), len(known_paths)))
+
+        return new_paths
+
+    def prefetch_gids(self, paths):
+        # granule ids already in the database for the whole batch, decoded from the file names alone;
+        # new granules are inserted with their first file
+
+        gnames = [i for i in decode_names(paths)['gname'] if i is not None]
+        self.retry.call(self._with_conn, self.gid_resolver.prefetch, gnames, what='granule ids')
+
+    def write_record(self, record):
+        # writer side for records coming from parse_worker
+
+        path, finfo, error, parsed = record
+        # parse and write metrics end up in one record per file
+        with instrument.file_scope(path, parsed=parsed):
+            if error is not None:
+                self.summary.add('failed', path, error)
+            else:
+                self.write(path, finfo)
+
+    def run_process_pool(self, paths):
+        # parse in worker processes, write from threads of this process
+
+        # bound the number of parsed files waiting for a writer
+        slots = threading.BoundedSemaphore(self.writers * 2)
+
+        def done(_):
+            slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.writers) as writer_pool:
+            with multiprocessing.Pool(processes=self.workers, initializer=init_worker,
+                                      initargs=(self.parse_cache, self.parse_cache_bytes,
+                                                instrument.enabled())) as parse_pool:
+                for record in parse_pool.imap_unordered(parse_worker, paths):
+                    slots.acquire()
+                    writer_pool.submit(self.write_record, record).add_done_callback(done)
+
+    def run_pipeline(self, paths):
+        # reader and writer threads in this process, joined by a bounded queue
+
+        init_worker(self.parse_cache, self.parse_cache_bytes)
+        run_pipeline(paths, parse_worker, self.write_record,
+                     readers=self.workers, writers=self.writers, queue_size=self.writers * 2)
+
+    def run_mode(self, paths):
+
+        if self.mode == 'pipeline':
+            self.run_pipeline(paths)
+        else:
+            self.run_process_pool(paths)
+
+    def run_and_flush(self, paths):
+
+        try:
+            self.run_mode(paths)
+        finally:
+            self.flush_footprints()
+
+    def run(self, paths):
+
+        paths = [i for i in paths if i.endswith(SUPPORTED_EXT)]
+        if len(paths) == 0:
+            return self.summary
+
+        if self.checkpoint is not None:
+            paths, done = self.checkpoint.pending(paths, self.retry_failed)
+            self.summary.resumed(done)
+            print('Checkpoint: %s files done in earlier runs, %s to do.' % (len(done), len(paths)))
+            if len(paths) == 0:
+                return self.summary
+
+        if self.stage is not None:
+            # offline, no database connection at all
+            try:
+                self.run_and_flush(paths)
+            finally:
+                self.stage.close()
+            return self.summary
+
+        # one connection per writer, reused for every file of the run
+        self.pool = DBInfo().make_pool(self.server, minconn=1, maxconn=self.writers)
+        try:
+            if not self.update:
+                paths = self.preflight(paths)
+            self.prefetch_gids(paths)
+            self.run_and_flush(paths)
+        finally:
+            self.pool.closeall()
+            self.pool = None
+
+        return self.summary
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Ingest many VIIRS HDF5/GeoTIFF files.')
+    parser.add_argument('inputs', nargs='*', help='files or directories to ingest')
+    parser.add_argument('--file-list', default=None, help='text file with one path per line')
+    parser.add_argument('--server', default='eogdev')
+    parser.add_argument('--update', action='store_true', help='update links of files already ingested')
+    parser.add_argument('--mode', choices=['pool', 'pipeline'], default='pool',
+                        help='pool: parse in worker processes; pipeline: overlap reader and writer threads')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of parse processes (reader threads in pipeline mode)')
+    parser.add_argument('--writers', type=int, default=2, help='number of DB writer threads')
+    parser.add_argument('--raster-encoder', choices=['raster2pgsql', 'native'], default='raster2pgsql',
+                        help='how out-db rasters are encoded; native needs no PostGIS client tools')
+    parser.add_argument('--in-db', nargs='*', default=None, metavar='CONTENT',
+                        help='also load the pixels of these raster contents as in-db tiles, default %s' %
+                             ' '.join(IN_DB_CONTENT))
+    parser.add_argument('--tile-size', nargs=2, type=int, default=TILE_SIZE, metavar=('WIDTH', 'HEIGHT'),
+                        help='in-db tile size in pixels')
+    parser.add_argument('--parse-cache', default=None,
+                        help='SQLite file caching parsed HDF5 metadata between runs')
+    parser.add_argument('--parse-cache-mb', type=int, default=512, help='size limit of the parse cache')
+    parser.add_argument('--manifest', default=None,
+                        help='SQLite file of files seen; only new, changed or failed files are ingested')
+    parser.add_argument('--full-scan', action='store_true',
+                        help='with --manifest, stat every file even in directories that did not change')
+    parser.add_argument('--stage-dir', default=None,
+                        help='write COPY files under this directory instead of ingesting (see load_stage.py)')
+    parser.add_argument('--run-id', default=None, help='staging run name, default run-<date>T<time>')
+    parser.add_argument('--footprint-index', default=None,
+                        help='directory of a local footprint index to append the footprints of ingested files to')
+    parser.add_argument('--checkpoint', default=None,
+                        help='file recording the outcome of every file; a rerun resumes where it stopped')
+    parser.add_argument('--no-retry-failed', action='store_true',
+                        help='with --checkpoint, do not try files that failed in earlier runs again')
+    parser.add_argument('--attempts', type=int, default=ATTEMPTS,
+                        help='attempts per file on transient database errors (lost connection, deadlock, ...)')
+    parser.add_argument('--metrics', default=None,
+                        help='write per-file and per-run timings and I/O counters to this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.in_db is not None and args.stage_dir is not None:
+        # tiles are keyed by rastid, which staged files only get when load_stage.py runs
+        parser.error('--in-db cannot be combined with --stage-dir')
+    if args.metrics is not None:
+        instrument.enable()
+
+    manifest = None
+    if args.manifest is not None:
+        manifest = Manifest(args.manifest)
+        roots = list(args.inputs)
+        if args.file_list is not None:
+            roots.extend(collect_files([], args.file_list))
+        paths = manifest.scan(roots, SUPPORTED_EXT, full=args.full_scan)
+    else:
+        paths = collect_files(args.inputs, args.file_list)
+    checkpoint = Checkpoint(args.checkpoint) if args.checkpoint is not None else None
+    stage = None
+    if args.stage_dir is not None:
+        stage = StageWriter(args.stage_dir, args.run_id)
+        print('Staging to %s' % stage.run_dir)
+    batch = BatchIngest(server=args.server, update=args.update, workers=args.workers, writers=args.writers,
+                        raster_encoder=args.raster_encoder, mode=args.mode,
+                        parse_cache=args.parse_cache, parse_cache_bytes=args.parse_cache_mb * 1024 * 1024,
+                        stage=stage,
+                        footprint_index=FootprintIndex(args.footprint_index) if args.footprint_index else None,
+                        checkpoint=checkpoint, retry=RetryPolicy(args.attempts),
+                        retry_failed=not args.no_retry_failed,
+                        in_db_content=() if args.in_db is None else tuple(args.in_db or IN_DB_CONTENT),
+                        tile_size=tuple(args.tile_size))
+    try:
+        summary = batch.run(paths)
+    finally:
+        if manifest is not None:
+            # files not reported stay queued and are picked up by the next run
+            manifest.mark(batch.summary.ingested + batch.summary.skipped, DONE)
+            for path, message in batch.summary.failed:
+                manifest.mark([path], FAILED, message)
+            manifest.close()
+        if checkpoint is not None:
+            checkpoint.close()
+    summary.report()
+    if args.metrics is not None:
+        instrument.write_report(args.metrics)
+
+    return 1 if len(summary.failed) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
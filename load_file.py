@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 
-from import_to_db import ImportToDB
+from import_to_db import ImportToDB, AlreadyIngested, IngestError
 import sys
 
 file=sys.argv[1]
-b=ImportToDB(file, server='eogdev')
+try:
+    b=ImportToDB(file, server='eogdev')
+except AlreadyIngested as e:
+    print(e)
+    sys.exit(0)
+except IngestError as e:
+    print(e)
+    sys.exit(1)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# bulk load runs staged with "load_batch.py --stage-dir"
+#
+#   ./load_stage.py --server eogdev /scratch/stage/r1 /scratch/stage/r2
+#
+# each run is loaded in one transaction; runs with a LOADED marker are skipped
+# unless --force is given (files already in the database are never duplicated).
+# runs with part files still being written (*.copy.tmp) are not loaded
+
+import argparse
+import os
+import sys
+
+from import_to_db import DBInfo
+from leap_second import LeapSecondManager
+from copy_stage import load_run, LOADED_MARKER, RunIncomplete
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='COPY staged ingest runs into the database.')
+    parser.add_argument('runs', nargs='+', help='run directories under the stage directory')
+    parser.add_argument('--server', default='eogdev')
+    parser.add_argument('--force', action='store_true', help='load runs that were loaded before')
+    args = parser.parse_args(argv)
+
+    incomplete = 0
+    conn = DBInfo().make_con(args.server)
+    try:
+        LeapSecondManager().ensure(conn)
+        for run_dir in args.runs:
+            if os.path.exists(os.path.join(run_dir, LOADED_MARKER)) and not args.force:
+                print('Already loaded: %s' % run_dir)
+                continue
+            try:
+                counts = load_run(conn, run_dir)
+            except RunIncomplete as e:
+                print('Not loaded: %s' % e)
+                incomplete += 1
+                continue
+            print('Loaded %s: %s' % (run_dir, ', '.join('%s %s' % (k, v) for k, v in counts.items())))
+    finally:
+        conn.close()
+
+    return 1 if incomplete > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# local manifest of archive files for incremental ingest
+#
+# every file seen is kept in a SQLite file with its size, mtime and status
+# (queued, done, failed). a scan only returns files that are new, changed or
+# not done yet, so catch-up runs cost time in proportion to new data.
+#
+# directory mtimes are kept as well: a directory whose mtime did not change
+# has no added, removed or renamed files, and its files are not stat'ed again
+# (full=True stats every file, to also catch files rewritten in place).
+
+import os
+import sqlite3
+import time
+
+
+QUEUED = 'queued'
+DONE = 'done'
+FAILED = 'failed'
+
+CREATE_SQL = (
+    '''CREATE TABLE IF NOT EXISTS files (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        message TEXT,
+        updated REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS files_status ON files(status)',
+    '''CREATE TABLE IF NOT EXISTS dirs (
+        path TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL
+    )''',
+)
+
+
+class Manifest:
+
+    def __init__(self, db_path):
+
+        self.db_path = db_path
+        parent = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(parent, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        with self.conn:
+            for stmt in CREATE_SQL:
+                self.conn.execute(stmt)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _walk(self, root, extensions, full, dir_mtimes, found, dirs_seen):
+        # collect (path, size, mtime_ns) of files to check below root
+
+        stack = [root]
+        while len(stack) > 0:
+            top = stack.pop()
+            try:
+                mtime_ns = os.stat(top).st_mtime_ns
+                entries = list(os.scandir(top))
+            except OSError as e:
+                print('Cannot scan %s: %s' % (top, e))
+                continue
+            dirs_seen.append((top, mtime_ns))
+            unchanged = not full and dir_mtimes.get(top) == mtime_ns
+
+            for entry in sorted(entries, key=lambda i: i.name, reverse=True):
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif not unchanged and entry.name.endswith(extensions):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    found.append((entry.path, st.st_size, st.st_mtime_ns))
+
+    def scan(self, roots, extensions=('.h5', '.tif'), full=False):
+        # queue new and changed files below roots (directories or files) and
+        # return every queued or failed path of the manifest that still exists
+
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                 self.conn.execute('SELECT path, size, mtime_ns FROM files')}
+        dir_mtimes = dict(self.conn.execute('SELECT path, mtime_ns FROM dirs'))
+
+        roots = [os.path.abspath(root) for root in roots]
+        found = []
+        dirs_seen = []
+        for root in roots:
+            if os.path.isdir(root):
+                self._walk(root, extensions, full, dir_mtimes, found, dirs_seen)
+            elif os.path.exists(root):
+                st = os.stat(root)
+                found.append((root, st.st_size, st.st_mtime_ns))
+            else:
+                print('Not found: %s' % root)
+
+        now = time.time()
+        changed = [(path, size, mtime_ns, QUEUED, now) for path, size, mtime_ns in found
+                   if known.get(path) != (size, mtime_ns)]
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO files(path, size, mtime_ns, status, updated) '
+                                  'VALUES (?, ?, ?, ?, ?)', changed)
+            self.conn.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?)', dirs_seen)
+
+        pending = [path for path, in self.conn.execute('SELECT path FROM files WHERE status != ? ORDER BY path',
+                                                       (DONE,))]
+        prefixes = tuple(root.rstrip(os.sep) + os.sep for root in roots)
+        pending = [path for path in pending
+                   if (path in roots or path.startswith(prefixes)) and os.path.exists(path)]
+        print('Manifest: %s files checked, %s new or changed, %s to ingest.' %
+              (len(found), len(changed), len(pending)))
+
+        return pending
+
+    def mark(self, paths, status, message=None):
+
+        now = time.time()
+        with self.conn:
+            self.conn.executemany('UPDATE files SET status = ?, message = ?, updated = ? WHERE path = ?',
+                                  [(status, message, now, os.path.abspath(path)) for path in paths])
+
+    def counts(self):
+
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM files GROUP BY status'))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# on-disk cache of parsed HDF5 metadata
+#
+# a rebuild, a new server or a rerun after a failure parses the same files
+# again; the metadata InfoFile extracts (file name fields, gring, midtime,
+# qf3, radiance factors, solz, nscan, desc) and the computed footprints are
+# kept in a SQLite file, so repeat ingests skip HDF5 I/O entirely.
+#
+# entries are keyed by absolute path and only valid for the same size and
+# mtime; the least recently used entries are dropped when the cache grows
+# past max_bytes. the raster and lat/lon grids are never cached.
+
+import os
+import pickle
+import sqlite3
+import time
+
+from parse_file import InfoFile
+from footprint import file_footprints
+import instrument
+
+
+# bump when InfoFile gains or changes attributes, old entries are then ignored
+CACHE_VERSION = 1
+MAX_BYTES = 512 * 1024 * 1024
+
+CREATE_SQL = '''
+CREATE TABLE IF NOT EXISTS parse_cache (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    data BLOB NOT NULL
+)
+'''
+
+
+def _metadata_state(finfo):
+    # InfoFile state without h5 handles and without any grid data
+
+    state = finfo.__getstate__()
+    for field in InfoFile.LAZY_FIELDS:
+        state[field] = {}
+    return state
+
+
+class ParseCache:
+
+    def __init__(self, db_path, max_bytes=MAX_BYTES):
+
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        parent = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(parent, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(CREATE_SQL)
+            conn.execute('CREATE INDEX IF NOT EXISTS parse_cache_last_used ON parse_cache(last_used)')
+
+    def _connect(self):
+        # a short-lived connection per call: the cache is shared by pool processes and reader threads
+
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def get(self, path):
+        # cached InfoFile for path or None if missing or stale
+
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT data FROM parse_cache WHERE path = ? AND size = ? AND mtime_ns = ? '
+                               'AND version = ?', (path, st.st_size, st.st_mtime_ns, CACHE_VERSION)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with conn:
+                conn.execute('UPDATE parse_cache SET last_used = ? WHERE path = ?', (time.time(), path))
+        finally:
+            conn.close()
+
+        finfo = InfoFile.__new__(InfoFile)
+        finfo.__dict__.update(pickle.loads(row[0]))
+        self.hits += 1
+        instrument.count('parse_cache_hits')
+        return finfo
+
+    def put(self, path, finfo):
+        # store the metadata of a parsed file; footprints are computed here if not done yet
+
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        if finfo.footprints == {}:
+            finfo.footprints = file_footprints(finfo)
+        data = pickle.dumps(_metadata_state(finfo), protocol=pickle.HIGHEST_PROTOCOL)
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO parse_cache VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (path, st.st_size, st.st_mtime_ns, CACHE_VERSION, len(data), time.time(), data))
+                self._evict(conn)
+        finally:
+            conn.close()
+
+    def _evict(self, conn):
+        # drop least recently used entries until the cache is back under max_bytes
+
+        total, = conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM parse_cache').fetchone()
+        if total <= self.max_bytes:
+            return
+        drop = []
+        for path, nbytes in conn.execute('SELECT path, nbytes FROM parse_cache ORDER BY last_used'):
+            if total <= self.max_bytes:
+                break
+            drop.append((path,))
+            total -= nbytes
+        conn.executemany('DELETE FROM parse_cache WHERE path = ?', drop)
+
+    def parse(self, path):
+        # InfoFile for path, from the cache or parsed (lazily, file closed) and stored
+
+        finfo = self.get(path)
+        if finfo is not None:
+            return finfo
+
+        with InfoFile(lazy=True) as finfo:
+            finfo.parse_file(path)
+        if finfo.is_h5:
+            # GeoTIFFs are parsed from the file name only, nothing to save
+            self.put(path, finfo)
+        return finfo
+
+    def stats(self):
+
+        conn = self._connect()
+        try:
+            count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM parse_cache').fetchone()
+        finally:
+            conn.close()
+        return {'entries': count, 'bytes': total, 'hits': self.hits, 'misses': self.misses}
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 
 import os
-import re
-import datetime
 import h5py
 import numpy as np
+from footprint import read_ncei_edge
+from h5_reduce import reduce_dataset, MinMaxReducer
+from h5_index import H5Index
+from fname_parser import decode_name
+import instrument
 
 
 # from viirs_h5_db.h5_setting import InfoH5Setting
@@ -12,9 +15,15 @@ import numpy as np
 
 class InfoFile:
 
-    def __init__(self):
+    # large datasets that lazy mode keeps as h5py.Dataset references
+    LAZY_FIELDS = ('raster', 'latitude', 'longitude')
+
+    def __init__(self, lazy=False):
 
         # self.h5_setting = InfoH5Setting()
+        # lazy: keep the h5 file open and read big arrays only when asked for
+        self.lazy = lazy
+        self._h5f = None
         self.infile = None
         self.filename = None
         self.ftype = None
@@ -39,6 +48,8 @@ class InfoFile:
         self.longitude = {}
         # self.attribute = {}
         self.gring = {}  # only if is a geolocation file
+        self.ncei_edge = None  # (lons, lats) of the ncei gring vertices, geolocation file only
+        self.footprints = {}  # hex EWKB footprints once computed, see footprint.file_footprints
         self.nscan = None
 
         self.is_geo = False
@@ -50,6 +61,41 @@ class InfoFile:
         self.solz = None
         self.desc = {}
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getstate__(self):
+        # open h5 handles cannot be pickled; unloaded lazy datasets are dropped
+        state = self.__dict__.copy()
+        state['_h5f'] = None
+        for field in self.LAZY_FIELDS:
+            state[field] = {k: v for k, v in state[field].items() if isinstance(v, np.ndarray)}
+        return state
+
+    def close(self):
+
+        if self._h5f is not None:
+            # drop unread dataset references together with the file
+            for field in self.LAZY_FIELDS:
+                data = getattr(self, field)
+                for key in [k for k, v in data.items() if not isinstance(v, np.ndarray)]:
+                    del data[key]
+            self._h5f.close()
+            self._h5f = None
+
+    def load(self, *fields):
+        # read lazy datasets into memory, e.g. finfo.load('latitude', 'longitude')
+
+        for field in fields or self.LAZY_FIELDS:
+            data = getattr(self, field)
+            for key, val in data.items():
+                if not isinstance(val, np.ndarray):
+                    data[key] = val[()]
+                    instrument.count_read(val, data[key])
+
     def parse_h5(self, infile):
 
         self.parse_file_name(infile)
@@ -67,6 +113,7 @@ class InfoFile:
         # parse content to hex wkb is handled in import_to_db.py
         # self.parse_raster_content(infile)
 
+    @instrument.timed('parse.file')
     def parse_file(self, infile):
 
         if infile.endswith('.h5'):
@@ -92,98 +139,56 @@ class InfoFile:
 
         base_name, ext_name = os.path.splitext(os.path.basename(infile))
         self.filename = ''.join([base_name, ext_name])
-        print('Processing file: %s' % self.filename)
 
         #################
-        # general parsing
-
-        # get granule name
-        m = re.match('.*(..._d[0-9]{8}_t[0-9]{7}_e[0-9]{7}_b[0-9]{5}).*', self.filename)
-        if m is not None:
-            self.gname = m.groups()[0]
-
-        # get file type from full file name if available
-        full = re.match('(.....)_..._d[0-9]{8}_t[0-9]{7}_e[0-9]{7}_b[0-9]{5}_' +
-                        'c([0-9]{8})([0-9]{6})([0-9]{6})_(....)_(...).*', self.filename)
-        if full is not None:
-            self.ftype, cdate, ctime, ctimef, self.source, self.state = full.groups()
-            self.dt_create = (datetime.datetime.strptime('_'.join([cdate, ctime]), '%Y%m%d_%H%M%S') +
-                              datetime.timedelta(microseconds=float(ctimef)))
-
-        # get granule info from file name if available
-        parts = re.match('.*(...)_d([0-9]{8})_t([0-9]{6})([0-9])_e([0-9]{6})([0-9])_b([0-9]{5}).*', self.filename)
-        if parts is not None:
-            self.space_craft, date, ttime, ttimef, etime, etimef, orbit = parts.groups()
-
-            self.dt_start = (datetime.datetime.strptime('_'.join([date, ttime]), '%Y%m%d_%H%M%S') +
-                             datetime.timedelta(milliseconds=float(ttimef)*100))
-            self.dt_end = (datetime.datetime.strptime('_'.join([date, etime]), '%Y%m%d_%H%M%S') +
-                           datetime.timedelta(milliseconds=float(etimef)*100))
-            if self.dt_end < self.dt_start:
-                self.dt_end += datetime.timedelta(days=1)
-            self.orbit = int(orbit)
+        # general parsing, see fname_parser.py for the grammar
+
+        decoded = decode_name(self.filename)
+        self.gname = decoded['gname']
+        if decoded['ftype'] is not None:
+            self.ftype = decoded['ftype']
+            self.source = decoded['source']
+            self.state = decoded['state']
+            self.dt_create = decoded['dt_create']
+        if decoded['space_craft'] is not None:
+            self.space_craft = decoded['space_craft']
+            self.dt_start = decoded['dt_start']
+            self.dt_end = decoded['dt_end']
+            self.orbit = decoded['orbit']
 
         #########################
         # raster specific parsing
 
-        if '.lines.' in self.filename:
-            self.content = 'lines'
-            self.is_geo = True
-            self.reproj = True
-        elif '.samples' in self.filename:
-            self.content = 'samples'
-            self.is_geo = True
-            self.reproj = True
-        elif '.rade9.' in self.filename:
-            self.content = 'rade9'
-            self.reproj = True
-        elif '.srade9.' in self.filename:
-            self.content = 'srade9'
-            self.reproj = False
-        elif '.dspace_rad.' in self.filename:
-            self.content = 'dspace_rad'
-            self.reproj = False
-            self.space = 'D'
-        elif '.rad.' in self.filename:
-            self.content = 'rad'
-            self.reproj = True
-        elif '.vflag' in self.filename:
-            self.content = 'vflag'
-            self.reproj = True
-        elif '.dflag.' in self.filename:
-            self.content = 'dflag'
-            self.space = 'd'
-        elif '.dflagr.' in self.filename:
-            self.content = 'dflag'
-            self.space = 'd'
-            self.reproj = True
-        elif '.mflag.' in self.filename:
-            self.content = 'mflag'
-            self.space = 'm'
-        elif '.mflagr.' in self.filename:
-            self.content = 'mflag'
-            self.space = 'm'
-            self.reproj = True
-        elif '.blur.' in self.filename:
-            self.content = 'blur'
-        elif '.lon.' in self.filename:
-            self.content = 'longitude'
-            self.reproj = False
-        elif '.lat.' in self.filename:
-            self.content = 'latitude'
-            self.reporj = False
+        if decoded['content'] is not None:
+            self.content = decoded['content']
+            self.is_geo = self.is_geo or decoded['is_geo']
+            self.reproj = self.reproj or decoded['reproj']
+            if decoded['space'] is not None:
+                self.space = decoded['space']
 
+    @instrument.timed('parse.h5_content')
     def parse_h5_content(self, infile):
         # get target contents in the h5 file and store them in self var
 
-        print('Opening h5 file')
         h5f = h5py.File(infile,'r')
 
-        # retrieve content list
-        h5f.visit(self.content_list.append)
+        def read(dset):
+            data = np.array(dset)
+            instrument.count_read(dset, data)
+            return data
+
+        # in lazy mode big datasets are stored as references and read on demand
+        if self.lazy:
+            read_big = lambda dset: dset
+        else:
+            read_big = read
+
+        # retrieve content list, dataset lookup and granule attributes in one pass
+        index = H5Index(h5f)
+        self.content_list = index.paths
 
         # print(list(h5f.attrs.keys()))
-        if 'N_GEO_Ref' not in list(h5f.attrs.keys()):
+        if 'N_GEO_Ref' not in h5f.attrs:
             self.is_geo = True
         else:
             if h5f.filename.startswith('G'):
@@ -191,47 +196,50 @@ class InfoFile:
             else:
                 self.is_geo = False
 
-        for radiance_key in [i for i in self.content_list if i.endswith('/Radiance')]:
-            self.raster[radiance_key] = np.array(h5f[radiance_key])
+        for radiance_key in index.find('Radiance'):
+            self.raster[radiance_key] = read_big(h5f[radiance_key])
 
-        for factor_key in [i for i in self.content_list if i.endswith('/RadianceFactors')]:
-            self.radiance_factor[factor_key] = np.array(h5f[factor_key])
+        for factor_key in index.find('RadianceFactors'):
+            self.radiance_factor[factor_key] = read(h5f[factor_key])
 
-        for qf3_key in [i for i in self.content_list if i.endswith('/QF3_SCAN_RDR')]:
-            self.qf3_scan_rdr[qf3_key] = np.array(h5f[qf3_key])
+        for qf3_key in index.find('QF3_SCAN_RDR'):
+            self.qf3_scan_rdr[qf3_key] = read(h5f[qf3_key])
 
-        granule_group = [i for i in self.content_list if '_Gran_' in i]
-        self.ngranule = len(granule_group)  # count granule attribute groups
+        self.ngranule = len(index.granules)  # count granule attribute groups
 
         # granule specific attribute
         # gring is available in all files
-        for granule in granule_group:
-            for gring_key in [i for i in list(h5f[granule].attrs.keys()) if
-                              (i.endswith('G-Ring_Latitude') or i.endswith('G-Ring_Longitude'))]:
-                self.gring[os.path.join(granule, gring_key)] = np.array(h5f[granule].attrs[gring_key])
-            for desc_key in [i for i in list(h5f[granule].attrs.keys()) if
-                             i.endswith('Ascending/Descending_Indicator')]:
-                # print(granule, desc_key)
-                self.desc[os.path.join(granule, desc_key)] = h5f[granule].attrs[desc_key]
+        for granule in index.granules:
+            for key, val in index.granule_attrs[granule].items():
+                if key.endswith('G-Ring_Latitude') or key.endswith('G-Ring_Longitude'):
+                    self.gring[os.path.join(granule, key)] = np.array(val)
+                elif key.endswith('Ascending/Descending_Indicator'):
+                    self.desc[os.path.join(granule, key)] = val
 
         # geolocation file only extraction
         if self.is_geo:
-            for midtime_key in [i for i in self.content_list if i.endswith('/MidTime')]:
-                self.midtime[midtime_key] = np.array(h5f[midtime_key])
-            for lat_key in [i for i in self.content_list if i.endswith('/Latitude')]:
-                self.latitude[lat_key] = np.array(h5f[lat_key])
-            for lon_key in [i for i in self.content_list if i.endswith('/Longitude')]:
-                self.longitude[lon_key] = np.array(h5f[lon_key])
-            for solz_key in [i for i in self.content_list if i.endswith('/SolarZenithAngle')]:
-                sol_grid = np.array(h5f[solz_key])
-                # avoid select -999.3 as the min
-                self.solz = np.array([sol_grid[np.where(sol_grid > -999.3)].min().tolist(),
-                                      sol_grid.max().tolist()])
-
-        for nscan_key in [i for i in self.content_list if i.endswith('/NumberOfScans')]:
-            self.nscan = int(np.array(h5f[nscan_key])[0])
-
-        h5f.close()
+            for midtime_key in index.find('MidTime'):
+                self.midtime[midtime_key] = read(h5f[midtime_key])
+            for lat_key in index.find('Latitude'):
+                self.latitude[lat_key] = read_big(h5f[lat_key])
+            for lon_key in index.find('Longitude'):
+                self.longitude[lon_key] = read_big(h5f[lon_key])
+            if self.latitude != {} and self.longitude != {}:
+                # edge pixels only, read straight from the file with hyperslab selections
+                lat_key = list(self.latitude.keys())[0]
+                lon_key = list(self.longitude.keys())[0]
+                self.ncei_edge = read_ncei_edge(h5f[lat_key], h5f[lon_key], self.ngranule)
+            for solz_key in index.find('SolarZenithAngle'):
+                # streamed in row blocks, avoid select -999.3 as the min
+                self.solz, = reduce_dataset(h5f[solz_key], [MinMaxReducer(fill=-999.3)])
+
+        for nscan_key in index.find('NumberOfScans'):
+            self.nscan = int(read(h5f[nscan_key])[0])
+
+        if self.lazy:
+            self._h5f = h5f
+        else:
+            h5f.close()
 
     def ask_space(self):
         dspace = ['GDNBO', 'SVDNB']
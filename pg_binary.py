@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+# PostgreSQL binary COPY encoding of numpy arrays
+#
+# midtime, qf3_scan_rdr, radiance_factor and solar_zenith rows hold one array
+# per file. instead of val.tolist() rendered as a text array literal, a row is
+# sent with COPY ... (FORMAT binary), its array built from the numpy buffer
+# with a structured dtype: every element is a big-endian (length, value) pair,
+#
+#   array:  ndim(4) has_null(4) element oid(4) [size(4) lower bound(4)] * ndim
+#           [length(4) value] * n
+#   stream: PGCOPY\n\377\r\n\0 flags(4) extension(4)
+#           [nfields(2) [length(4) data] * nfields] * rows  -1(2)
+#
+# element types are read from the catalog once per database and table, so the
+# binary value always matches the column; decode_array() reads such an array
+# back (e.g. from COPY ... TO STDOUT (FORMAT binary)) into numpy.
+
+import io
+import struct
+import threading
+
+import numpy as np
+from psycopg2 import sql
+
+
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+COPY_HEADER = COPY_SIGNATURE + struct.pack('>ii', 0, 0)
+COPY_TRAILER = struct.pack('>h', -1)
+
+# type oid -> big-endian numpy dtype of the binary send format
+SCALAR_DTYPES = {
+    16: '?',      # bool
+    20: '>i8',    # int8
+    21: '>i2',    # int2
+    23: '>i4',    # int4
+    700: '>f4',   # float4
+    701: '>f8',   # float8
+}
+
+COLUMN_TYPES_SQL = ('SELECT a.attname, a.atttypid, t.typelem FROM pg_attribute a '
+                    'JOIN pg_type t ON t.oid = a.atttypid '
+                    'WHERE a.attrelid = to_regclass(%s) AND a.attnum > 0 AND NOT a.attisdropped')
+
+_types = {}  # (database, table) -> {column: (type oid, element oid)}
+_types_lock = threading.Lock()
+
+
+def _db_key(conn):
+
+    params = conn.get_dsn_parameters()
+    return params.get('host'), params.get('port'), params.get('dbname')
+
+
+def column_types(cur, table):
+    # {column: (type oid, element oid or 0)} of table, cached per database
+
+    key = (_db_key(cur.connection), table)
+    with _types_lock:
+        types = _types.get(key)
+    if types is None:
+        cur.execute(COLUMN_TYPES_SQL, (table,))
+        types = {name: (typ, elem) for name, typ, elem in cur.fetchall()}
+        with _types_lock:
+            _types[key] = types
+    return types
+
+
+def encode_scalar(val, oid):
+    return np.array(val, dtype=SCALAR_DTYPES[oid]).tobytes()
+
+
+def to_column_type(arr, dtype):
+    # arr converted to dtype; ValueError where a text array literal would be rejected by the server:
+    # another kind of number (floats into an integer column) or values out of the column's range
+
+    try:
+        # overflow to inf is checked below
+        with np.errstate(over='ignore'):
+            out = arr.astype(dtype, casting='same_kind')
+    except TypeError:
+        raise ValueError('Cannot store %s values in a %s column' % (arr.dtype, dtype))
+    if arr.size == 0:
+        return out
+    if dtype.kind in 'iu' and arr.dtype.kind in 'iub':
+        info = np.iinfo(dtype)
+        if arr.min() < info.min or arr.max() > info.max:
+            raise ValueError('Values %s..%s out of range for a %s column' % (arr.min(), arr.max(), dtype))
+    elif dtype.kind == 'f' and arr.dtype.kind == 'f':
+        if np.any(np.isinf(out) & np.isfinite(arr)):
+            raise ValueError('Values out of range for a %s column' % dtype)
+    return out
+
+
+def encode_array(arr, elem_oid):
+    # binary array value of a numpy array without nulls, elements converted to the column type
+
+    dtype = np.dtype(SCALAR_DTYPES[elem_oid])
+    arr = np.asarray(arr)
+    if arr.size == 0:
+        return struct.pack('>iii', 0, 0, elem_oid)
+
+    header = struct.pack('>iii', arr.ndim, 0, elem_oid)
+    dims = np.empty((arr.ndim, 2), dtype='>i4')
+    dims[:, 0] = arr.shape
+    dims[:, 1] = 1
+    items = np.empty(arr.size, dtype=[('len', '>i4'), ('val', dtype)])
+    items['len'] = dtype.itemsize
+    items['val'] = to_column_type(arr.reshape(-1), dtype)
+
+    return header + dims.tobytes() + items.tobytes()
+
+
+def encode_value(val, types):
+    # one field for a column of (type oid, element oid)
+
+    typ, elem = types
+    if val is None:
+        return None
+    if elem in SCALAR_DTYPES and typ not in SCALAR_DTYPES:
+        return encode_array(val, elem)
+    return encode_scalar(val, typ)
+
+
+def supported(types):
+    typ, elem = types
+    return typ in SCALAR_DTYPES or elem in SCALAR_DTYPES
+
+
+def copy_stream(rows, col_types):
+    # binary COPY data for rows of values, col_types: [(type oid, element oid), ...]
+
+    out = io.BytesIO()
+    out.write(COPY_HEADER)
+    nfields = struct.pack('>h', len(col_types))
+    for row in rows:
+        out.write(nfields)
+        for val, types in zip(row, col_types):
+            data = encode_value(val, types)
+            if data is None:
+                out.write(struct.pack('>i', -1))
+            else:
+                out.write(struct.pack('>i', len(data)))
+                out.write(data)
+    out.write(COPY_TRAILER)
+    out.seek(0)
+    return out
+
+
+def copy_rows(cur, table, columns, rows):
+    # send rows with binary COPY; False (nothing sent) if a column type has no binary encoder here
+
+    types = column_types(cur, table)
+    if any(col not in types or not supported(types[col]) for col in columns):
+        return False
+    stream = copy_stream(rows, [types[col] for col in columns])
+    cur.copy_expert(sql.SQL('COPY {} ({}) FROM STDIN (FORMAT binary)')
+                    .format(sql.Identifier(table), sql.SQL(', ').join(sql.Identifier(i) for i in columns)),
+                    stream)
+    return True
+
+
+def decode_array(buf, offset=0):
+    # numpy array of a binary array value without nulls; one copy into native byte order
+
+    ndim, has_null, elem_oid = struct.unpack_from('>iii', buf, offset)
+    if has_null:
+        raise ValueError('Arrays with NULL elements are not supported')
+    dtype = np.dtype(SCALAR_DTYPES[elem_oid])
+    if ndim == 0:
+        return np.empty(0, dtype=dtype.newbyteorder('='))
+    dims = np.frombuffer(buf, dtype='>i4', count=2 * ndim, offset=offset + 12).reshape(ndim, 2)
+    shape = tuple(int(i) for i in dims[:, 0])
+    count = int(np.prod(shape))
+    items = np.frombuffer(buf, dtype=[('len', '>i4'), ('val', dtype)], count=count, offset=offset + 12 + 8 * ndim)
+    if np.any(items['len'] != dtype.itemsize):
+        raise ValueError('Unexpected element length in binary array')
+
+    return items['val'].astype(dtype.newbyteorder('=')).reshape(shape)
+
+
+def decode_copy(buf):
+    # rows of field bytes (memoryviews, None for NULL) from a binary COPY stream
+
+    buf = memoryview(buf)
+    if bytes(buf[:len(COPY_SIGNATURE)]) != COPY_SIGNATURE:
+        raise ValueError('Not a binary COPY stream')
+    ext_len, = struct.unpack_from('>i', buf, len(COPY_SIGNATURE) + 4)
+    pos = len(COPY_SIGNATURE) + 8 + ext_len
+    rows = []
+    while True:
+        nfields, = struct.unpack_from('>h', buf, pos)
+        pos += 2
+        if nfields == -1:
+            return rows
+        row = []
+        for _ in range(nfields):
+            size, = struct.unpack_from('>i', buf, pos)
+            pos += 4
+            if size == -1:
+                row.append(None)
+            else:
+                row.append(buf[pos:pos + size])
+                pos += size
+        rows.append(row)
+
+
+def read_arrays(cur, table, column='val', key='h5id', keys=None):
+    # {key: numpy array} of an array column, fetched with binary COPY
+
+    query = sql.SQL('SELECT {}, {} FROM {}').format(sql.Identifier(key), sql.Identifier(column),
+                                                    sql.Identifier(table))
+    if keys is not None:
+        query = query + sql.SQL(' WHERE {} = ANY({})').format(
+            sql.Identifier(key), sql.Literal([int(i) for i in keys]))
+    out = io.BytesIO()
+    cur.copy_expert(sql.SQL('COPY ({}) TO STDOUT (FORMAT binary)').format(query), out)
+
+    key_type = column_types(cur, table)[key][0]
+    result = {}
+    for key_data, val_data in decode_copy(out.getbuffer()):
+        key_val = np.frombuffer(key_data, dtype=SCALAR_DTYPES[key_type])[0].item()
+        result[key_val] = None if val_data is None else decode_array(val_data)
+    return result
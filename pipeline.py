@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# producer/consumer ingest pipeline
+#
+# reader threads turn paths into parsed records, writer threads send them to
+# the database; the queue between them is bounded, so readers wait when the
+# writers fall behind and HDF5 reading overlaps with network I/O on one node
+
+import queue
+import threading
+
+
+_DONE = object()
+
+
+def run_pipeline(paths, read, write, readers=2, writers=2, queue_size=8):
+    # read(path) -> record runs in reader threads, write(record) in writer threads
+    # both should handle their own errors; an exception is printed and the item dropped
+
+    todo = queue.Queue()
+    for path in paths:
+        todo.put(path)
+    for _ in range(readers):
+        todo.put(_DONE)
+
+    parsed = queue.Queue(maxsize=queue_size)
+
+    def reader():
+        while True:
+            path = todo.get()
+            if path is _DONE:
+                return
+            try:
+                record = read(path)
+            except Exception as e:
+                print('Pipeline read failed for %s: %r' % (path, e))
+                continue
+            parsed.put(record)  # blocks while the writers are behind
+
+    def writer():
+        while True:
+            record = parsed.get()
+            if record is _DONE:
+                return
+            try:
+                write(record)
+            except Exception as e:
+                print('Pipeline write failed: %r' % e)
+
+    reader_threads = [threading.Thread(target=reader, name='reader-%s' % n, daemon=True) for n in range(readers)]
+    writer_threads = [threading.Thread(target=writer, name='writer-%s' % n, daemon=True) for n in range(writers)]
+    for thread in reader_threads + writer_threads:
+        thread.start()
+
+    for thread in reader_threads:
+        thread.join()
+    for _ in range(writers):
+        parsed.put(_DONE)
+    for thread in writer_threads:
+        thread.join()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+# pre-flight check of a batch against the database
+#
+# file names are looked up set-wise (one query per chunk and table) so files
+# that are already ingested are dropped before any HDF5/GeoTIFF is opened
+
+import os
+from psycopg2 import sql
+
+
+CHUNK_SIZE = 5000
+
+# file extension -> table holding files of that kind
+FILE_TABLES = {
+    '.h5': 'info_file_hdf5',
+    '.tif': 'info_file_raster',
+}
+
+
+def known_fnames(conn, table, fnames, chunk_size=CHUNK_SIZE):
+    # subset of fnames already present in table
+
+    known = set()
+    cur = conn.cursor()
+    try:
+        for start in range(0, len(fnames), chunk_size):
+            chunk = fnames[start:start + chunk_size]
+            cur.execute(sql.SQL('SELECT fname FROM {} WHERE fname = ANY(%s)')
+                        .format(sql.Identifier(table)),
+                        (chunk,))
+            known.update(row[0] for row in cur.fetchall())
+    finally:
+        cur.close()
+    conn.rollback()  # read only, do not leave the connection idle in transaction
+
+    return known
+
+
+def filter_new_files(conn, paths, chunk_size=CHUNK_SIZE):
+    # split paths into (new, known), preserving order; files are matched on fname
+
+    by_table = {}
+    for path in paths:
+        table = FILE_TABLES.get(os.path.splitext(path)[1])
+        if table is not None:
+            by_table.setdefault(table, []).append(os.path.basename(path))
+
+    known = set()
+    for table, fnames in by_table.items():
+        known.update((table, fname) for fname in known_fnames(conn, table, fnames, chunk_size))
+
+    new_paths = []
+    known_paths = []
+    for path in paths:
+        table = FILE_TABLES.get(os.path.splitext(path)[1])
+        if (table, os.path.basename(path)) in known:
+            known_paths.append(path)
+        else:
+            new_paths.append(path)
+
+    return new_paths, known_paths
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+# in-process replacement for "raster2pgsql -R <file>"
+#
+# only the GeoTIFF header is read (size, bands, pixel type, nodata,
+# geotransform, EPSG code) and the PostGIS out-db raster is encoded directly,
+# with the layout raster2pgsql writes for an untiled out-db raster:
+#
+#   endian(1) version(2) nbands(2) scalex scaley ipx ipy skewx skewy (8 each)
+#   srid(4) width(2) height(2)
+#   per band: flags(1) nodata(pixel size) bandnum(1) path(null terminated)
+
+import math
+import os
+import struct
+
+
+# tiff tags used here
+TAG_IMAGE_WIDTH = 256
+TAG_IMAGE_LENGTH = 257
+TAG_BITS_PER_SAMPLE = 258
+TAG_COMPRESSION = 259
+TAG_STRIP_OFFSETS = 273
+TAG_SAMPLES_PER_PIXEL = 277
+TAG_ROWS_PER_STRIP = 278
+TAG_STRIP_BYTE_COUNTS = 279
+TAG_PLANAR_CONFIG = 284
+TAG_PREDICTOR = 317
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_TILE_BYTE_COUNTS = 325
+TAG_SAMPLE_FORMAT = 339
+TAG_MODEL_PIXEL_SCALE = 33550
+TAG_MODEL_TIEPOINT = 33922
+TAG_MODEL_TRANSFORMATION = 34264
+TAG_GEO_KEY_DIRECTORY = 34735
+TAG_GDAL_NODATA = 42113
+
+# geo keys
+GEO_KEY_RASTER_TYPE = 1025
+GEO_KEY_GEOGRAPHIC_TYPE = 2048
+GEO_KEY_PROJECTED_CS_TYPE = 3072
+RASTER_PIXEL_IS_POINT = 2
+USER_DEFINED = 32767
+
+# tiff field type -> struct format and size
+FIELD_TYPES = {
+    1: ('B', 1), 2: ('c', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 6: ('b', 1), 7: ('B', 1),
+    8: ('h', 2), 9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8), 16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8),
+}
+
+# (sample format, bits per sample) -> (PostGIS pixel type id, struct format)
+# sample format 1 = unsigned int, 2 = signed int, 3 = float
+PIXEL_TYPES = {
+    (1, 8): (4, 'B'),     # 8BUI
+    (2, 8): (3, 'b'),     # 8BSI
+    (1, 16): (6, 'H'),    # 16BUI
+    (2, 16): (5, 'h'),    # 16BSI
+    (1, 32): (8, 'I'),    # 32BUI
+    (2, 32): (7, 'i'),    # 32BSI
+    (3, 32): (10, 'f'),   # 32BF
+    (3, 64): (11, 'd'),   # 64BF
+}
+
+BAND_IS_OFFLINE = 0x80
+BAND_HAS_NODATA = 0x40
+# largest finite 32 bit float
+FLOAT_MAX = struct.unpack('<f', b'\xff\xff\x7f\x7f')[0]
+
+SRID_UNKNOWN = 0
+
+
+class TiffHeader:
+    # tags of the first image file directory; values are read on demand
+
+    def __init__(self, path):
+
+        self.path = path
+        self.entries = {}
+        with open(path, 'rb') as f:
+            self._f = f
+            self._read_ifd()
+            self.width = self.value(TAG_IMAGE_WIDTH)[0]
+            self.height = self.value(TAG_IMAGE_LENGTH)[0]
+            self.bands = self.value(TAG_SAMPLES_PER_PIXEL, [1])[0]
+            self.bits = self.value(TAG_BITS_PER_SAMPLE, [1])[0]
+            self.sample_format = self.value(TAG_SAMPLE_FORMAT, [1])[0]
+            self.nodata = self._read_nodata()
+            self.geotransform = self._read_geotransform()
+            self.srid = self._read_srid()
+            self._f = None
+
+    def _read_ifd(self):
+
+        f = self._f
+        order = f.read(2)
+        if order == b'II':
+            self.endian = '<'
+        elif order == b'MM':
+            self.endian = '>'
+        else:
+            raise ValueError('Not a TIFF file: %s' % self.path)
+
+        magic, = struct.unpack(self.endian + 'H', f.read(2))
+        if magic == 42:
+            self.bigtiff = False
+            offset, = struct.unpack(self.endian + 'I', f.read(4))
+            count_fmt, entry_fmt, entry_size, inline = 'H', 'HHI', 12, 4
+        elif magic == 43:
+            self.bigtiff = True
+            f.read(4)  # offset byte size and padding
+            offset, = struct.unpack(self.endian + 'Q', f.read(8))
+            count_fmt, entry_fmt, entry_size, inline = 'Q', 'HHQ', 20, 8
+        else:
+            raise ValueError('Not a TIFF file: %s' % self.path)
+
+        f.seek(offset)
+        count, = struct.unpack(self.endian + count_fmt, f.read(struct.calcsize(count_fmt)))
+        data = f.read(count * entry_size)
+        head_size = struct.calcsize(self.endian + entry_fmt)
+        for n in range(count):
+            entry = data[n * entry_size:(n + 1) * entry_size]
+            tag, ftype, nval = struct.unpack(self.endian + entry_fmt, entry[:head_size])
+            self.entries[tag] = (ftype, nval, entry[head_size:head_size + inline])
+
+    def value(self, tag, default=None):
+        # tag values as a tuple (a str for ASCII tags)
+
+        if tag not in self.entries:
+            return default
+        ftype, nval, raw = self.entries[tag]
+        fmt, size = FIELD_TYPES[ftype]
+        nbytes = size * nval
+        if nbytes > len(raw):
+            offset_fmt = 'Q' if self.bigtiff else 'I'
+            offset, = struct.unpack(self.endian + offset_fmt, raw)
+            if self._f is None:
+                with open(self.path, 'rb') as f:
+                    f.seek(offset)
+                    raw = f.read(nbytes)
+            else:
+                self._f.seek(offset)
+                raw = self._f.read(nbytes)
+        raw = raw[:nbytes]
+
+        if ftype == 2:
+            return raw.split(b'\0')[0].decode('ascii', 'replace')
+        vals = struct.unpack(self.endian + fmt * nval, raw)
+        if ftype in (5, 10):
+            vals = tuple(vals[i] / vals[i + 1] for i in range(0, len(vals), 2))
+        return vals
+
+    def _read_nodata(self):
+
+        text = self.value(TAG_GDAL_NODATA)
+        if text is None or text.strip() == '':
+            return None
+        return float(text.strip())
+
+    def geo_keys(self):
+
+        keys = {}
+        directory = self.value(TAG_GEO_KEY_DIRECTORY)
+        if directory is None:
+            return keys
+        nkeys = directory[3]
+        for n in range(nkeys):
+            key_id, location, count, val = directory[4 + n * 4:8 + n * 4]
+            if location == 0:
+                keys[key_id] = val
+        return keys
+
+    def _read_geotransform(self):
+        # gdal order: (ulx, xres, xskew, uly, yskew, yres)
+
+        matrix = self.value(TAG_MODEL_TRANSFORMATION)
+        if matrix is not None:
+            gt = [matrix[3], matrix[0], matrix[1], matrix[7], matrix[4], matrix[5]]
+        else:
+            scale = self.value(TAG_MODEL_PIXEL_SCALE)
+            tie = self.value(TAG_MODEL_TIEPOINT)
+            if scale is None or tie is None:
+                return (0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+            i, j, k, x, y, z = tie[:6]
+            gt = [x - i * scale[0], scale[0], 0.0, y + j * scale[1], 0.0, -scale[1]]
+
+        # gdal reports pixel-is-point rasters by their corner, shifted half a pixel
+        if self.geo_keys().get(GEO_KEY_RASTER_TYPE) == RASTER_PIXEL_IS_POINT:
+            gt[0] -= 0.5 * gt[1] + 0.5 * gt[2]
+            gt[3] -= 0.5 * gt[4] + 0.5 * gt[5]
+
+        return tuple(gt)
+
+    def _read_srid(self):
+
+        keys = self.geo_keys()
+        for key in (GEO_KEY_PROJECTED_CS_TYPE, GEO_KEY_GEOGRAPHIC_TYPE):
+            code = keys.get(key)
+            if code is not None and code != USER_DEFINED:
+                return code
+        return SRID_UNKNOWN
+
+    def pixel_type(self):
+
+        # gdal reads 1, 2 and 4 bit images as bytes
+        bits = 8 if self.sample_format == 1 and self.bits < 8 else self.bits
+        try:
+            return PIXEL_TYPES[(self.sample_format, bits)]
+        except KeyError:
+            raise ValueError('Unsupported pixel type (format %s, %s bits): %s' %
+                             (self.sample_format, self.bits, self.path))
+
+
+def raster_header_wkb(header, srid=None):
+    # raster header without bands, little endian, WKB version 0
+
+    if header.width > 65535 or header.height > 65535:
+        raise ValueError('Raster too large for a single tile: %s' % header.path)
+    ulx, xres, xskew, uly, yskew, yres = header.geotransform
+    if srid is None:
+        srid = header.srid
+
+    return struct.pack('<BHHddddddiHH', 1, 0, header.bands,
+                       xres, yres, ulx, uly, xskew, yskew,
+                       srid, header.width, header.height)
+
+
+def nodata_value(nodata, fmt):
+    # the nodata value a band of struct format fmt stores, None for none
+    # like raster2pgsql: clamped to the pixel type, integers truncated, nan on an integer band is no nodata
+
+    if nodata is None:
+        return None
+    if fmt == 'd':
+        return nodata
+    if fmt == 'f':
+        return nodata if math.isinf(nodata) else min(max(nodata, -FLOAT_MAX), FLOAT_MAX)
+    if math.isnan(nodata):
+        return None
+    bits = 8 * struct.calcsize(fmt)
+    low, high = (0, 2 ** bits - 1) if fmt.isupper() else (-2 ** (bits - 1), 2 ** (bits - 1) - 1)
+    return int(min(max(nodata, low), high))
+
+
+def band_flags(header, offline):
+
+    pixtype, fmt = header.pixel_type()
+    nodata = nodata_value(header.nodata, fmt)
+    flags = pixtype
+    if offline:
+        flags |= BAND_IS_OFFLINE
+    if nodata is not None:
+        flags |= BAND_HAS_NODATA
+
+    return struct.pack('<B' + fmt, flags, nodata if nodata is not None else 0)
+
+
+def out_db_wkb(path, srid=None):
+    # PostGIS out-db raster for a GeoTIFF, as raster2pgsql -R writes it
+
+    # raster2pgsql stores the resolved absolute path of the file
+    path = os.path.realpath(path)
+    header = TiffHeader(path)
+    parts = [raster_header_wkb(header, srid)]
+    for band in range(header.bands):
+        parts.append(band_flags(header, offline=True))
+        parts.append(struct.pack('<B', band))
+        parts.append(path.encode('utf-8') + b'\0')
+
+    return b''.join(parts)
+
+
+def get_raster_od_hex(path, srid=None):
+    # upper case hex, as found in the raster2pgsql INSERT statement
+    return out_db_wkb(path, srid).hex().upper()
+
+
+# PostGIS pixel type id -> bytes of the band nodata value
+PIXEL_SIZES = {0: 1, 1: 1, 2: 1, 3: 1, 4: 1, 5: 2, 6: 2, 7: 4, 8: 4, 10: 4, 11: 8}
+HEADER_SIZE = 61
+
+
+def split_out_db(wkb):
+    # (raster header, [(band flags and nodata, band number, path), ...]) of an out-db raster
+    # as out_db_wkb writes it
+
+    if wkb[0] != 1:
+        raise ValueError('Only little endian raster WKB is supported')
+    nbands, = struct.unpack_from('<H', wkb, 3)
+    pos = HEADER_SIZE
+    bands = []
+    for _ in range(nbands):
+        flags = wkb[pos]
+        if not flags & BAND_IS_OFFLINE:
+            raise ValueError('Not an out-db raster band')
+        head = wkb[pos:pos + 1 + PIXEL_SIZES[flags & 0x0F]]
+        pos += len(head)
+        bandnum = wkb[pos]
+        end = wkb.index(b'\0', pos + 1)
+        bands.append((head, bandnum, wkb[pos + 1:end].decode('utf-8')))
+        pos = end + 1
+
+    return wkb[:HEADER_SIZE], bands
+
+
+def join_out_db(header, bands):
+    return header + b''.join(head + struct.pack('<B', bandnum) + path.encode('utf-8') + b'\0'
+                             for head, bandnum, path in bands)
+
+
+def relink_out_db(wkb, path):
+    # the same out-db raster pointing at path; the file is not opened
+    # (raster2pgsql stores resolved paths, os.path.realpath only looks at symlinks)
+
+    header, bands = split_out_db(wkb)
+    path = os.path.realpath(path)
+    return join_out_db(header, [(head, bandnum, path) for head, bandnum, _ in bands])
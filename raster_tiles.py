@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+# in-db raster import: GeoTIFF tiles streamed into a tile table with COPY
+#
+# the out-db registration (raster_od.py) only points at the file. for products
+# analysed in the database (.srade9., .dspace_rad.) the pixels are loaded as
+# in-db raster tiles of tile_width x tile_height pixels, one row per tile in
+#
+#   raster_tile (rastid, tile_row, tile_col, rast)
+#
+# linked to info_file_raster by rastid. the GeoTIFF strips or tiles are read
+# and decoded here (uncompressed or deflate, optional horizontal predictor)
+# one band of tile rows at a time, and every tile is encoded as PostGIS
+# raster WKB straight into the COPY stream, so neither the full raster nor
+# the SQL text of all tiles is ever held in memory. edge tiles are cut to the
+# raster size, as raster2pgsql -t does without -P.
+
+import struct
+import zlib
+
+import numpy as np
+from psycopg2 import sql
+
+import raster_od
+import instrument
+
+
+TILE_TABLE = 'raster_tile'
+TILE_SIZE = (256, 256)
+# raster contents loaded in-db when asked for without a list
+IN_DB_CONTENT = ('srade9', 'dspace_rad')
+
+TILE_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS {table} (
+    rastid integer NOT NULL REFERENCES {rasters} (rastid) ON DELETE CASCADE,
+    tile_row integer NOT NULL,
+    tile_col integer NOT NULL,
+    rast raster NOT NULL,
+    PRIMARY KEY (rastid, tile_row, tile_col)
+)'''
+
+COMPRESSION_NONE = 1
+COMPRESSION_DEFLATE = (8, 32946)
+PREDICTOR_NONE = 1
+PREDICTOR_HORIZONTAL = 2
+PLANAR_SEPARATE = 2
+
+# bytes read from the COPY stream at a time
+COPY_BUFFER = 1 << 20
+# compressed bytes read from a strip or tile at a time
+READ_SIZE = 1 << 16
+
+
+def create_tile_table(conn):
+
+    cur = conn.cursor()
+    try:
+        cur.execute(sql.SQL(TILE_TABLE_SQL).format(table=sql.Identifier(TILE_TABLE),
+                                                   rasters=sql.Identifier('info_file_raster')))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+class BlockStream:
+    # the decoded bytes of one strip or tile, read and inflated as they are asked for
+
+    def __init__(self, f, offset, size, compressed):
+
+        self._f = f
+        self._pos = offset
+        self._left = size
+        self._inflate = zlib.decompressobj() if compressed else None
+        self._buf = bytearray()
+
+    def read(self, n):
+
+        while len(self._buf) < n:
+            if self._inflate is not None and self._inflate.unconsumed_tail:
+                raw = self._inflate.unconsumed_tail
+            else:
+                if self._left <= 0:
+                    break
+                # the file is shared with the other blocks of the row
+                self._f.seek(self._pos)
+                raw = self._f.read(min(READ_SIZE, self._left))
+                if len(raw) == 0:
+                    break
+                self._pos += len(raw)
+                self._left -= len(raw)
+                instrument.count('tiff_bytes', len(raw))
+            if self._inflate is not None:
+                self._buf += self._inflate.decompress(raw, max(n - len(self._buf), READ_SIZE))
+            else:
+                self._buf += raw
+        out = bytes(self._buf[:n])
+        del self._buf[:n]
+        return out
+
+
+class TiffReader(raster_od.TiffHeader):
+    # pixel rows of the first image, decoded from its strips or tiles
+    #
+    # rows are read top to bottom: the blocks of the current block row are kept
+    # open as BlockStreams, so every strip or tile is read and inflated once and
+    # only the rows asked for are decoded, even for one strip of the whole image
+
+    def __init__(self, path):
+
+        super().__init__(path)
+        self.compression = self.value(raster_od.TAG_COMPRESSION, [COMPRESSION_NONE])[0]
+        if self.compression != COMPRESSION_NONE and self.compression not in COMPRESSION_DEFLATE:
+            raise ValueError('Unsupported TIFF compression %s: %s' % (self.compression, path))
+        self.predictor = self.value(raster_od.TAG_PREDICTOR, [PREDICTOR_NONE])[0]
+        if self.predictor not in (PREDICTOR_NONE, PREDICTOR_HORIZONTAL):
+            raise ValueError('Unsupported TIFF predictor %s: %s' % (self.predictor, path))
+        if self.bits not in (8, 16, 32, 64):
+            raise ValueError('Unsupported bits per sample %s: %s' % (self.bits, path))
+        self.planar = self.value(raster_od.TAG_PLANAR_CONFIG, [1])[0] == PLANAR_SEPARATE and self.bands > 1
+        self.dtype = np.dtype(self.endian + self.pixel_type()[1])
+
+        if raster_od.TAG_TILE_WIDTH in self.entries:
+            self.block_width = self.value(raster_od.TAG_TILE_WIDTH)[0]
+            self.block_height = self.value(raster_od.TAG_TILE_LENGTH)[0]
+            self.offsets = self.value(raster_od.TAG_TILE_OFFSETS)
+            self.byte_counts = self.value(raster_od.TAG_TILE_BYTE_COUNTS)
+        else:
+            self.block_width = self.width
+            self.block_height = min(self.value(raster_od.TAG_ROWS_PER_STRIP, [self.height])[0], self.height)
+            self.offsets = self.value(raster_od.TAG_STRIP_OFFSETS)
+            self.byte_counts = self.value(raster_od.TAG_STRIP_BYTE_COUNTS)
+        self.blocks_across = -(-self.width // self.block_width)
+        self.blocks_down = -(-self.height // self.block_height)
+        self.samples = 1 if self.planar else self.bands
+        self.row_size = self.block_width * self.samples * self.dtype.itemsize
+        self._f = open(path, 'rb')
+        # block row whose streams are open, streams[across][plane], rows of it consumed
+        self._down = None
+        self._streams = None
+        self._next = 0
+
+    def close(self):
+
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        self._streams = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _start(self, down, row):
+        # position the streams of block row down at its row; only a step back reopens them
+
+        if self._down != down or row < self._next:
+            planes = self.bands if self.planar else 1
+            streams = []
+            for across in range(self.blocks_across):
+                streams.append([])
+                for plane in range(planes):
+                    index = (plane * self.blocks_down + down) * self.blocks_across + across
+                    streams[-1].append(BlockStream(self._f, self.offsets[index], self.byte_counts[index],
+                                                   self.compression != COMPRESSION_NONE))
+            self._down = down
+            self._streams = streams
+            self._next = 0
+        if row > self._next:
+            for planes in self._streams:
+                for stream in planes:
+                    stream.read((row - self._next) * self.row_size)
+            self._next = row
+
+    def _rows(self, across, plane, count):
+        # (count, block_width, samples) of the next rows of a block; the predictor works row by row
+
+        data = self._streams[across][plane].read(count * self.row_size)
+        rows = len(data) // self.row_size
+        block = np.frombuffer(data, dtype=self.dtype, count=rows * self.block_width * self.samples)
+        block = block.reshape(rows, self.block_width, self.samples)
+        if self.predictor == PREDICTOR_HORIZONTAL:
+            # libtiff differences the sample words as integers, floats included
+            words = np.dtype(self.endian + 'u%d' % self.dtype.itemsize)
+            block = np.cumsum(block.view(words), axis=1, dtype=words).view(self.dtype)
+        return block
+
+    def read_rows(self, top, count):
+        # (bands, count, width) array of image rows top .. top + count, native byte order
+
+        count = min(count, self.height - top)
+        out = np.empty((self.bands, count, self.width), dtype=self.dtype.newbyteorder('='))
+        first = top // self.block_height
+        last = (top + count - 1) // self.block_height
+        for down in range(first, last + 1):
+            block_top = down * self.block_height
+            y0 = max(top, block_top)
+            y1 = min(top + count, block_top + self.block_height, self.height)
+            self._start(down, y0 - block_top)
+            for across in range(self.blocks_across):
+                x0 = across * self.block_width
+                x1 = min(x0 + self.block_width, self.width)
+                for plane in range(self.bands if self.planar else 1):
+                    part = self._rows(across, plane, y1 - y0)[:, :x1 - x0]
+                    if self.planar:
+                        out[plane, y0 - top:y1 - top, x0:x1] = part[:, :, 0]
+                    else:
+                        out[:, y0 - top:y1 - top, x0:x1] = np.moveaxis(part, -1, 0)
+            self._next = y1 - block_top
+        return out
+
+
+def tile_wkb(reader, pixels, x0, y0, srid=None):
+    # in-db raster WKB of pixels (bands, rows, cols) whose upper left pixel is (x0, y0) of the image
+
+    ulx, xres, xskew, uly, yskew, yres = reader.geotransform
+    bands, height, width = pixels.shape
+    header = struct.pack('<BHHddddddiHH', 1, 0, bands, xres, yres,
+                         ulx + x0 * xres + y0 * xskew, uly + x0 * yskew + y0 * yres, xskew, yskew,
+                         reader.srid if srid is None else srid, width, height)
+    flags = raster_od.band_flags(reader, offline=False)
+    little = pixels.astype(pixels.dtype.newbyteorder('<'), copy=False)
+    return header + b''.join(flags + np.ascontiguousarray(little[band]).tobytes() for band in range(bands))
+
+
+def iter_tiles(reader, tile_size=TILE_SIZE, srid=None):
+    # (tile_row, tile_col, WKB) of every tile, one band of tile rows read at a time
+
+    tile_width, tile_height = tile_size
+    for tile_row, top in enumerate(range(0, reader.height, tile_height)):
+        rows = reader.read_rows(top, tile_height)
+        for tile_col, left in enumerate(range(0, reader.width, tile_width)):
+            yield tile_row, tile_col, tile_wkb(reader, rows[:, :, left:left + tile_width], left, top, srid)
+
+
+class CopyStream:
+    # file-like object for copy_expert, producing COPY text lines from an iterator on demand
+
+    def __init__(self, lines):
+
+        self._lines = iter(lines)
+        self._buf = bytearray()
+
+    def read(self, size=-1):
+
+        if size is None or size < 0:
+            size = COPY_BUFFER
+        while len(self._buf) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buf += line
+        out = bytes(self._buf[:size])
+        del self._buf[:size]
+        return out
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def copy_tiles(cur, rastid, path, tile_size=TILE_SIZE, srid=None):
+    # COPY the tiles of a GeoTIFF into the tile table on cur's transaction; returns the tile count
+
+    count = [0]
+
+    def lines(reader):
+        for tile_row, tile_col, wkb in iter_tiles(reader, tile_size, srid):
+            count[0] += 1
+            yield b'%d\t%d\t%d\t%s\n' % (rastid, tile_row, tile_col, wkb.hex().upper().encode('ascii'))
+
+    with TiffReader(path) as reader:
+        cur.copy_expert(sql.SQL('COPY {} (rastid, tile_row, tile_col, rast) FROM STDIN')
+                        .format(sql.Identifier(TILE_TABLE)), CopyStream(lines(reader)), size=COPY_BUFFER)
+    instrument.count('raster_tiles', count[0])
+    return count[0]
+
+
+def decode_tile(wkb):
+    # (geotransform, srid, (bands, rows, cols) array) of an in-db raster WKB, e.g. to check a load
+
+    (endian, version, bands, xres, yres, ulx, uly, xskew, yskew,
+     srid, width, height) = struct.unpack_from('<BHHddddddiHH', wkb, 0)
+    if endian != 1:
+        raise ValueError('Only little endian raster WKB is supported')
+    pos = raster_od.HEADER_SIZE
+    out = []
+    for _ in range(bands):
+        pixtype = wkb[pos] & 0x0F
+        if wkb[pos] & raster_od.BAND_IS_OFFLINE:
+            raise ValueError('Not an in-db raster band')
+        fmt = [fmt for ptype, fmt in raster_od.PIXEL_TYPES.values() if ptype == pixtype][0]
+        pos += 1 + raster_od.PIXEL_SIZES[pixtype]
+        dtype = np.dtype('<' + fmt)
+        out.append(np.frombuffer(wkb, dtype=dtype, count=width * height, offset=pos).reshape(height, width))
+        pos += width * height * dtype.itemsize
+
+    return (ulx, xres, xskew, uly, yskew, yres), srid, np.stack(out)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+# bulk relink of ingested files after an archive moved
+#
+#   ./relink.py --server eogdev --map /data/viirs /mnt/archive/viirs     (old prefix -> new prefix)
+#   ./relink.py --server eogdev --paths moved.txt                        (new path of each file, one per line)
+#
+# files are matched on fname. new links (and, for rasters, the out-db raster
+# with its band paths rewritten) are COPYed into a temp table and applied with
+# one UPDATE ... FROM per table and chunk, each chunk in its own transaction.
+# no data file is opened: the raster header stays as ingested, unless
+# --verify-rasters reads the TIFF header at the new path and re-encodes the
+# rasters whose header changed.
+
+import argparse
+import io
+import os
+import sys
+
+from psycopg2 import sql
+
+from import_to_db import DBInfo
+from copy_stage import copy_line
+import catalog
+import raster_od
+
+
+CHUNK_SIZE = 50000
+
+# table -> staged columns (fname first); the temp tables keep their rows for the session only
+RELINK_TABLES = {
+    'info_file_hdf5': ('fname', 'link'),
+    'info_file_raster': ('fname', 'link', 'rast'),
+}
+
+
+def dir_prefix(prefix):
+    # prefixes are directories: /data/viirs matches /data/viirs/... but not /data/viirs2/...
+
+    return prefix.rstrip('/') + '/'
+
+
+def like_prefix(prefix):
+    # LIKE pattern of paths under the directory prefix
+
+    prefix = dir_prefix(prefix)
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def map_prefix(link, prefixes):
+    # link with the first matching old directory prefix replaced, None if none matches
+
+    for old, new in prefixes:
+        old = dir_prefix(old)
+        if link.startswith(old):
+            return dir_prefix(new) + link[len(old):]
+    return None
+
+
+def _stage_table(table):
+    return 'relink_' + table
+
+
+class Relinker:
+
+    def __init__(self, conn, chunk_size=CHUNK_SIZE, verify_rasters=False, dry_run=False):
+
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.verify_rasters = verify_rasters
+        self.dry_run = dry_run
+        self.counts = {'staged': 0, 'updated': 0, 'unchanged': 0, 'reencoded': 0, 'no_rast': 0, 'duplicates': 0}
+        self._created = False
+
+    def _create_stage_tables(self, cur):
+
+        if self._created:
+            return
+        for table, columns in RELINK_TABLES.items():
+            cur.execute(sql.SQL('CREATE TEMP TABLE IF NOT EXISTS {} ON COMMIT DELETE ROWS AS '
+                                'SELECT {} FROM {} WITH NO DATA')
+                        .format(sql.Identifier(_stage_table(table)),
+                                sql.SQL(', ').join(sql.Identifier(i) for i in columns), sql.Identifier(table)))
+        self.conn.commit()
+        self._created = True
+
+    def new_rast(self, fname, rast, link):
+        # stored out-db raster (hex) pointing at link; a file without raster only gets its link
+
+        if rast is None:
+            self.counts['no_rast'] += 1
+            print('No raster stored for %s, only its link is updated' % fname)
+            return None
+        wkb = bytes.fromhex(rast)
+        relinked = raster_od.relink_out_db(wkb, link)
+        if self.verify_rasters:
+            fresh = raster_od.out_db_wkb(link)
+            if fresh != relinked:
+                self.counts['reencoded'] += 1
+                relinked = fresh
+        return relinked.hex().upper()
+
+    def apply(self, table, rows):
+        # stage rows (in RELINK_TABLES order) and update the matching files in one transaction
+
+        # one staged row per file, the last one given wins; duplicates would make the UPDATE ambiguous
+        unique = {}
+        for row in rows:
+            unique[row[0]] = row
+        if len(unique) < len(rows):
+            self.counts['duplicates'] += len(rows) - len(unique)
+            print('%s: %s duplicate file names dropped' % (table, len(rows) - len(unique)))
+            rows = list(unique.values())
+        if len(rows) == 0:
+            return 0
+        cur = self.conn.cursor()
+        try:
+            self._create_stage_tables(cur)
+            columns = RELINK_TABLES[table]
+            data = io.StringIO(''.join(copy_line(row) for row in rows))
+            cur.copy_expert(sql.SQL('COPY {} ({}) FROM STDIN').format(
+                sql.Identifier(_stage_table(table)), sql.SQL(', ').join(sql.Identifier(i) for i in columns)), data)
+            sets = sql.SQL(', ').join(sql.SQL('{} = {}').format(sql.Identifier(i), sql.Identifier('s', i))
+                                      for i in columns[1:])
+            # rasters are compared as bytes, raster = only compares bounding boxes
+            changed = sql.SQL(' OR ').join(sql.SQL('{}::bytea IS DISTINCT FROM {}::bytea' if i == 'rast' else
+                                                   '{} IS DISTINCT FROM {}').format(
+                sql.Identifier('t', i), sql.Identifier('s', i)) for i in columns[1:])
+            cur.execute(sql.SQL('UPDATE {target} t SET {sets} FROM {stage} s '
+                                'WHERE t.fname = s.fname AND ({changed})')
+                        .format(target=sql.Identifier(table), sets=sets, stage=sql.Identifier(_stage_table(table)),
+                                changed=changed))
+            updated = cur.rowcount
+            if self.dry_run:
+                self.conn.rollback()
+            else:
+                self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+        self.counts['staged'] += len(rows)
+        self.counts['updated'] += updated
+        print('%s: %s staged, %s updated' % (table, len(rows), updated))
+        return updated
+
+    def relink_prefixes(self, read_conn, prefixes):
+        # files whose link starts with an old prefix; read_conn streams them while self.conn writes
+
+        for table, columns in RELINK_TABLES.items():
+            where = sql.SQL('({})').format(sql.SQL(' OR ').join(
+                sql.SQL('{} LIKE %s').format(sql.Identifier('f', 'link')) for _ in prefixes))
+            query = catalog.select(table, 'f', columns, [where], order_by=('fname',))
+            params = [like_prefix(old) for old, _ in prefixes]
+
+            chunk = []
+            for rows in catalog.stream(read_conn, query, params, self.chunk_size):
+                for row in rows:
+                    link = map_prefix(row.link, prefixes)
+                    if link is None or link == row.link:
+                        self.counts['unchanged'] += 1
+                        continue
+                    if table == 'info_file_raster':
+                        chunk.append((row.fname, link, self.new_rast(row.fname, row.rast, link)))
+                    else:
+                        chunk.append((row.fname, link))
+                    if len(chunk) >= self.chunk_size:
+                        self.apply(table, chunk)
+                        chunk = []
+            self.apply(table, chunk)
+
+    def relink_paths(self, paths):
+        # new locations of files, matched by file name; rasters need their stored out-db raster
+
+        hdf5 = []
+        rasters = []
+        for path in paths:
+            link = os.path.abspath(path)
+            if path.endswith('.h5'):
+                hdf5.append((os.path.basename(path), link))
+                if len(hdf5) >= self.chunk_size:
+                    self.apply('info_file_hdf5', hdf5)
+                    hdf5 = []
+            elif path.endswith('.tif'):
+                rasters.append((os.path.basename(path), link))
+                if len(rasters) >= self.chunk_size:
+                    self._relink_rasters(rasters)
+                    rasters = []
+        self.apply('info_file_hdf5', hdf5)
+        self._relink_rasters(rasters)
+
+    def _relink_rasters(self, rasters):
+
+        if len(rasters) == 0:
+            return
+        cur = self.conn.cursor()
+        try:
+            cur.execute(sql.SQL('SELECT fname, rast FROM {} WHERE fname = ANY(%s)')
+                        .format(sql.Identifier('info_file_raster')), ([i[0] for i in rasters],))
+            stored = dict(cur.fetchall())
+        finally:
+            cur.close()
+        self.conn.rollback()
+
+        rows = [(fname, link, self.new_rast(fname, stored[fname], link)) for fname, link in rasters
+                if fname in stored]
+        self.apply('info_file_raster', rows)
+
+
+def read_paths(path):
+    # lines of a path list, lazily
+
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line != '' and not line.startswith('#'):
+                yield line
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Rewrite the links of ingested files after a move.')
+    parser.add_argument('--server', default='eogdev')
+    parser.add_argument('--map', nargs=2, action='append', default=[], metavar=('OLD', 'NEW'),
+                        help='replace the path prefix OLD by NEW, may be repeated')
+    parser.add_argument('--paths', default=None, help='text file with the new path of each file')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--verify-rasters', action='store_true',
+                        help='read the TIFF header at the new path and re-encode rasters whose header changed')
+    parser.add_argument('--dry-run', action='store_true', help='count the changes, roll every chunk back')
+    args = parser.parse_args(argv)
+
+    if (len(args.map) == 0) == (args.paths is None):
+        parser.error('give either --map or --paths')
+
+    db_info = DBInfo()
+    conn = db_info.make_con(args.server)
+    try:
+        relinker = Relinker(conn, args.chunk_size, args.verify_rasters, args.dry_run)
+        if args.paths is not None:
+            relinker.relink_paths(read_paths(args.paths))
+        else:
+            read_conn = db_info.make_con(args.server)
+            try:
+                relinker.relink_prefixes(read_conn, [tuple(i) for i in args.map])
+            finally:
+                read_conn.close()
+    finally:
+        conn.close()
+
+    counts = relinker.counts
+    print('Relink%s: %s staged, %s updated, %s unchanged, %s rasters re-encoded, %s without raster, '
+          '%s duplicates dropped.' %
+          (' (dry run)' if args.dry_run else '', counts['staged'], counts['updated'], counts['unchanged'],
+           counts['reencoded'], counts['no_rast'], counts['duplicates']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())